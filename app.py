@@ -2,13 +2,33 @@
 FUNDEB Fácil - Sistema Inteligente para Projeção de Complementações Orçamentárias
 MVP para Prêmio SOF 2025
 """
+import importlib
+import os
+import sys
+import time
+
+from metricas import METRICAS, medir, registrar
+
+# Carga dos módulos só na primeira execução do processo (nas seguintes já estão em sys.modules)
+_inicio_importacoes = time.perf_counter()
+_primeira_carga = 'calculadora' not in sys.modules
+
 import streamlit as st
-import json
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
-from calculadora import CalculadoraFUNDEB, formatar_moeda, formatar_numero
-from chat_agent import ChatAgentFUNDEB
+import base_municipios
+from base_municipios import ETAPAS
+from calculadora import CalculadoraFUNDEB, formatar_moeda
+from projecao import ProjecaoPlurianual
+from cache_resultados import CacheResultados
+from cubo import FAIXAS_POPULACAO, CuboAgregado
+from ferramentas_chat import FerramentasCalculadora
+from tabelas import TabelaPaginada
+import graficos
+
+if _primeira_carga:
+    registrar('app.importacoes', time.perf_counter() - _inicio_importacoes)
 
 
 # Configuração da página
@@ -59,105 +79,183 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-@st.cache_data
+@st.cache_resource
 def carregar_municipios():
-    """Carrega dados dos municípios"""
-    with open('dados/municipios.json', 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """Carrega dados dos municípios (base colunar mapeada em memória, compartilhada)"""
+    return base_municipios.carregar_municipios('dados/municipios.json')
+
+
+@st.cache_resource
+def rotulos_municipios():
+    """Rótulos 'Nome - UF' da seleção de município, na ordem da base"""
+    base = carregar_municipios()
+    return [f"{nome} - {uf}" for nome, uf in zip(base.colunas['nome'].tolist(), base.siglas_uf.tolist())]
 
 
 @st.cache_resource
 def inicializar_calculadora():
-    """Inicializa calculadora (cached)"""
-    return CalculadoraFUNDEB()
+    """Inicializa calculadora com a base nacional carregada (cached)"""
+    calculadora = CalculadoraFUNDEB()
+    # Contexto nacional lido do cache em disco quando outro worker já o resolveu
+    obter_cache_resultados().carregar_base_nacional(calculadora, carregar_municipios())
+    return calculadora
 
 
-def inicializar_chat_agent():
-    """Inicializa agente de chat"""
-    # Tenta pegar da session_state (input do usuário) ou dos secrets do Streamlit Cloud
-    api_key = st.session_state.get('anthropic_api_key')
-    if not api_key:
-        # Tenta pegar dos secrets do Streamlit Cloud
-        try:
-            api_key = st.secrets.get("ANTHROPIC_API_KEY")
-        except:
-            pass
+@st.cache_resource
+def obter_cache_resultados():
+    """Cache de resultados nacionais (memória + disco compartilhado entre workers)"""
+    return CacheResultados()
 
-    if api_key:
-        return ChatAgentFUNDEB(api_key=api_key)
-    return None
 
+@st.cache_resource
+def obter_tabela_comparacao(chave: str, _lote: dict):
+    """Tabela paginada da comparação nacional (uma por resultado em cache)"""
+    with medir('app.tabela_comparacao'):
+        dados = pd.DataFrame({
+            'Município': _lote['municipio'],
+            'UF': _lote['uf'],
+            'VAAT': _lote['vaat']['valor_total'],
+            'VAAF': _lote['vaaf']['valor_total'],
+            'Total': _lote['total_complementacoes'],
+            'Matrículas': _lote['matriculas_totais']
+        })
+    return TabelaPaginada(dados, {
+        'VAAT': 'moeda',
+        'VAAF': 'moeda',
+        'Total': 'moeda',
+        'Matrículas': 'inteiro',
+    })
 
-def main():
-    """Função principal do app"""
 
-    # Header
-    st.markdown('<div class="main-header">📚 FUNDEB Fácil</div>', unsafe_allow_html=True)
-    st.markdown(
-        '<div class="sub-header">Sistema Inteligente para Compreensão e Projeção de Complementações VAAT/VAAF</div>',
-        unsafe_allow_html=True
+@st.cache_resource
+def obter_cubo(chave: str, _lote: dict):
+    """Cubo UF × faixa de população × elegibilidade da comparação nacional"""
+    return CuboAgregado.de_lote(_lote, carregar_municipios())
+
+
+# Cada combinação de taxas guarda um cubo nacional: só as mais recentes ficam
+@st.cache_resource(max_entries=8)
+def calcular_projecao(crescimento_matriculas: float, crescimento_complementacao: float):
+    """Projeção 2025–2035 de todos os municípios (cached por parâmetros)"""
+    return ProjecaoPlurianual(
+        inicializar_calculadora(),
+        carregar_municipios(),
+        crescimento_matriculas=crescimento_matriculas,
+        crescimento_complementacao=crescimento_complementacao
     )
 
-    # Sidebar - Configurações
-    with st.sidebar:
-        st.image("https://via.placeholder.com/150x50/1E88E5/FFFFFF?text=FUNDEB+Fácil", use_container_width=True)
 
-        st.markdown("### ⚙️ Configurações")
+def modulo_chat():
+    """
+    chat_agent (e o SDK da Anthropic), importado só quando o chat é usado
 
-        # API Key Anthropic
-        api_key = st.text_input(
-            "Chave API Anthropic",
-            type="password",
-            value=st.session_state.get('anthropic_api_key', ''),
-            help="Necessária para o chat explicativo"
-        )
-        if api_key:
-            st.session_state['anthropic_api_key'] = api_key
-            st.success("✅ API configurada")
+    A primeira importação no processo é registrada em 'app.importar_chat'.
+    """
+    if 'chat_agent' not in sys.modules:
+        with medir('app.importar_chat'):
+            importlib.import_module('chat_agent')
+    return sys.modules['chat_agent']
 
-        st.markdown("---")
 
-        st.markdown("### 📖 Sobre")
-        st.info("""
-        **FUNDEB Fácil** é uma solução para transparência inteligível das complementações
-        VAAT e VAAF do FUNDEB.
+@st.cache_resource
+def obter_cache_respostas():
+    """Cache em disco das respostas do chat (compartilhado entre sessões)"""
+    return modulo_chat().CacheRespostas()
 
-        **Recursos:**
-        - 🧮 Calculadora de complementações
-        - 📊 Visualizações interativas
-        - 🤖 Chat explicativo com IA
-        - 🎯 Simulação de cenários
-        """)
 
-        st.markdown("---")
-        st.caption("Desenvolvido para o Prêmio SOF 2025")
+def obter_api_key():
+    """Chave da API informada na barra lateral ou nos secrets (None se nenhuma)"""
+    # Tenta pegar da session_state (input do usuário) ou dos secrets do Streamlit Cloud
+    api_key = st.session_state.get('anthropic_api_key')
+    if not api_key:
+        # Tenta pegar dos secrets do Streamlit Cloud
+        try:
+            api_key = st.secrets.get("ANTHROPIC_API_KEY")
+        except:
+            pass
+    return api_key or None
+
+
+def inicializar_chat_agent(api_key: str):
+    """
+    Agente de chat da sessão, criado na primeira pergunta
+
+    Só aqui chat_agent (e o SDK da Anthropic) é importado; o agente fica na
+    sessão e é recriado se a chave mudar ou a conversa for limpa.
+    """
+    chave, agente = st.session_state.get('chat_agent', (None, None))
+    if agente is None or chave != api_key:
+        chat_agent = modulo_chat()
+        # Ferramentas (e seu cache de resultados) duram uma conversa
+        if 'ferramentas_chat' not in st.session_state:
+            st.session_state['ferramentas_chat'] = FerramentasCalculadora(
+                inicializar_calculadora(), carregar_municipios()
+            )
+        agente = chat_agent.ChatAgentFUNDEB(
+            api_key=api_key,
+            cache=obter_cache_respostas(),
+            ferramentas=st.session_state['ferramentas_chat']
+        )
+        st.session_state['chat_agent'] = (api_key, agente)
+    if 'gerenciador_historico' not in st.session_state:
+        st.session_state['gerenciador_historico'] = modulo_chat().GerenciadorHistorico()
+    return agente
+
+
+def painel_metricas():
+    """Painel de administração na barra lateral: tempos por etapa e exportação"""
+    with st.expander("⏱️ Métricas (admin)"):
+        METRICAS.ativo = st.toggle("Coletar métricas", value=METRICAS.ativo)
+        resumo = METRICAS.resumo()
+
+        if resumo['duracoes']:
+            df_metricas = pd.DataFrame.from_dict(resumo['duracoes'], orient='index')
+            colunas_ms = ['media_s', 'p50_s', 'p90_s', 'p99_s', 'max_s']
+            df_metricas[colunas_ms] = df_metricas[colunas_ms] * 1000
+            df_metricas = df_metricas[['n'] + colunas_ms].rename(
+                columns={c: c.replace('_s', ' (ms)') for c in colunas_ms}
+            )
+            st.dataframe(df_metricas.style.format('{:.2f}', subset=df_metricas.columns[1:]),
+                         use_container_width=True)
+        else:
+            st.caption("Nenhuma medição ainda")
+
+        for nome, valor in resumo['contadores'].items():
+            st.caption(f"{nome}: {valor:,.0f}")
+
+        col_a, col_b = st.columns(2)
+        with col_a:
+            st.download_button("Exportar", METRICAS.exportar_texto(), file_name="metricas.txt",
+                               mime="text/plain")
+        with col_b:
+            if st.button("Zerar"):
+                METRICAS.limpar()
+                st.rerun()
 
-    # Carrega dados
-    municipios = carregar_municipios()
-    calculadora = inicializar_calculadora()
 
-    # Tabs principais
-    tab1, tab2, tab3 = st.tabs(["🧮 Calculadora", "💬 Chat Explicativo", "📊 Comparações"])
+# Cada aba é um fragmento: interagir com um campo reexecuta só a própria aba
 
-    # ========== TAB 1: CALCULADORA ==========
-    with tab1:
+@st.fragment
+def painel_calculadora(municipios, calculadora):
+    """Aba Calculadora"""
+    with medir('app.aba_calculadora'):
         col1, col2 = st.columns([1, 2])
 
         with col1:
             st.markdown("### 📍 Selecione o Município")
 
             # Seleção de município
-            municipios_opcoes = {
-                f"{m['nome']} - {m['uf']}": m for m in municipios
-            }
-
-            municipio_selecionado = st.selectbox(
+            rotulos = rotulos_municipios()
+            indice_municipio = st.selectbox(
                 "Município",
-                options=list(municipios_opcoes.keys()),
+                options=range(len(rotulos)),
+                format_func=rotulos.__getitem__,
                 index=0
             )
 
-            municipio_data = municipios_opcoes[municipio_selecionado].copy()
+            municipio_original = municipios[indice_municipio]
+            municipio_data = municipio_original.copy()
+            municipio_data['matriculas'] = dict(municipio_original['matriculas'])
 
             # Exibe informações do município
             st.markdown("#### Informações do Município")
@@ -197,11 +295,42 @@ def main():
             # Botão calcular
             if st.button("🔢 Calcular Complementações", type="primary", use_container_width=True):
                 with st.spinner("Calculando..."):
+                    # Atualiza o total nacional apenas pela variação do município simulado
+                    totais_nacionais = calculadora.totais_com_delta(municipio_original, municipio_data)
+
                     # Calcula
-                    resultado = calculadora.calcular_ambas_complementacoes(municipio_data)
+                    resultado = calculadora.calcular_ambas_complementacoes(
+                        municipio_data, totais_nacionais
+                    )
+
+                    # Valor de uma matrícula a mais por etapa (mesmos totais da simulação)
+                    contexto = calculadora.contexto_nacional
+                    if contexto is not None:
+                        contexto = {**contexto, 'totais': totais_nacionais}
+                    sensibilidade = calculadora.calcular_sensibilidade([municipio_data], contexto)
 
-                    # Salva em session_state
+                    # Salva em session_state (com o código IBGE, usado pelas ferramentas do chat)
+                    resultado['codigo_ibge'] = municipio_data['codigo_ibge']
                     st.session_state['ultimo_resultado'] = resultado
+                    st.session_state['ultimo_indice'] = indice_municipio
+                    st.session_state['ultima_sensibilidade'] = pd.DataFrame({
+                        'Etapa': [etapa.replace('_', ' ').title() for etapa in sensibilidade['etapas']],
+                        'VAAT': sensibilidade['vaat']['valor_por_matricula'][0],
+                        'VAAF': sensibilidade['vaaf']['valor_por_matricula'][0],
+                        'Total': sensibilidade['valor_por_matricula_total'][0],
+                        'Muda elegibilidade': (
+                            sensibilidade['vaat']['muda_elegibilidade'][0]
+                            | sensibilidade['vaaf']['muda_elegibilidade'][0]
+                        ),
+                    })
+
+                # Só esta aba: chat e comparações leem o novo resultado de session_state
+                # na próxima execução deles. Se o clique veio numa execução do app
+                # inteiro (não da aba), as abas seguintes já o leem nesta mesma.
+                try:
+                    st.rerun(scope="fragment")
+                except StreamlitAPIException:
+                    pass
 
             # Exibe resultados se disponível
             if 'ultimo_resultado' in st.session_state:
@@ -230,6 +359,15 @@ def main():
                         formatar_moeda(resultado['total_complementacoes'])
                     )
 
+                # Elegibilidade calculada pela redistribuição nacional
+                if resultado['vaat'].get('limiar') is not None:
+                    st.caption(
+                        f"Valor por aluno VAAT: {formatar_moeda(resultado['vaat']['valor_aluno_ano'])} "
+                        f"(limiar {formatar_moeda(resultado['vaat']['limiar'])}) · "
+                        f"Valor por aluno VAAF: {formatar_moeda(resultado['vaaf']['valor_aluno_ano'])} "
+                        f"(limiar {formatar_moeda(resultado['vaaf']['limiar'])})"
+                    )
+
                 st.markdown("---")
 
                 # Detalhamento por etapa
@@ -239,12 +377,7 @@ def main():
 
                 with tab_vaat:
                     if resultado['vaat']['elegivel']:
-                        df_vaat = pd.DataFrame.from_dict(
-                            resultado['vaat']['detalhamento'],
-                            orient='index'
-                        )
-                        df_vaat.index.name = 'Etapa'
-                        df_vaat = df_vaat.reset_index()
+                        df_vaat = resultado['vaat'].para_dataframe().reset_index()
                         df_vaat['Etapa'] = df_vaat['Etapa'].str.replace('_', ' ').str.title()
 
                         # Tabela
@@ -260,12 +393,11 @@ def main():
                         )
 
                         # Gráfico
-                        fig = px.bar(
-                            df_vaat,
-                            x='Etapa',
-                            y='valor_complementacao',
+                        fig = go.Figure(go.Bar(x=df_vaat['Etapa'], y=df_vaat['valor_complementacao']))
+                        fig.update_layout(
                             title='Contribuição de Cada Etapa para VAAT',
-                            labels={'valor_complementacao': 'Valor (R$)', 'Etapa': 'Etapa Educacional'}
+                            xaxis_title='Etapa Educacional',
+                            yaxis_title='Valor (R$)'
                         )
                         st.plotly_chart(fig, use_container_width=True)
                     else:
@@ -273,12 +405,7 @@ def main():
 
                 with tab_vaaf:
                     if resultado['vaaf']['elegivel']:
-                        df_vaaf = pd.DataFrame.from_dict(
-                            resultado['vaaf']['detalhamento'],
-                            orient='index'
-                        )
-                        df_vaaf.index.name = 'Etapa'
-                        df_vaaf = df_vaaf.reset_index()
+                        df_vaaf = resultado['vaaf'].para_dataframe().reset_index()
                         df_vaaf['Etapa'] = df_vaaf['Etapa'].str.replace('_', ' ').str.title()
 
                         # Tabela
@@ -294,25 +421,167 @@ def main():
                         )
 
                         # Gráfico
-                        fig = px.bar(
-                            df_vaaf,
-                            x='Etapa',
-                            y='valor_complementacao',
+                        fig = go.Figure(go.Bar(x=df_vaaf['Etapa'], y=df_vaaf['valor_complementacao']))
+                        fig.update_layout(
                             title='Contribuição de Cada Etapa para VAAF',
-                            labels={'valor_complementacao': 'Valor (R$)', 'Etapa': 'Etapa Educacional'}
+                            xaxis_title='Etapa Educacional',
+                            yaxis_title='Valor (R$)'
                         )
                         st.plotly_chart(fig, use_container_width=True)
                     else:
                         st.info("Município não elegível para VAAF")
 
-    # ========== TAB 2: CHAT EXPLICATIVO ==========
-    with tab2:
+                # Valor marginal por etapa (forma fechada, sem recalcular cenário a cenário)
+                if 'ultima_sensibilidade' in st.session_state:
+                    with st.expander("📐 Quanto vale uma matrícula a mais em cada etapa"):
+                        df_sensibilidade = st.session_state['ultima_sensibilidade']
+                        st.dataframe(
+                            df_sensibilidade.style.format({
+                                'VAAT': 'R$ {:,.2f}', 'VAAF': 'R$ {:,.2f}', 'Total': 'R$ {:,.2f}'
+                            }),
+                            use_container_width=True,
+                            hide_index=True
+                        )
+                        st.caption(
+                            "Variação da complementação por matrícula extra, incluindo o efeito no "
+                            "denominador nacional. Etapas marcadas mudam a elegibilidade do município."
+                        )
+
+            # Metas: matrículas necessárias para um valor e distância da elegibilidade
+            if calculadora.contexto_nacional is not None:
+                with st.expander("🎯 Metas e elegibilidade"):
+                    # O expander executa mesmo fechado: só calcula quando pedido
+                    if st.toggle("Calcular metas", key='mostrar_metas'):
+                        painel_metas(calculadora, municipios, municipio_original, municipio_data)
+
+            # Projeção plurianual do município selecionado (dados atuais)
+            with st.expander("📈 Projeção 2025–2035"):
+                if st.toggle("Calcular projeção", key='mostrar_projecao'):
+                    painel_projecao(municipio_original)
+
+
+def painel_metas(calculadora, municipios, municipio_original, municipio_data):
+    """Matrículas necessárias para um valor alvo e distância da elegibilidade"""
+    col_e1, col_e2, col_e3 = st.columns(3)
+    with col_e1:
+        etapa_meta = st.selectbox(
+            "Etapa", ETAPAS, format_func=lambda etapa: etapa.replace('_', ' ').title()
+        )
+    with col_e2:
+        tipo_meta = st.selectbox(
+            "Complementação", ['total', 'vaat', 'vaaf'],
+            format_func={'total': 'Total', 'vaat': 'VAAT', 'vaaf': 'VAAF'}.get
+        )
+
+    # Mesmos totais nacionais da simulação
+    contexto_meta = {
+        **calculadora.contexto_nacional,
+        'totais': calculadora.totais_com_delta(municipio_original, municipio_data)
+    }
+    atual = calculadora.resolver_matriculas(
+        [municipio_data], etapa_meta, 0.0, tipo_meta, contexto_meta
+    )['valor_atual'][0]
+    with col_e3:
+        valor_alvo = st.number_input(
+            "Valor alvo (R$)", min_value=0.0, value=float(round(atual * 1.1, -3)) or 1_000_000.0,
+            step=100000.0
+        )
+
+    meta = calculadora.resolver_matriculas(
+        [municipio_data], etapa_meta, valor_alvo, tipo_meta, contexto_meta
+    )
+    extras = int(meta['matriculas_extras'][0])
+    nome_etapa = etapa_meta.replace('_', ' ').title()
+    if extras < 0:
+        st.warning(f"A meta não é alcançada só com matrículas em {nome_etapa}.")
+    elif extras == 0:
+        st.success(f"O município já alcança {formatar_moeda(valor_alvo)} ({formatar_moeda(atual)}).")
+    else:
+        st.success(
+            f"{extras:,} matrículas a mais em {nome_etapa} levam a "
+            f"{formatar_moeda(meta['valor_final'][0])} (hoje {formatar_moeda(atual)})."
+        )
+
+    for tipo in ('vaat', 'vaaf'):
+        distancia = calculadora.distancia_elegibilidade([municipio_data], tipo, contexto_meta)
+        rotulo = tipo.upper()
+        if distancia['elegivel'][0]:
+            st.caption(
+                f"{rotulo}: elegível, {formatar_moeda(-distancia['diferenca_valor_aluno'][0])} "
+                f"por aluno abaixo do limiar"
+            )
+            continue
+        extras_elegivel = int(distancia['matriculas_extras'][0, ETAPAS.index(etapa_meta)])
+        via_matriculas = (
+            f"ou {extras_elegivel:,} matrículas a mais em {nome_etapa}" if extras_elegivel > 0
+            else f"matrículas em {nome_etapa} não tornam o município elegível"
+        )
+        st.caption(
+            f"{rotulo}: não elegível, {formatar_moeda(distancia['diferenca_valor_aluno'][0])} por "
+            f"aluno acima do limiar (receita {formatar_moeda(distancia['receita_acima_limiar'][0])} "
+            f"acima); {via_matriculas}"
+        )
+
+    # A mesma meta para todos os municípios da UF (base atual, uma passada vetorizada)
+    if st.toggle(f"Todos os municípios de {municipio_original['uf']}"):
+        base_uf = municipios.por_uf(municipio_original['uf'])
+        metas_uf = calculadora.resolver_matriculas(base_uf, etapa_meta, valor_alvo, tipo_meta)
+        distancia_uf = calculadora.distancia_elegibilidade(base_uf, 'vaat')
+        st.dataframe(
+            pd.DataFrame({
+                'Município': metas_uf['municipio'],
+                'Atual': metas_uf['valor_atual'],
+                'Matrículas necessárias': metas_uf['matriculas_extras'],
+                'Elegível VAAT': distancia_uf['elegivel'],
+                'Matrículas até elegibilidade VAAT': (
+                    distancia_uf['matriculas_extras'][:, ETAPAS.index(etapa_meta)]
+                ),
+            }).style.format({'Atual': 'R$ {:,.2f}'}),
+            use_container_width=True,
+            hide_index=True
+        )
+        st.caption("-1: não alcança só com matrículas nesta etapa")
+
+
+def painel_projecao(municipio_original):
+    """Projeção 2025–2035 do município (dados atuais)"""
+    col_p1, col_p2 = st.columns(2)
+    with col_p1:
+        taxa_matriculas = st.number_input(
+            "Crescimento anual das matrículas (%)", value=0.0, step=0.5
+        )
+    with col_p2:
+        taxa_complementacao = st.number_input(
+            "Crescimento anual da complementação (%)", value=0.0, step=0.5
+        )
+
+    projecao = calcular_projecao(taxa_matriculas / 100, taxa_complementacao / 100)
+    serie = projecao.municipio(municipio_original['codigo_ibge'])
+
+    fig = go.Figure([
+        go.Scatter(x=serie['anos'], y=serie[tipo], name=tipo.upper(), mode='lines+markers')
+        for tipo in ('vaat', 'vaaf')
+    ])
+    fig.update_layout(
+        title=f"Projeção de Complementações - {municipio_original['nome']}",
+        xaxis_title='Ano',
+        yaxis_title='Valor (R$)',
+        legend_title='Complementação'
+    )
+    st.plotly_chart(fig, use_container_width=True)
+
+
+@st.fragment
+def painel_chat():
+    """Aba Chat Explicativo"""
+    with medir('app.aba_chat'):
         st.markdown("### 💬 Assistente Conversacional FUNDEB")
 
-        # Verifica se API está configurada (session_state ou secrets)
-        chat_agent = inicializar_chat_agent()
+        # Verifica se API está configurada (session_state ou secrets); o agente
+        # só é criado na primeira pergunta
+        api_key = obter_api_key()
 
-        if not chat_agent:
+        if not api_key:
             st.warning("⚠️ Configure sua chave API da Anthropic na barra lateral para usar o chat.")
         else:
             # Inicializa histórico
@@ -335,35 +604,42 @@ def main():
                 with st.chat_message("user"):
                     st.markdown(prompt)
 
-                # Gera resposta
+                # Gera resposta em fluxo (trechos aparecem conforme chegam)
                 with st.chat_message("assistant"):
-                    with st.spinner("Pensando..."):
-                        contexto = st.session_state.get('ultimo_resultado')
-
-                        resposta = chat_agent.gerar_resposta(
-                            prompt,
-                            contexto_municipio=contexto,
-                            historico=[
-                                {"role": m['role'], "content": m['content']}
-                                for m in st.session_state['chat_history'][:-1]
-                            ]
-                        )
-
-                        st.markdown(resposta)
-
-                        # Adiciona ao histórico
-                        st.session_state['chat_history'].append({
-                            'role': 'assistant',
-                            'content': resposta
-                        })
+                    chat_agent = inicializar_chat_agent(api_key)
+                    contexto = st.session_state.get('ultimo_resultado')
+
+                    resposta = st.write_stream(chat_agent.gerar_resposta_stream(
+                        prompt,
+                        contexto_municipio=contexto,
+                        historico=[
+                            {"role": m['role'], "content": m['content']}
+                            for m in st.session_state['chat_history'][:-1]
+                        ],
+                        gerenciador=st.session_state['gerenciador_historico']
+                    ))
+
+                    if chat_agent.latencia_primeiro_token is not None:
+                        st.caption(f"⏱️ Primeira resposta em {chat_agent.latencia_primeiro_token:.2f} s")
+
+                    # Adiciona ao histórico (texto completo)
+                    st.session_state['chat_history'].append({
+                        'role': 'assistant',
+                        'content': resposta
+                    })
 
             # Botão limpar histórico
             if st.button("🗑️ Limpar Histórico"):
                 st.session_state['chat_history'] = []
+                for chave in ('gerenciador_historico', 'ferramentas_chat', 'chat_agent'):
+                    st.session_state.pop(chave, None)
                 st.rerun()
 
-    # ========== TAB 3: COMPARAÇÕES ==========
-    with tab3:
+
+@st.fragment
+def painel_comparacoes(municipios, calculadora):
+    """Aba Comparações"""
+    with medir('app.aba_comparacoes'):
         st.markdown("### 📊 Comparação Entre Municípios")
 
         st.info("🚧 Recurso em desenvolvimento - MVP focado em cálculo individual e chat explicativo")
@@ -371,45 +647,172 @@ def main():
         # Preview de comparação simples
         st.markdown("#### Visão Geral dos Municípios")
 
-        # Calcula para todos
-        resultados_todos = []
-        for mun in municipios:
-            res = calculadora.calcular_ambas_complementacoes(mun)
-            resultados_todos.append({
-                'Município': res['municipio'],
-                'UF': res['uf'],
-                'VAAT': res['vaat']['valor_total'],
-                'VAAF': res['vaaf']['valor_total'],
-                'Total': res['total_complementacoes'],
-                'Matrículas': res['matriculas_totais']
-            })
-
-        df_comparacao = pd.DataFrame(resultados_todos)
-
-        # Gráfico comparativo
-        fig = go.Figure()
-        fig.add_trace(go.Bar(name='VAAT', x=df_comparacao['Município'], y=df_comparacao['VAAT']))
-        fig.add_trace(go.Bar(name='VAAF', x=df_comparacao['Município'], y=df_comparacao['VAAF']))
-        fig.update_layout(
-            title='Complementações por Município',
-            xaxis_title='Município',
-            yaxis_title='Valor (R$)',
-            barmode='stack'
-        )
-        st.plotly_chart(fig, use_container_width=True)
-
-        # Tabela
+        # Calcula para todos em uma única passada vetorizada (ou lê do cache)
+        lote = obter_cache_resultados().calcular_lote(calculadora, municipios)
+
+        # Resumo filtrado lido do cubo de agregação (sem varrer os municípios)
+        chave_resultados = CacheResultados.chave(calculadora, municipios)
+        cubo = obter_cubo(chave_resultados, lote)
+        if 'ultimo_resultado' in st.session_state:
+            # Inclui o último cálculo da aba Calculadora (só as células do município mudam)
+            cubo = cubo.simulado(st.session_state['ultimo_indice'], st.session_state['ultimo_resultado'])
+            st.caption(f"Resumo inclui o último cálculo: {st.session_state['ultimo_resultado']['municipio']}")
+
+        col_f1, col_f2, col_f3, col_f4, col_f5 = st.columns(5)
+        with col_f1:
+            filtro_regiao = st.multiselect("Região", cubo.regioes)
+        with col_f2:
+            filtro_uf = st.multiselect("UF", cubo.ufs)
+        with col_f3:
+            filtro_faixa = st.multiselect("População", FAIXAS_POPULACAO)
+        with col_f4:
+            filtro_elegibilidade = st.selectbox(
+                "Elegibilidade", ["Todos", "Elegíveis ao VAAT", "Elegíveis ao VAAF", "Não elegíveis"]
+            )
+        with col_f5:
+            agrupar_por = st.selectbox("Agrupar por", ["UF", "Região", "População"])
+
+        with medir('app.resumo_cubo'):
+            resumo = cubo.consultar(
+                por=({'UF': 'uf', 'Região': 'regiao', 'População': 'faixa_populacao'}[agrupar_por],),
+                uf=filtro_uf or None,
+                regiao=filtro_regiao or None,
+                faixa_populacao=filtro_faixa or None,
+                elegivel_vaat={"Elegíveis ao VAAT": True, "Não elegíveis": False}.get(filtro_elegibilidade),
+                elegivel_vaaf={"Elegíveis ao VAAF": True, "Não elegíveis": False}.get(filtro_elegibilidade)
+            )
+        col_r1, col_r2, col_r3, col_r4 = st.columns(4)
+        col_r1.metric("Municípios", f"{resumo['Municípios'].sum():,}")
+        col_r2.metric("VAAT", formatar_moeda(resumo['VAAT'].sum()))
+        col_r3.metric("VAAF", formatar_moeda(resumo['VAAF'].sum()))
+        col_r4.metric("Total", formatar_moeda(resumo['Total'].sum()))
         st.dataframe(
-            df_comparacao.style.format({
-                'VAAT': 'R$ {:,.2f}',
-                'VAAF': 'R$ {:,.2f}',
-                'Total': 'R$ {:,.2f}',
-                'Matrículas': '{:,.0f}'
+            resumo.rename(columns={'uf': 'UF', 'regiao': 'Região', 'faixa_populacao': 'População'}).style.format({
+                'VAAT': 'R$ {:,.2f}', 'VAAF': 'R$ {:,.2f}', 'Total': 'R$ {:,.2f}', 'Matrículas': '{:,.0f}',
+                'VAAT por aluno': 'R$ {:,.2f}', 'VAAF por aluno': 'R$ {:,.2f}'
             }),
             use_container_width=True,
             hide_index=True
         )
 
+        # Gráfico comparativo (reduzido no servidor: o tamanho não cresce com a base)
+        col_g1, col_g2 = st.columns([3, 1])
+        with col_g1:
+            modo_grafico = st.radio(
+                "Visualização",
+                graficos.MODOS,
+                index=graficos.MODOS.index('Por município' if len(municipios) <= 50 else 'Por UF'),
+                horizontal=True
+            )
+        with col_g2:
+            tipo_grafico = st.selectbox(
+                "Complementação", ['vaat', 'vaaf'], format_func=graficos.ROTULOS.get,
+                disabled=modo_grafico not in ('Distribuição', 'Maiores e menores')
+            )
+
+        with medir('app.grafico_comparacao'):
+            if modo_grafico == 'Por UF':
+                fig = graficos.figura_por_uf(lote)
+            elif modo_grafico == 'Distribuição':
+                fig = graficos.figura_distribuicao(lote, tipo_grafico)
+            elif modo_grafico == 'Maiores e menores':
+                fig = graficos.figura_maiores_e_menores(lote, tipo_grafico)
+            elif modo_grafico == 'Dispersão (WebGL)':
+                fig = graficos.figura_dispersao(lote)
+            else:
+                fig = graficos.figura_por_municipio(lote)
+            st.plotly_chart(fig, use_container_width=True)
+
+        # Tabela ordenada e paginada no servidor: só a página visível é formatada e enviada
+        tabela = obter_tabela_comparacao(chave_resultados, lote)
+        col_t1, col_t2, col_t3, col_t4 = st.columns([2, 1, 1, 1])
+        with col_t1:
+            ordenar_por = st.selectbox("Ordenar por", tabela.colunas, index=tabela.colunas.index('Total'))
+        with col_t2:
+            decrescente = st.toggle("Decrescente", value=True)
+        with col_t3:
+            tamanho_pagina = st.selectbox("Linhas por página", [25, 50, 100], index=1)
+        with col_t4:
+            pagina = st.number_input(
+                "Página", min_value=1, max_value=tabela.n_paginas(tamanho_pagina), value=1, step=1
+            )
+
+        with medir('app.tabela_pagina'):
+            st.dataframe(
+                tabela.pagina(pagina, tamanho_pagina, ordenar_por, crescente=not decrescente),
+                use_container_width=True,
+                hide_index=True
+            )
+        inicio = (pagina - 1) * tamanho_pagina
+        st.caption(f"Linhas {inicio + 1}–{min(inicio + tamanho_pagina, len(tabela))} de {len(tabela)}")
+
+
+def main():
+    """Função principal do app"""
+
+    # Header
+    st.markdown('<div class="main-header">📚 FUNDEB Fácil</div>', unsafe_allow_html=True)
+    st.markdown(
+        '<div class="sub-header">Sistema Inteligente para Compreensão e Projeção de Complementações VAAT/VAAF</div>',
+        unsafe_allow_html=True
+    )
+
+    # Sidebar - Configurações
+    with st.sidebar:
+        st.image("https://via.placeholder.com/150x50/1E88E5/FFFFFF?text=FUNDEB+Fácil", use_container_width=True)
+
+        st.markdown("### ⚙️ Configurações")
+
+        # API Key Anthropic
+        api_key = st.text_input(
+            "Chave API Anthropic",
+            type="password",
+            value=st.session_state.get('anthropic_api_key', ''),
+            help="Necessária para o chat explicativo"
+        )
+        if api_key:
+            st.session_state['anthropic_api_key'] = api_key
+            st.success("✅ API configurada")
+
+        # Painel de métricas só para administradores (FUNDEB_ADMIN=1)
+        if os.environ.get('FUNDEB_ADMIN'):
+            painel_metricas()
+
+        st.markdown("---")
+
+        st.markdown("### 📖 Sobre")
+        st.info("""
+        **FUNDEB Fácil** é uma solução para transparência inteligível das complementações
+        VAAT e VAAF do FUNDEB.
+
+        **Recursos:**
+        - 🧮 Calculadora de complementações
+        - 📊 Visualizações interativas
+        - 🤖 Chat explicativo com IA
+        - 🎯 Simulação de cenários
+        """)
+
+        st.markdown("---")
+        st.caption("Desenvolvido para o Prêmio SOF 2025")
+
+    # Carrega dados
+    with medir('app.dados'):
+        municipios = carregar_municipios()
+        calculadora = inicializar_calculadora()
+
+    # Tabs principais
+    tab1, tab2, tab3 = st.tabs(["🧮 Calculadora", "💬 Chat Explicativo", "📊 Comparações"])
+
+    with tab1:
+        painel_calculadora(municipios, calculadora)
+
+    with tab2:
+        painel_chat()
+
+    with tab3:
+        painel_comparacoes(municipios, calculadora)
+
 
 if __name__ == "__main__":
-    main()
+    with medir('app.execucao'):
+        main()
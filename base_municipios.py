@@ -0,0 +1,483 @@
+"""
+Base colunar de municípios (formato compacto mapeável em memória)
+
+Guarda cada coluna de municipios.json como um arquivo .npy em um diretório
+(ex.: dados/municipios.colunar/). Os arquivos são abertos com np.load em modo
+mmap, de modo que vários workers do Streamlit compartilham as mesmas páginas
+do sistema operacional sem copiar nem reinterpretar JSON.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+from metricas import cronometrar
+
+
+# Ordem fixa das etapas nas colunas de matrículas
+ETAPAS = (
+    'creche_integral',
+    'creche_parcial',
+    'pre_escola_integral',
+    'pre_escola_parcial',
+    'anos_iniciais_urbano',
+    'anos_iniciais_rural',
+    'anos_finais_urbano',
+    'anos_finais_rural',
+    'ensino_medio_urbano',
+    'eja',
+    'educacao_especial',
+)
+
+VERSAO_FORMATO = 1
+
+# Campos sem os quais um registro de município não pode ser calculado
+CAMPOS_OBRIGATORIOS = ('nome', 'uf', 'nse', 'drec', 'matriculas')
+
+# Colunas gravadas em disco (além de meta.json)
+COLUNAS = (
+    'codigo_ibge',
+    'nome',
+    'uf',
+    'populacao',
+    'nse',
+    'drec',
+    'elegivel_vaat',
+    'elegivel_vaaf',
+    'receita_vaat',
+    'receita_vaaf',
+    'matriculas',
+    'ordem_uf',
+    'inicio_uf',
+)
+
+
+def _numero(valor) -> bool:
+    """Número finito (bool não conta)"""
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool) and np.isfinite(valor)
+
+
+def validar_municipio(municipio) -> Dict:
+    """
+    Confere um registro no formato de municipios.json antes do cálculo
+
+    Exige CAMPOS_OBRIGATORIOS, nome/uf em texto, codigo_ibge em texto ou
+    inteiro, nse/drec/populacao/receita_* numéricos e matrículas não
+    negativas apenas em etapas de ETAPAS. Usada pelo serviço HTTP e pelo
+    lote em linha de comando.
+
+    Raises:
+        ValueError: com a descrição do primeiro problema encontrado
+    """
+    if not isinstance(municipio, dict):
+        raise ValueError("Esperado um objeto JSON")
+    faltando = [c for c in CAMPOS_OBRIGATORIOS if c not in municipio]
+    if faltando:
+        raise ValueError(f"Campos obrigatórios ausentes: {', '.join(faltando)}")
+    if not isinstance(municipio['matriculas'], dict):
+        raise ValueError("'matriculas' deve ser um objeto {etapa: quantidade}")
+    for campo in ('nome', 'uf'):
+        if not isinstance(municipio[campo], str):
+            raise ValueError(f"'{campo}' deve ser um texto")
+    codigo = municipio.get('codigo_ibge')
+    if codigo is not None and (not isinstance(codigo, (str, int)) or isinstance(codigo, bool)):
+        raise ValueError("'codigo_ibge' deve ser um texto ou número inteiro")
+    for campo in ('nse', 'drec', 'populacao'):
+        if campo in municipio and not _numero(municipio[campo]):
+            raise ValueError(f"'{campo}' deve ser um número")
+    for campo in ('receita_vaat', 'receita_vaaf'):
+        if municipio.get(campo) is not None and not _numero(municipio[campo]):
+            raise ValueError(f"'{campo}' deve ser um número")
+    for etapa, quantidade in municipio['matriculas'].items():
+        if etapa not in ETAPAS:
+            raise ValueError(f"Etapa desconhecida: '{etapa}'")
+        if not _numero(quantidade) or quantidade < 0:
+            raise ValueError(f"Matrículas de '{etapa}' devem ser um número não negativo")
+    return municipio
+
+
+class BaseMunicipios:
+    """
+    Base de municípios em colunas NumPy
+
+    Comporta-se como uma sequência de dicionários no formato de municipios.json
+    (len, índice e iteração), mas os cálculos em lote leem direto das colunas:
+    matrículas como int32 (municípios × ETAPAS), nse/drec como float64 e UF
+    como código inteiro em uma tabela interna de siglas.
+    """
+
+    def __init__(self, colunas: Dict[str, np.ndarray], ufs: List[str]):
+        """
+        Args:
+            colunas: Arrays por coluna (ver COLUNAS)
+            ufs: Tabela de siglas; colunas['uf'] guarda o índice nesta lista
+        """
+        self.colunas = colunas
+        self.ufs = list(ufs)
+        self._codigo_uf = {uf: i for i, uf in enumerate(self.ufs)}
+        self._indice_codigo = None
+        self._impressao = None
+
+    # ---------- Construção e persistência ----------
+
+    @classmethod
+    def de_registros(cls, municipios: List[Dict]) -> 'BaseMunicipios':
+        """Monta a base a partir da lista de dicionários de municipios.json"""
+        n = len(municipios)
+        ufs = sorted({m['uf'] for m in municipios})
+        codigo_uf = {uf: i for i, uf in enumerate(ufs)}
+
+        matriculas = np.zeros((n, len(ETAPAS)), dtype=np.int32)
+        for i, mun in enumerate(municipios):
+            matriculas_mun = mun['matriculas']
+            matriculas[i] = [matriculas_mun.get(etapa, 0) for etapa in ETAPAS]
+
+        def receita(m, tipo):
+            valor = m.get(f'receita_{tipo}')
+            return np.nan if valor is None else valor
+
+        uf = np.array([codigo_uf[m['uf']] for m in municipios], dtype=np.uint8)
+        ordem_uf, inicio_uf = _agrupar_por_uf(uf, len(ufs))
+
+        colunas = {
+            'codigo_ibge': np.array([str(m.get('codigo_ibge', '')) for m in municipios], dtype=str),
+            'nome': np.array([m['nome'] for m in municipios], dtype=str),
+            'uf': uf,
+            'populacao': np.array([m.get('populacao', 0) for m in municipios], dtype=np.int64),
+            'nse': np.array([m['nse'] for m in municipios], dtype=np.float64),
+            'drec': np.array([m['drec'] for m in municipios], dtype=np.float64),
+            'elegivel_vaat': np.array([bool(m.get('elegivel_vaat', False)) for m in municipios], dtype=bool),
+            'elegivel_vaaf': np.array([bool(m.get('elegivel_vaaf', False)) for m in municipios], dtype=bool),
+            'receita_vaat': np.array([receita(m, 'vaat') for m in municipios], dtype=np.float64),
+            'receita_vaaf': np.array([receita(m, 'vaaf') for m in municipios], dtype=np.float64),
+            'matriculas': matriculas,
+            'ordem_uf': ordem_uf,
+            'inicio_uf': inicio_uf,
+        }
+        return cls(colunas, ufs)
+
+    @classmethod
+    def como_base(cls, municipios) -> 'BaseMunicipios':
+        """Retorna a própria base ou empacota uma lista de dicionários"""
+        if isinstance(municipios, cls):
+            return municipios
+        return cls.de_registros(municipios)
+
+    @classmethod
+    def abrir(cls, diretorio: str) -> 'BaseMunicipios':
+        """Abre uma base colunar gravada por salvar, mapeando as colunas em memória"""
+        while True:
+            # Resolve o link uma vez: todas as colunas vêm da mesma versão
+            versao = os.path.realpath(diretorio)
+            try:
+                return cls._abrir_versao(versao)
+            except FileNotFoundError:
+                # Versão apagada por trocas seguidas enquanto era aberta: relê o link
+                if os.path.realpath(diretorio) == versao:
+                    raise
+
+    @classmethod
+    def _abrir_versao(cls, diretorio: str) -> 'BaseMunicipios':
+        with open(os.path.join(diretorio, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        if meta['formato'] != VERSAO_FORMATO or tuple(meta['etapas']) != ETAPAS:
+            raise ValueError(f"Base colunar incompatível em {diretorio}; converta novamente a partir do JSON")
+
+        colunas = {
+            nome: np.load(os.path.join(diretorio, f'{nome}.npy'), mmap_mode='r')
+            for nome in COLUNAS
+        }
+        return cls(colunas, meta['ufs'])
+
+    def salvar(self, diretorio: str):
+        """
+        Grava a base em formato colunar
+
+        Escreve em um diretório de versão e troca o link do destino no final
+        (trocar_diretorio), para que workers concorrentes nunca vejam uma base
+        pela metade nem um destino ausente.
+        """
+        destino = os.path.abspath(diretorio)
+        temporario = criar_versao(destino)
+        try:
+            for nome in COLUNAS:
+                np.save(os.path.join(temporario, f'{nome}.npy'), np.ascontiguousarray(self.colunas[nome]))
+
+            meta = {'formato': VERSAO_FORMATO, 'etapas': list(ETAPAS), 'ufs': self.ufs, 'n': len(self)}
+            with open(os.path.join(temporario, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+
+            trocar_diretorio(temporario, destino)
+        except BaseException:
+            shutil.rmtree(temporario, ignore_errors=True)
+            raise
+
+    # ---------- Acesso ----------
+
+    def __len__(self) -> int:
+        return len(self.colunas['nome'])
+
+    def __getitem__(self, i: int) -> Dict:
+        """Registro no formato de municipios.json"""
+        c = self.colunas
+        registro = {
+            'codigo_ibge': str(c['codigo_ibge'][i]),
+            'nome': str(c['nome'][i]),
+            'uf': self.ufs[c['uf'][i]],
+            'populacao': int(c['populacao'][i]),
+            'nse': float(c['nse'][i]),
+            'drec': float(c['drec'][i]),
+            'elegivel_vaat': bool(c['elegivel_vaat'][i]),
+            'elegivel_vaaf': bool(c['elegivel_vaaf'][i]),
+            'matriculas': dict(zip(ETAPAS, c['matriculas'][i].tolist())),
+        }
+        for tipo in ('vaat', 'vaaf'):
+            receita = c[f'receita_{tipo}'][i]
+            if not np.isnan(receita):
+                registro[f'receita_{tipo}'] = float(receita)
+        return registro
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def matriculas(self) -> np.ndarray:
+        """Matriz int32 municípios × ETAPAS"""
+        return self.colunas['matriculas']
+
+    @property
+    def siglas_uf(self) -> np.ndarray:
+        """Sigla da UF de cada município"""
+        return np.asarray(self.ufs, dtype=str)[self.colunas['uf']]
+
+    def indice(self, codigo_ibge) -> int:
+        """Linha do município pelo código IBGE, em O(1) (KeyError se ausente)"""
+        if self._indice_codigo is None:
+            self._indice_codigo = {
+                codigo: i for i, codigo in enumerate(self.colunas['codigo_ibge'].tolist())
+            }
+        return self._indice_codigo[str(codigo_ibge)]
+
+    def por_codigo(self, codigo_ibge) -> Dict:
+        """Registro do município pelo código IBGE"""
+        return self[self.indice(codigo_ibge)]
+
+    def indices_uf(self, uf: str) -> np.ndarray:
+        """Linhas dos municípios de uma UF (fatia pré-calculada, sem varredura)"""
+        codigo = self._codigo_uf.get(uf)
+        if codigo is None:
+            return np.zeros(0, dtype=np.int64)
+        inicio = self.colunas['inicio_uf']
+        return self.colunas['ordem_uf'][inicio[codigo]:inicio[codigo + 1]]
+
+    def por_uf(self, uf: str) -> 'BaseMunicipios':
+        """Sub-base com os municípios de uma UF"""
+        return self.subconjunto(self.indices_uf(uf))
+
+    def subconjunto(self, indices) -> 'BaseMunicipios':
+        """Nova base (em memória) com as linhas indicadas, na ordem dada"""
+        indices = np.asarray(indices, dtype=np.int64)
+        colunas = {
+            nome: np.asarray(self.colunas[nome])[indices]
+            for nome in COLUNAS if nome not in ('ordem_uf', 'inicio_uf')
+        }
+        colunas['ordem_uf'], colunas['inicio_uf'] = _agrupar_por_uf(colunas['uf'], len(self.ufs))
+        return BaseMunicipios(colunas, self.ufs)
+
+    def impressao_digital(self) -> str:
+        """Hash SHA-256 do conteúdo das colunas (calculado uma vez por base)"""
+        if self._impressao is None:
+            h = hashlib.sha256(json.dumps(self.ufs).encode('utf-8'))
+            for nome in COLUNAS:
+                h.update(np.ascontiguousarray(self.colunas[nome]).tobytes())
+            self._impressao = h.hexdigest()
+        return self._impressao
+
+
+def _agrupar_por_uf(uf: np.ndarray, n_ufs: int):
+    """Ordem estável das linhas por UF e deslocamento de início de cada UF"""
+    ordem = np.argsort(uf, kind='stable').astype(np.int64)
+    inicio = np.zeros(n_ufs + 1, dtype=np.int64)
+    inicio[1:] = np.cumsum(np.bincount(uf, minlength=n_ufs))
+    return ordem, inicio
+
+
+def _prefixo_versao(destino: str) -> str:
+    """Prefixo dos diretórios de versão de um destino (ex.: .municipios.colunar-)"""
+    return f'.{os.path.basename(destino)}-'
+
+
+def _link_versao(versao: str) -> str:
+    """Link temporário que reserva uma versão até a troca (nome único, como a versão)"""
+    return f'{versao}.link'
+
+
+def criar_versao(destino: str) -> str:
+    """
+    Cria o diretório de uma nova versão de 'destino', a gravar e publicar com trocar_diretorio
+
+    A versão nasce reservada pelo seu link temporário: a limpeza de outro
+    escritor do mesmo destino não a apaga antes da troca.
+    """
+    versao = tempfile.mkdtemp(prefix=_prefixo_versao(destino), dir=os.path.dirname(destino))
+    try:
+        os.symlink(os.path.basename(versao), _link_versao(versao), target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pass  # Sem links: trocar_diretorio troca por renomeação
+    return versao
+
+
+def trocar_diretorio(novo: str, destino: str):
+    """
+    Publica o diretório 'novo' em 'destino' sem deixar o destino ausente
+
+    O destino é um link simbólico para o diretório de versão (irmão dele,
+    criado por criar_versao); a troca renomeia o link temporário da versão
+    por cima do atual com os.replace, que é atômico. Leitores resolvem o link
+    uma vez (os.path.realpath) e leem uma versão inteira. A versão anterior
+    fica para quem ainda a está abrindo; as mais antigas são apagadas
+    (_apagar_versoes_antigas).
+
+    Um destino que ainda é um diretório comum (formato antigo) é migrado: é
+    renomeado para uma versão e só então trocado pelo link. Sem suporte a
+    links (ex.: Windows sem permissão), o destino antigo é renomeado para o
+    lado antes de o novo tomar seu lugar, e apagado em seguida.
+    """
+    pai = os.path.dirname(destino)
+    prefixo = _prefixo_versao(destino)
+    link = _link_versao(os.path.join(pai, os.path.basename(novo)))
+    try:
+        if not os.path.islink(link):
+            os.symlink(os.path.basename(novo), link, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        # Sem links: o destino antigo sai do caminho só no instante da troca
+        lado = None
+        if os.path.lexists(destino):
+            lado = tempfile.mkdtemp(prefix=prefixo, dir=pai)
+            os.replace(destino, lado)
+        os.replace(novo, destino)
+        if lado is not None:
+            shutil.rmtree(lado, ignore_errors=True)
+        return
+
+    if os.path.islink(destino):
+        anterior = os.path.realpath(destino)
+    elif os.path.isdir(destino):
+        # Formato antigo: o diretório vira uma versão (mkdtemp cria o nome,
+        # os.replace põe o diretório antigo no lugar dele)
+        anterior = tempfile.mkdtemp(prefix=prefixo, dir=pai)
+        os.replace(destino, anterior)
+    else:
+        anterior = None
+    os.replace(link, destino)
+
+    _apagar_versoes_antigas(destino, {os.path.realpath(novo), anterior and os.path.realpath(anterior)})
+
+
+def _apagar_versoes_antigas(destino: str, manter: set):
+    """
+    Apaga versões de 'destino' substituídas, sem tocar nas de outros escritores
+
+    Versões ainda não publicadas estão reservadas pelo link temporário
+    (criar_versao) e ficam. Das demais, só saem as completas (com meta.json,
+    gravado por último) e mais antigas que a versão para a qual o destino
+    aponta agora. Links de gravações interrompidas (versão já apagada) são
+    removidos.
+    """
+    pai = os.path.dirname(destino)
+    prefixo = _prefixo_versao(destino)
+    nomes = [nome for nome in os.listdir(pai) if nome.startswith(prefixo)]
+    reservadas = set(manter)
+    for nome in nomes:
+        caminho = os.path.join(pai, nome)
+        if not os.path.islink(caminho):
+            continue
+        try:
+            versao = os.path.realpath(os.path.join(pai, os.readlink(caminho)))
+            if os.path.isdir(versao):
+                reservadas.add(versao)
+            else:
+                os.remove(caminho)
+        except FileNotFoundError:
+            pass  # Link consumido por uma troca enquanto era lido
+
+    # Lido depois dos links: uma versão publicada nesse meio-tempo já é a atual
+    try:
+        atual = os.path.realpath(destino)
+        reservadas.add(atual)
+        atual = os.stat(os.path.join(atual, 'meta.json')).st_mtime_ns
+    except FileNotFoundError:
+        return
+
+    for nome in nomes:
+        caminho = os.path.join(pai, nome)
+        if os.path.islink(caminho) or os.path.realpath(caminho) in reservadas:
+            continue
+        try:
+            completa = os.stat(os.path.join(caminho, 'meta.json')).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        if completa < atual:
+            shutil.rmtree(caminho, ignore_errors=True)
+
+
+def converter_json_para_colunar(caminho_json: str, diretorio: str = None) -> str:
+    """
+    Converte municipios.json para o formato colunar
+
+    Args:
+        caminho_json: Arquivo JSON de municípios
+        diretorio: Destino (padrão: mesmo nome com sufixo .colunar)
+
+    Returns:
+        Caminho do diretório gerado
+    """
+    if diretorio is None:
+        diretorio = os.path.splitext(caminho_json)[0] + '.colunar'
+
+    with open(caminho_json, 'r', encoding='utf-8') as f:
+        municipios = json.load(f)
+
+    BaseMunicipios.de_registros(municipios).salvar(diretorio)
+    return diretorio
+
+
+@cronometrar()
+def carregar_municipios(caminho: str = 'dados/municipios.json') -> BaseMunicipios:
+    """
+    Carrega a base de municípios em qualquer um dos formatos
+
+    Diretórios são abertos como base colunar. Para um arquivo JSON, usa a versão
+    colunar ao lado dele, gerando-a antes se estiver ausente ou desatualizada.
+    """
+    if os.path.isdir(caminho):
+        return BaseMunicipios.abrir(caminho)
+
+    diretorio = os.path.splitext(caminho)[0] + '.colunar'
+    meta = os.path.join(diretorio, 'meta.json')
+    try:
+        if not os.path.exists(meta) or os.path.getmtime(meta) < os.path.getmtime(caminho):
+            converter_json_para_colunar(caminho, diretorio)
+        try:
+            return BaseMunicipios.abrir(diretorio)
+        except ValueError:
+            # Gerada por versão anterior do formato
+            converter_json_para_colunar(caminho, diretorio)
+            return BaseMunicipios.abrir(diretorio)
+    except OSError:
+        # Sem permissão de escrita: mantém a base em memória
+        with open(caminho, 'r', encoding='utf-8') as f:
+            return BaseMunicipios.de_registros(json.load(f))
+
+
+if __name__ == '__main__':
+    origem = sys.argv[1] if len(sys.argv) > 1 else 'dados/municipios.json'
+    destino = sys.argv[2] if len(sys.argv) > 2 else None
+    print(f"Base colunar gravada em {converter_json_para_colunar(origem, destino)}")
@@ -0,0 +1,310 @@
+"""
+Benchmarks da calculadora com bases sintéticas em escala nacional
+
+Gera municípios no formato de dados/municipios.json em 1×, 10× e 100× o
+tamanho nacional (≈ 5.570 municípios), mede o cálculo escalar
+(calcular_complementacao), os caminhos em lote, a carga dos dados e a
+montagem da tabela de resultados, e grava tudo em JSON. Com --referencia,
+compara com uma execução anterior e falha se algum tempo piorar além do
+limite.
+
+Uso:
+    python benchmark.py --escalas 1 10 --saida bench.json
+    python benchmark.py --referencia bench.json --limite 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from base_municipios import ETAPAS, BaseMunicipios, _agrupar_por_uf, carregar_municipios
+from calculadora import TIPOS_COMPLEMENTACAO, CalculadoraFUNDEB, registros_lote
+from cubo import CuboAgregado
+from tabelas import TabelaPaginada
+
+VERSAO_RESULTADOS = 1
+
+# Municípios por UF (IBGE); a soma é o tamanho nacional
+MUNICIPIOS_POR_UF = {
+    'AC': 22, 'AL': 102, 'AM': 62, 'AP': 16, 'BA': 417, 'CE': 184, 'DF': 1,
+    'ES': 78, 'GO': 246, 'MA': 217, 'MG': 853, 'MS': 79, 'MT': 141, 'PA': 144,
+    'PB': 223, 'PE': 184, 'PI': 224, 'PR': 399, 'RJ': 92, 'RN': 167, 'RO': 52,
+    'RR': 15, 'RS': 497, 'SC': 295, 'SE': 75, 'SP': 645, 'TO': 139,
+}
+TAMANHO_NACIONAL = sum(MUNICIPIOS_POR_UF.values())
+
+# Participação média de cada etapa nas matrículas (ordem de ETAPAS)
+PARTICIPACAO_ETAPAS = np.array([0.06, 0.04, 0.05, 0.06, 0.27, 0.04, 0.19, 0.03, 0.17, 0.06, 0.03])
+
+# Matrículas públicas por habitante (≈ 37,9 milhões / 203 milhões)
+MATRICULAS_POR_HABITANTE = 0.187
+
+
+def gerar_base(n: int, semente: int = 0) -> BaseMunicipios:
+    """
+    Base sintética de n municípios com distribuições realistas
+
+    UFs na proporção do número real de municípios, população log-normal
+    (mediana ≈ 11 mil habitantes), matrículas proporcionais à população com
+    variação por etapa, NSE normal em torno de 50 e DRec uniforme em 0,85–1,15.
+
+    Args:
+        n: Número de municípios
+        semente: Semente do gerador (mesma semente, mesma base)
+    """
+    rng = np.random.default_rng(semente)
+    ufs = sorted(MUNICIPIOS_POR_UF)
+    pesos_uf = np.array([MUNICIPIOS_POR_UF[uf] for uf in ufs], dtype=np.float64)
+    uf = rng.choice(len(ufs), size=n, p=pesos_uf / pesos_uf.sum()).astype(np.uint8)
+
+    populacao = np.maximum(800, rng.lognormal(np.log(11_000), 1.2, n)).astype(np.int64)
+    participacao = rng.dirichlet(PARTICIPACAO_ETAPAS * 200, n)
+    matriculas = np.rint(
+        populacao[:, np.newaxis] * MATRICULAS_POR_HABITANTE * participacao
+    ).astype(np.int32)
+
+    nse = np.clip(rng.normal(50.0, 6.0, n), 30.0, 70.0).round(1)
+    drec = rng.uniform(0.85, 1.15, n).round(3)
+    elegivel = drec < 1.0
+    ordem_uf, inicio_uf = _agrupar_por_uf(uf, len(ufs))
+
+    colunas = {
+        'codigo_ibge': np.array([f'{9_000_000 + i}' for i in range(n)], dtype=str),
+        'nome': np.array([f'Município {i}' for i in range(n)], dtype=str),
+        'uf': uf,
+        'populacao': populacao,
+        'nse': nse,
+        'drec': drec,
+        'elegivel_vaat': elegivel,
+        'elegivel_vaaf': elegivel,
+        'receita_vaat': np.full(n, np.nan),
+        'receita_vaaf': np.full(n, np.nan),
+        'matriculas': matriculas,
+        'ordem_uf': ordem_uf,
+        'inicio_uf': inicio_uf,
+    }
+    return BaseMunicipios(colunas, ufs)
+
+
+def gerar_municipios(n: int, semente: int = 0) -> List[Dict]:
+    """Mesma base de gerar_base como lista de dicionários (formato de municipios.json)"""
+    return list(gerar_base(n, semente))
+
+
+def medir(funcao: Callable, repeticoes: int = 3) -> Dict[str, float]:
+    """
+    Tempo de parede de funcao() em segundos
+
+    Returns:
+        {'mediana_s', 'minimo_s', 'repeticoes'}
+    """
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return {'mediana_s': statistics.median(tempos), 'minimo_s': min(tempos), 'repeticoes': repeticoes}
+
+
+def medir_escala(n: int, repeticoes: int = 3, amostra_escalar: int = 2000, semente: int = 0) -> Dict[str, Dict]:
+    """
+    Mede todos os caminhos para uma base sintética de n municípios
+
+    O cálculo escalar roda sobre uma amostra (no máximo amostra_escalar
+    municípios) e informa também o tempo por município.
+    """
+    base = gerar_base(n, semente)
+    resultados = {}
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho_json = os.path.join(diretorio, 'municipios.json')
+        with open(caminho_json, 'w', encoding='utf-8') as f:
+            json.dump(list(base), f, ensure_ascii=False)
+
+        def carregar_json():
+            with open(caminho_json, 'r', encoding='utf-8') as f:
+                BaseMunicipios.de_registros(json.load(f))
+
+        resultados['carga_json'] = medir(carregar_json, repeticoes)
+        carregar_municipios(caminho_json)  # gera a versão colunar ao lado
+        resultados['carga_colunar'] = medir(lambda: carregar_municipios(caminho_json), repeticoes)
+
+    calculadora = CalculadoraFUNDEB()
+    resultados['contexto_nacional'] = medir(lambda: calculadora.resolver_contexto_nacional(base), repeticoes)
+    calculadora.carregar_base_nacional(base)
+
+    amostra = [base[i] for i in range(min(n, amostra_escalar))]
+
+    def escalar():
+        for municipio in amostra:
+            for tipo in TIPOS_COMPLEMENTACAO:
+                calculadora.calcular_complementacao(municipio, tipo)
+
+    resultados['escalar'] = medir(escalar, repeticoes)
+    resultados['escalar']['por_municipio_us'] = resultados['escalar']['mediana_s'] / len(amostra) * 1e6
+
+    resultados['lote'] = medir(lambda: calculadora.calcular_lote(base), repeticoes)
+    resultados['lote']['por_municipio_us'] = resultados['lote']['mediana_s'] / n * 1e6
+    fator_matriculas = np.outer([1.0, 1.05, 1.10, 1.15], np.ones(len(ETAPAS)))
+    resultados['cenarios'] = medir(
+        lambda: calculadora.calcular_cenarios(base, fator_matriculas=fator_matriculas), repeticoes
+    )
+    resultados['sensibilidade'] = medir(lambda: calculadora.calcular_sensibilidade(base), repeticoes)
+    resultados['metas'] = medir(
+        lambda: calculadora.resolver_matriculas(base, 'creche_integral', 5e6, 'total'), repeticoes
+    )
+
+    lote = calculadora.calcular_lote(base)
+
+    def tabela():
+        return pd.DataFrame({
+            'Município': lote['municipio'],
+            'UF': lote['uf'],
+            'VAAT': lote['vaat']['valor_total'],
+            'VAAF': lote['vaaf']['valor_total'],
+            'Total': lote['total_complementacoes'],
+            'Matrículas': lote['matriculas_totais'],
+        })
+
+    resultados['tabela'] = medir(tabela, repeticoes)
+    dados_tabela = tabela()
+    resultados['tabela_pagina'] = medir(
+        lambda: TabelaPaginada(dados_tabela, {'Total': 'moeda', 'Matrículas': 'inteiro'}).pagina(
+            1, 50, ordenar_por='Total', crescente=False
+        ),
+        repeticoes
+    )
+    resultados['registros'] = medir(lambda: sum(1 for _ in registros_lote(lote)), repeticoes)
+    resultados['cubo'] = medir(lambda: CuboAgregado.de_lote(lote, base), repeticoes)
+    cubo = CuboAgregado.de_lote(lote, base)
+    resultados['cubo_consulta'] = medir(
+        lambda: cubo.consultar(por=('uf', 'faixa_populacao'), regiao=['Sul', 'Sudeste'], elegivel_vaat=True),
+        repeticoes
+    )
+
+    for medicao in resultados.values():
+        medicao.setdefault('municipios', n)
+    resultados['escalar']['municipios'] = len(amostra)
+    return resultados
+
+
+def executar(
+    escalas=(1, 10),
+    repeticoes: int = 3,
+    tamanho_nacional: int = TAMANHO_NACIONAL,
+    amostra_escalar: int = 2000
+) -> Dict:
+    """
+    Roda a suíte nas escalas pedidas (múltiplos do tamanho nacional)
+
+    Returns:
+        Dicionário serializável com ambiente e {escala: {benchmark: medição}}
+    """
+    return {
+        'versao': VERSAO_RESULTADOS,
+        'commit': _commit_atual(),
+        'ambiente': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'escalas': {
+            f'{escala}x': medir_escala(round(tamanho_nacional * escala), repeticoes, amostra_escalar)
+            for escala in escalas
+        },
+    }
+
+
+def comparar(atual: Dict, referencia: Dict, limite: float = 0.25, tolerancia_s: float = 0.005) -> List[Dict]:
+    """
+    Benchmarks que pioraram em relação à referência
+
+    Compara o tempo mínimo (o menos sujeito a ruído da máquina) de cada
+    benchmark presente nas duas execuções. Conta como regressão o que ficou
+    mais de limite (fração) e mais de tolerancia_s segundos mais lento, para
+    que ruído em tempos curtos não dispare.
+
+    Returns:
+        Lista de {'escala', 'benchmark', 'referencia_s', 'atual_s', 'variacao'}
+    """
+    regressoes = []
+    for escala, medicoes in atual['escalas'].items():
+        anteriores = referencia.get('escalas', {}).get(escala, {})
+        for nome, medicao in medicoes.items():
+            if nome not in anteriores:
+                continue
+            antes, agora = anteriores[nome]['minimo_s'], medicao['minimo_s']
+            if agora > antes * (1 + limite) and agora - antes > tolerancia_s:
+                regressoes.append({
+                    'escala': escala,
+                    'benchmark': nome,
+                    'referencia_s': antes,
+                    'atual_s': agora,
+                    'variacao': agora / antes - 1 if antes > 0 else float('inf'),
+                })
+    return regressoes
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _imprimir(resultados: Dict):
+    for escala, medicoes in resultados['escalas'].items():
+        print(f"\n{escala} ({medicoes['lote']['municipios']:,} municípios)")
+        for nome, medicao in medicoes.items():
+            extra = f"  ({medicao['por_municipio_us']:.2f} µs/município)" if 'por_municipio_us' in medicao else ''
+            print(f"  {nome:<18} {medicao['mediana_s'] * 1000:>10.2f} ms{extra}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks da calculadora FUNDEB")
+    parser.add_argument('--escalas', type=float, nargs='+', default=[1, 10],
+                        help="Múltiplos do tamanho nacional (ex.: 1 10 100)")
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--amostra-escalar', type=int, default=2000,
+                        help="Municípios medidos no cálculo escalar")
+    parser.add_argument('--saida', help="Grava os resultados em JSON")
+    parser.add_argument('--referencia', help="JSON de uma execução anterior para comparar")
+    parser.add_argument('--limite', type=float, default=0.25,
+                        help="Piora máxima tolerada (fração do tempo mínimo de referência)")
+    args = parser.parse_args(argv)
+
+    escalas = [int(e) if float(e).is_integer() else e for e in args.escalas]
+    resultados = executar(escalas, args.repeticoes, amostra_escalar=args.amostra_escalar)
+    _imprimir(resultados)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+
+    if args.referencia:
+        with open(args.referencia, 'r', encoding='utf-8') as f:
+            regressoes = comparar(resultados, json.load(f), args.limite)
+        for r in regressoes:
+            print(f"REGRESSÃO {r['escala']}/{r['benchmark']}: "
+                  f"{r['referencia_s'] * 1000:.2f} → {r['atual_s'] * 1000:.2f} ms (+{r['variacao']:.0%})",
+                  file=sys.stderr)
+        if regressoes:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Cache persistente de tabelas de resultados nacionais
+
+As chaves são endereçadas por conteúdo: hash da base de municípios, versão
+dos ponderadores e base nacional. Qualquer mudança em uma das entradas gera
+outra chave, então não há invalidação manual. O contexto nacional (limiares
+e totais) também é gravado, por hash da base e ponderadores, para que um
+worker novo carregue a base nacional sem varrê-la antes de consultar.
+
+Os resultados ficam em um LRU em memória e são gravados em um diretório
+local compartilhado entre processos (workers do Streamlit), com descarte
+dos menos usados por tamanho. Um worker novo carrega do disco o que outro
+já calculou.
+"""
+import io
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from base_municipios import BaseMunicipios
+from ponderadores import impressao_digital
+
+
+# Muda quando o formato dos resultados gravados muda
+VERSAO_CACHE = 1
+
+DIRETORIO_PADRAO = os.environ.get(
+    'FUNDEB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'fundeb_facil')
+)
+
+
+class CacheDisco:
+    """
+    Armazenamento chave → bytes em um diretório, com descarte LRU por tamanho
+
+    Cada entrada é um arquivo; a data de modificação marca o último uso. A
+    gravação é atômica (arquivo temporário + os.replace), então processos
+    concorrentes nunca leem uma entrada pela metade.
+    """
+
+    def __init__(self, diretorio: str, max_bytes: int):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.diretorio, f'{chave}.bin')
+
+    def ler(self, chave: str) -> Optional[bytes]:
+        """Conteúdo da entrada, ou None se ausente (ou descartada por outro processo)"""
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, 'rb') as f:
+                dados = f.read()
+            os.utime(caminho)
+            return dados
+        except FileNotFoundError:
+            return None
+
+    def gravar(self, chave: str, dados: bytes):
+        """Grava a entrada e descarta as menos usadas se o limite for excedido"""
+        descritor, temporario = tempfile.mkstemp(dir=self.diretorio, prefix='.tmp-')
+        try:
+            with os.fdopen(descritor, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, self._caminho(chave))
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+        self.descartar_excedente()
+
+    def remover(self, chave: str):
+        try:
+            os.remove(self._caminho(chave))
+        except FileNotFoundError:
+            pass
+
+    def descartar_excedente(self):
+        """Remove as entradas com uso mais antigo até caber em max_bytes"""
+        entradas = []
+        for nome in os.listdir(self.diretorio):
+            if not nome.endswith('.bin'):
+                continue
+            try:
+                info = os.stat(os.path.join(self.diretorio, nome))
+            except FileNotFoundError:
+                continue
+            entradas.append((info.st_mtime, info.st_size, nome))
+
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, nome in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.diretorio, nome))
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+
+
+class CacheResultados:
+    """
+    Cache de dois níveis (memória + disco) para resultados de calcular_lote
+
+    Exemplo:
+        cache = CacheResultados()
+        cache.carregar_base_nacional(calculadora, municipios)
+        lote = cache.calcular_lote(calculadora, municipios)
+
+    Os resultados devolvidos são cópias: alterá-los não muda o cache.
+    """
+
+    def __init__(
+        self,
+        diretorio: str = DIRETORIO_PADRAO,
+        max_bytes_memoria: int = 64 * 1024 * 1024,
+        max_bytes_disco: int = 512 * 1024 * 1024
+    ):
+        self.disco = CacheDisco(os.path.join(diretorio, 'resultados'), max_bytes_disco)
+        self.max_bytes_memoria = max_bytes_memoria
+        self._memoria: OrderedDict = OrderedDict()
+        self._bytes_memoria = 0
+        self._trava = threading.Lock()
+        self.acertos_memoria = 0
+        self.acertos_disco = 0
+        self.falhas = 0
+
+    @staticmethod
+    def chave(calculadora, municipios, operacao: str = 'lote') -> str:
+        """Chave de conteúdo: base × ponderadores × base nacional × operação"""
+        base = BaseMunicipios.como_base(municipios)
+        return impressao_digital([
+            VERSAO_CACHE,
+            operacao,
+            base.impressao_digital(),
+            calculadora.versao_ponderadores,
+            calculadora.identidade_contexto(),
+        ])
+
+    def carregar_base_nacional(self, calculadora, municipios) -> Dict[str, float]:
+        """
+        calculadora.carregar_base_nacional com o contexto nacional em cache
+
+        O contexto é guardado por hash da base e versão dos ponderadores; só é
+        resolvido (varrendo a base) em caso de falha.
+        """
+        base = BaseMunicipios.como_base(municipios)
+        chave = impressao_digital([
+            VERSAO_CACHE, 'contexto', base.impressao_digital(), calculadora.versao_ponderadores,
+        ])
+        contexto = self.obter_ou_calcular(chave, lambda: calculadora.resolver_contexto_nacional(base))
+        return calculadora.carregar_base_nacional(base, contexto)
+
+    def calcular_lote(self, calculadora, municipios) -> Dict:
+        """calcular_lote com cache; calcula e grava apenas em caso de falha"""
+        base = BaseMunicipios.como_base(municipios)
+        return self.obter_ou_calcular(
+            self.chave(calculadora, base),
+            lambda: calculadora.calcular_lote(base)
+        )
+
+    def obter_ou_calcular(self, chave: str, calcular: Callable[[], Dict]) -> Dict:
+        """Busca em memória, depois em disco; calcula e grava nos dois se ausente"""
+        with self._trava:
+            if chave in self._memoria:
+                self._memoria.move_to_end(chave)
+                self.acertos_memoria += 1
+                return _copiar(self._memoria[chave][0])
+
+        dados = self.disco.ler(chave)
+        if dados is not None:
+            try:
+                resultado = desserializar(dados)
+                self.acertos_disco += 1
+            except (ValueError, KeyError, OSError):
+                # Entrada corrompida: recalcula e sobrescreve
+                self.disco.remover(chave)
+                dados = None
+
+        if dados is None:
+            self.falhas += 1
+            resultado = calcular()
+            dados = serializar(resultado)
+            self.disco.gravar(chave, dados)
+
+        self._guardar_em_memoria(chave, resultado, len(dados))
+        return _copiar(resultado)
+
+    def _guardar_em_memoria(self, chave: str, resultado: Dict, tamanho: int):
+        with self._trava:
+            if chave in self._memoria:
+                return
+            self._memoria[chave] = (resultado, tamanho)
+            self._bytes_memoria += tamanho
+            while self._bytes_memoria > self.max_bytes_memoria and len(self._memoria) > 1:
+                _, (_, tamanho_removido) = self._memoria.popitem(last=False)
+                self._bytes_memoria -= tamanho_removido
+
+    def estatisticas(self) -> Dict[str, int]:
+        return {
+            'acertos_memoria': self.acertos_memoria,
+            'acertos_disco': self.acertos_disco,
+            'falhas': self.falhas,
+            'entradas_memoria': len(self._memoria),
+            'bytes_memoria': self._bytes_memoria,
+        }
+
+
+def _copiar(resultado):
+    """Cópia de dicionários, arrays e listas (escalares e tuplas são imutáveis)"""
+    if isinstance(resultado, dict):
+        return {chave: _copiar(valor) for chave, valor in resultado.items()}
+    if isinstance(resultado, np.ndarray):
+        return resultado.copy()
+    if isinstance(resultado, list):
+        return [_copiar(valor) for valor in resultado]
+    return resultado
+
+
+# ---------- Serialização (npz sem pickle) ----------
+
+def serializar(resultado: Dict) -> bytes:
+    """
+    Converte um dicionário aninhado de arrays, listas e escalares em bytes .npz
+
+    Arrays e listas viram arrays NumPy com a chave do caminho ('vaat/valor_total');
+    escalares e o tipo de cada sequência vão em um cabeçalho JSON.
+    """
+    arrays = {}
+    meta = {'escalares': {}, 'sequencias': {}}
+
+    def percorrer(prefixo, valor):
+        if isinstance(valor, dict):
+            if not valor:
+                meta['escalares'][prefixo] = {}
+            for chave, item in valor.items():
+                percorrer(f'{prefixo}/{chave}' if prefixo else chave, item)
+        elif isinstance(valor, np.ndarray):
+            arrays[prefixo] = valor
+        elif isinstance(valor, (list, tuple)):
+            arrays[prefixo] = np.asarray(valor)
+            meta['sequencias'][prefixo] = 'tupla' if isinstance(valor, tuple) else 'lista'
+        else:
+            meta['escalares'][prefixo] = valor.item() if isinstance(valor, np.generic) else valor
+
+    percorrer('', resultado)
+    arrays['__meta__'] = np.array(json.dumps(meta, ensure_ascii=False))
+
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def desserializar(dados: bytes) -> Dict:
+    """Inverso de serializar"""
+    resultado = {}
+
+    def inserir(caminho, valor):
+        partes = caminho.split('/')
+        destino = resultado
+        for parte in partes[:-1]:
+            destino = destino.setdefault(parte, {})
+        destino[partes[-1]] = valor
+
+    with np.load(io.BytesIO(dados), allow_pickle=False) as arquivo:
+        meta = json.loads(str(arquivo['__meta__']))
+        for caminho in arquivo.files:
+            if caminho == '__meta__':
+                continue
+            valor = arquivo[caminho]
+            tipo = meta['sequencias'].get(caminho)
+            if tipo == 'lista':
+                valor = valor.tolist()
+            elif tipo == 'tupla':
+                valor = tuple(valor.tolist())
+            inserir(caminho, valor)
+
+    for caminho, valor in meta['escalares'].items():
+        inserir(caminho, valor)
+    return resultado
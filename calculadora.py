@@ -1,17 +1,125 @@
 """
 Módulo de cálculo de complementações VAAT e VAAF do FUNDEB
 """
-import json
-from typing import Dict, Tuple
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+from base_municipios import ETAPAS, BaseMunicipios
+from metricas import cronometrar
+from ponderadores import TIPOS_COMPLEMENTACAO, ConjuntoPonderadores, obter_registro
+from resultados import ResultadoComplementacao, ResultadoMunicipio
+
+
+def resolver_redistribuicao(
+    valor_aluno: np.ndarray,
+    peso: np.ndarray,
+    orcamento
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encontra o limiar de valor por aluno que esgota o orçamento da complementação
+
+    Ordena os municípios pelo valor por aluno e eleva os menores a um patamar
+    comum T até o orçamento acabar: sum(peso_i * (T - valor_i)) = orcamento para
+    todo valor_i < T. Usa ordenação + somas prefixadas, em O(n log n).
+
+    Aceita arrays com dimensões extras à esquerda (ex.: cenários × municípios);
+    cada linha é resolvida de forma independente.
+
+    Args:
+        valor_aluno: Valor anual por aluno antes da complementação
+        peso: Matrículas ajustadas de cada município
+        orcamento: Valor total da complementação (escalar ou um por linha)
+
+    Returns:
+        Tupla (limiar, elegivel), com elegivel = valor_aluno < limiar
+    """
+    valor_aluno = np.asarray(valor_aluno, dtype=np.float64)
+    peso = np.asarray(peso, dtype=np.float64)
+    orcamento = np.asarray(orcamento, dtype=np.float64)
+
+    if valor_aluno.shape[-1] == 0:
+        return np.zeros(valor_aluno.shape[:-1]), np.zeros(valor_aluno.shape, dtype=bool)
+
+    # Municípios sem matrículas ajustadas não participam da redistribuição
+    valor_aluno = np.where(peso > 0, valor_aluno, np.inf)
+
+    ordem = np.argsort(valor_aluno, axis=-1)
+    valor_ordenado = np.take_along_axis(valor_aluno, ordem, axis=-1)
+    peso_ordenado = np.where(
+        np.isfinite(valor_ordenado), np.take_along_axis(peso, ordem, axis=-1), 0.0
+    )
+
+    peso_acumulado = np.cumsum(peso_ordenado, axis=-1)
+    receita_acumulada = np.cumsum(
+        peso_ordenado * np.where(peso_ordenado > 0, valor_ordenado, 0.0), axis=-1
+    )
+
+    with np.errstate(invalid='ignore'):
+        # Custo de elevar os k primeiros até o valor do k-ésimo
+        custo = valor_ordenado * peso_acumulado - receita_acumulada
+        preenchidos = np.sum(custo < orcamento[..., np.newaxis], axis=-1)
+
+    indice = np.maximum(preenchidos - 1, 0)[..., np.newaxis]
+    peso_k = np.take_along_axis(peso_acumulado, indice, axis=-1)[..., 0]
+    receita_k = np.take_along_axis(receita_acumulada, indice, axis=-1)[..., 0]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        limiar = np.where(
+            preenchidos > 0,
+            (orcamento + receita_k) / peso_k,
+            valor_ordenado[..., 0]
+        )
+
+    return limiar, valor_aluno < limiar[..., np.newaxis]
+
+
+# Posição de cada etapa nos vetores de ponderadores
+_POSICAO_ETAPA = {etapa: i for i, etapa in enumerate(ETAPAS)}
 
 
 class CalculadoraFUNDEB:
     """Calculadora de complementações VAAT e VAAF"""
 
-    def __init__(self):
-        """Inicializa calculadora carregando ponderadores"""
-        with open('dados/ponderadores.json', 'r', encoding='utf-8') as f:
-            self.ponderadores = json.load(f)
+    def __init__(self, conjunto_ponderadores: ConjuntoPonderadores = None):
+        """
+        Inicializa calculadora com um conjunto de ponderadores do registro
+
+        Args:
+            conjunto_ponderadores: Versão dos ponderadores (padrão: a vigente em
+                dados/ponderadores.json, carregada uma vez por processo)
+        """
+        self.conjunto_ponderadores = conjunto_ponderadores or obter_registro().obter()
+        self.ponderadores = self.conjunto_ponderadores.dados
+
+        # Ponderadores em vetores na ordem de ETAPAS (0 para etapa sem ponderador)
+        self.vetores_ponderadores = self.conjunto_ponderadores.vetores
+        self._etapas_ponderadas = {
+            tipo: frozenset(etapa for etapa in ETAPAS if etapa in self.ponderadores[tipo])
+            for tipo in TIPOS_COMPLEMENTACAO
+        }
+        self.versao_ponderadores = self.conjunto_ponderadores.versao
+
+        # Contexto nacional (limiares de elegibilidade, totais de matrículas
+        # ajustadas elegíveis e fração do orçamento), calculado uma vez por
+        # base de dados e versão de ponderadores
+        self.contexto_nacional = None
+        self._cache_contextos_nacionais = {}
+        self._origem_contexto = None
+
+    @property
+    def totais_nacionais(self) -> Dict[str, float]:
+        """Totais nacionais de matrículas ajustadas elegíveis da base carregada"""
+        if self.contexto_nacional is None:
+            return None
+        return self.contexto_nacional['totais']
+
+    @property
+    def limiares(self) -> Dict[str, float]:
+        """Limiares de valor por aluno encontrados para a base carregada"""
+        if self.contexto_nacional is None:
+            return None
+        return self.contexto_nacional['limiares']
 
     def calcular_fator_nse(self, nse: float) -> float:
         """
@@ -41,24 +149,35 @@ class CalculadoraFUNDEB:
         Returns:
             Dicionário com matrículas ajustadas por etapa
         """
-        ponderadores_tipo = self.ponderadores[tipo_complementacao]
-        fator_nse = self.calcular_fator_nse(nse)
-
-        matriculas_ajustadas = {}
+        vetor_matriculas = self._vetor_matriculas(matriculas)
 
-        for etapa, qtd_matriculas in matriculas.items():
-            if etapa in ponderadores_tipo:
-                # Ponderador base da etapa
-                ponderador_base = ponderadores_tipo[etapa]
+        # Ponderador final de cada etapa: ponderador_base * fator_nse * drec
+        ponderador_final = self.vetores_ponderadores[tipo_complementacao] * self.calcular_fator_nse(nse) * drec
+        ajustadas = (vetor_matriculas * ponderador_final).tolist()
 
-                # Aplica ajustes NSE e DRec
-                ponderador_final = ponderador_base * fator_nse * drec
+        ponderadores_tipo = self.ponderadores[tipo_complementacao]
+        return {
+            etapa: ajustadas[_POSICAO_ETAPA[etapa]]
+            for etapa in matriculas
+            if etapa in ponderadores_tipo and etapa in _POSICAO_ETAPA
+        }
 
-                # Calcula matrículas ajustadas
-                matriculas_ajustadas[etapa] = qtd_matriculas * ponderador_final
+    def calcular_total_ajustado(
+        self,
+        matriculas: Dict[str, int],
+        tipo_complementacao: str,
+        nse: float,
+        drec: float
+    ) -> float:
+        """Total de matrículas ajustadas do município (produto escalar com os ponderadores)"""
+        ponderador_final = self.vetores_ponderadores[tipo_complementacao] * self.calcular_fator_nse(nse) * drec
+        return float(self._vetor_matriculas(matriculas) @ ponderador_final)
 
-        return matriculas_ajustadas
+    def _vetor_matriculas(self, matriculas: Dict[str, int]) -> np.ndarray:
+        """Matrículas na ordem de ETAPAS (0 para etapa ausente)"""
+        return np.array([matriculas.get(etapa, 0) for etapa in ETAPAS], dtype=np.float64)
 
+    @cronometrar()
     def calcular_complementacao(
         self,
         municipio_data: Dict,
@@ -71,98 +190,971 @@ class CalculadoraFUNDEB:
         Args:
             municipio_data: Dados do município
             tipo_complementacao: 'vaat' ou 'vaaf'
-            total_matriculas_ajustadas_nacional: Total nacional (para cálculo proporcional)
+            total_matriculas_ajustadas_nacional: Total nacional (para cálculo proporcional).
+                Se omitido, usa o total da base carregada em carregar_base_nacional.
 
         Returns:
             Tupla (valor_complementacao, detalhamento_por_etapa)
         """
+        resultado = self._complementacao(
+            municipio_data, tipo_complementacao, total_matriculas_ajustadas_nacional
+        )
+        return resultado.valor_total, resultado.detalhamento
+
+    def _complementacao(
+        self,
+        municipio_data: Dict,
+        tipo_complementacao: str,
+        total_matriculas_ajustadas_nacional: float = None,
+        brutas: np.ndarray = None
+    ) -> ResultadoComplementacao:
+        """
+        Resultado compacto de um tipo (detalhamento por etapa sob demanda)
+
+        Args:
+            brutas: Matrículas na ordem de ETAPAS, para compartilhar entre VAAT e VAAF
+        """
+        matriculas = municipio_data['matriculas']
+        if brutas is None:
+            brutas = self._vetor_matriculas(matriculas)
+
+        # Matrículas ajustadas: ponderador_base * fator_nse * drec por etapa
+        ponderador_final = (
+            self.vetores_ponderadores[tipo_complementacao]
+            * self.calcular_fator_nse(municipio_data['nse']) * municipio_data['drec']
+        )
+        ajustadas = brutas * ponderador_final
+
+        # Etapas informadas que têm ponderador entram no total e no detalhamento
+        etapas = self._etapas_ponderadas[tipo_complementacao]
+        posicoes = [_POSICAO_ETAPA[etapa] for etapa in matriculas if etapa in etapas]
+        lista_ajustadas = ajustadas.tolist()
+        total_ajustado_municipio = sum(lista_ajustadas[i] for i in posicoes)
+
+        limiar = self.limiares[tipo_complementacao] if self.limiares else None
+        valor_aluno = self.calcular_valor_aluno(municipio_data, tipo_complementacao, total_ajustado_municipio)
+
         # Verifica elegibilidade
-        elegivel_key = f'elegivel_{tipo_complementacao}'
-        if not municipio_data.get(elegivel_key, False):
-            return 0.0, {}
+        if not self.avaliar_elegibilidade(municipio_data, tipo_complementacao, total_ajustado_municipio):
+            return ResultadoComplementacao(0.0, False, valor_aluno, limiar)
+
+        # Valor total da complementação nacional
+        total_complementacao_nacional = self._orcamento(tipo_complementacao)
+
+        if total_matriculas_ajustadas_nacional is None:
+            total_matriculas_ajustadas_nacional = self._total_nacional(
+                tipo_complementacao, total_ajustado_municipio
+            )
+
+        # Proporção do município no total e valor da complementação
+        proporcao = total_ajustado_municipio / total_matriculas_ajustadas_nacional
+        valor_complementacao = total_complementacao_nacional * proporcao
+
+        mascara = 0
+        for i in posicoes:
+            mascara |= 1 << i
+        return ResultadoComplementacao(
+            valor_complementacao, True, valor_aluno, limiar, brutas, ajustadas, mascara
+        )
+
+    @cronometrar()
+    def calcular_ambas_complementacoes(
+        self,
+        municipio_data: Dict,
+        totais_nacionais: Dict[str, float] = None
+    ) -> ResultadoMunicipio:
+        """
+        Calcula VAAT e VAAF para um município
+
+        Args:
+            municipio_data: Dados do município
+            totais_nacionais: Totais nacionais por tipo (ex.: de totais_com_delta).
+                Se omitido, usa a base carregada em carregar_base_nacional.
+
+        Returns:
+            ResultadoMunicipio (lido como dicionário: municipio, uf, vaat, vaaf,
+            total_complementacoes, matriculas_totais)
+        """
+        totais_nacionais = totais_nacionais or {}
+        brutas = self._vetor_matriculas(municipio_data['matriculas'])
+
+        vaat = self._complementacao(municipio_data, 'vaat', totais_nacionais.get('vaat'), brutas)
+        vaaf = self._complementacao(municipio_data, 'vaaf', totais_nacionais.get('vaaf'), brutas)
+
+        return ResultadoMunicipio(
+            municipio_data['nome'],
+            municipio_data['uf'],
+            vaat,
+            vaaf,
+            vaat.valor_total + vaaf.valor_total,
+            int(brutas.sum())
+        )
+
+    def _receita_estimada(self, tipo_complementacao: str, matriculas_totais, drec):
+        """
+        Estima a receita anual do município a partir da capacidade fiscal
+
+        Simplificação do MVP: o DRec é normalizado na faixa de ajustes_drec, de
+        modo que o piso da faixa recebe metade do valor de referência por aluno
+        e o teto recebe 1,5 vez esse valor. Funciona com escalares ou arrays.
+        """
+        drec_min, drec_max = self.ponderadores['ajustes_drec']['range']
+        referencia = self.ponderadores['valor_aluno_ano_referencia'][f'{tipo_complementacao}_2025']
+        return referencia * matriculas_totais * (0.5 + (drec - drec_min) / (drec_max - drec_min))
+
+    def calcular_valor_aluno(
+        self,
+        municipio_data: Dict,
+        tipo_complementacao: str,
+        total_ajustado_municipio: float = None
+    ) -> float:
+        """
+        Calcula o valor anual por matrícula ajustada antes da complementação
+
+        Usa receita_vaat/receita_vaaf do município quando informadas; caso
+        contrário, estima a receita pela capacidade fiscal (DRec).
+        """
+        if total_ajustado_municipio is None:
+            total_ajustado_municipio = self.calcular_total_ajustado(
+                municipio_data['matriculas'],
+                tipo_complementacao,
+                municipio_data['nse'],
+                municipio_data['drec']
+            )
+
+        if total_ajustado_municipio <= 0:
+            return float('inf')
+
+        receita = municipio_data.get(f'receita_{tipo_complementacao}')
+        if receita is None:
+            # Só etapas de ETAPAS, como na matriz de calcular_lote
+            receita = self._receita_estimada(
+                tipo_complementacao,
+                self._vetor_matriculas(municipio_data['matriculas']).sum(),
+                municipio_data['drec']
+            )
+
+        return receita / total_ajustado_municipio
+
+    def avaliar_elegibilidade(
+        self,
+        municipio_data: Dict,
+        tipo_complementacao: str,
+        total_ajustado_municipio: float = None
+    ) -> bool:
+        """
+        Verifica se o município recebe a complementação
+
+        Com base nacional carregada, o município é elegível quando seu valor por
+        aluno fica abaixo do limiar encontrado por resolver_redistribuicao. Sem
+        base, usa os indicadores elegivel_vaat/elegivel_vaaf dos dados.
+        """
+        if self.contexto_nacional is None:
+            return bool(municipio_data.get(f'elegivel_{tipo_complementacao}', False))
+
+        valor_aluno = self.calcular_valor_aluno(
+            municipio_data, tipo_complementacao, total_ajustado_municipio
+        )
+        return bool(valor_aluno < self.contexto_nacional['limiares'][tipo_complementacao])
+
+    def _orcamento(self, tipo_complementacao: str, contexto_nacional: Dict = None) -> float:
+        """Valor da complementação a distribuir entre os municípios da base"""
+        contexto_nacional = contexto_nacional or self.contexto_nacional
+        total = self.conjunto_ponderadores.complementacao_total(tipo_complementacao)
+        if contexto_nacional is None:
+            return total
+        return total * contexto_nacional['fracao_orcamento']
+
+    def _total_nacional(self, tipo_complementacao: str, total_ajustado_municipio):
+        """Total nacional de matrículas ajustadas elegíveis para o tipo"""
+        if self.totais_nacionais is not None:
+            return self.totais_nacionais[tipo_complementacao]
+
+        # Sem base nacional carregada, usa aproximação: assumindo que o município
+        # representa 0,02% do total elegível (simplificação do MVP)
+        return total_ajustado_municipio * 5000
 
-        # Calcula matrículas ajustadas
-        matriculas_ajustadas = self.calcular_matriculas_ajustadas(
+    def _contribuicao_nacional(self, municipio_data: Dict, tipo_complementacao: str) -> float:
+        """Matrículas ajustadas com que o município entra no total nacional"""
+        total_ajustado = self.calcular_total_ajustado(
             municipio_data['matriculas'],
             tipo_complementacao,
             municipio_data['nse'],
             municipio_data['drec']
         )
 
-        # Total de matrículas ajustadas do município
-        total_ajustado_municipio = sum(matriculas_ajustadas.values())
+        if not self.avaliar_elegibilidade(municipio_data, tipo_complementacao, total_ajustado):
+            return 0.0
+        return total_ajustado
 
-        # Valor total da complementação nacional
-        total_complementacao_nacional = self.ponderadores['complementacao_total'][f'{tipo_complementacao}_2025']
+    @cronometrar()
+    def resolver_contexto_nacional(self, municipios) -> Dict:
+        """
+        Resolve a redistribuição nacional de VAAT e VAAF para uma base
 
-        # Se não fornecido, usa aproximação (5% dos municípios são elegíveis)
-        if total_matriculas_ajustadas_nacional is None:
-            # Aproximação: assumindo que município representa 0,02% do total elegível
-            # (isso é simplificação para MVP - em produção usaríamos soma real)
-            total_matriculas_ajustadas_nacional = total_ajustado_municipio * 5000
+        Calcula o valor por aluno de cada município, encontra o limiar de
+        elegibilidade que esgota o orçamento e soma as matrículas ajustadas dos
+        elegíveis. Bases parciais (menos matrículas que a referência nacional)
+        recebem a fração proporcional do orçamento.
 
-        # Calcula proporção do município no total
-        proporcao = total_ajustado_municipio / total_matriculas_ajustadas_nacional
+        Args:
+            municipios: Lista de dicionários ou BaseMunicipios
 
-        # Valor da complementação
-        valor_complementacao = total_complementacao_nacional * proporcao
+        Returns:
+            Dicionário com 'limiares' e 'totais' por tipo e 'fracao_orcamento'
+        """
+        base = BaseMunicipios.como_base(municipios)
+        matriculas = self.empacotar_matriculas(base)
+        fator_nse, drec = self._fatores_lote(base)
+        matriculas_totais = matriculas.sum(axis=1)
 
-        # Detalhamento por etapa (quanto cada etapa contribuiu)
-        detalhamento = {}
-        for etapa, matriculas_ajustadas_etapa in matriculas_ajustadas.items():
-            proporcao_etapa = matriculas_ajustadas_etapa / total_ajustado_municipio
-            valor_etapa = valor_complementacao * proporcao_etapa
-
-            detalhamento[etapa] = {
-                'matriculas_brutas': municipio_data['matriculas'][etapa],
-                'matriculas_ajustadas': matriculas_ajustadas_etapa,
-                'valor_complementacao': valor_etapa,
-                'ponderador_efetivo': (
-                    matriculas_ajustadas_etapa / municipio_data['matriculas'][etapa]
-                    if municipio_data['matriculas'][etapa] > 0 else 0
-                )
+        referencia_nacional = self.ponderadores['matriculas_nacionais']['2025']
+        contexto = {
+            'limiares': {},
+            'totais': {},
+            'fracao_orcamento': min(1.0, float(matriculas_totais.sum()) / referencia_nacional),
+        }
+
+        for tipo in TIPOS_COMPLEMENTACAO:
+            total_ajustado = self._ajustar_lote(matriculas, tipo, fator_nse, drec).sum(axis=1)
+            valor_aluno = self._valor_aluno_lote(base, tipo, matriculas_totais, drec, total_ajustado)
+            limiar, elegivel = resolver_redistribuicao(
+                valor_aluno, total_ajustado, self._orcamento(tipo, contexto)
+            )
+            contexto['limiares'][tipo] = float(limiar)
+            contexto['totais'][tipo] = float(total_ajustado[elegivel].sum())
+
+        return contexto
+
+    def calcular_totais_nacionais(self, municipios) -> Dict[str, float]:
+        """
+        Soma as matrículas ajustadas dos municípios elegíveis, por tipo
+
+        O resultado é memorizado por impressão digital da base e versão dos
+        ponderadores, de modo que a mesma base não é varrida duas vezes.
+
+        Returns:
+            Dicionário {'vaat': total, 'vaaf': total}
+        """
+        return dict(self._contexto_memorizado(municipios)['totais'])
+
+    def _contexto_memorizado(self, municipios) -> Dict:
+        """Contexto nacional memorizado por base de dados e versão de ponderadores"""
+        base = BaseMunicipios.como_base(municipios)
+        chave = (base.impressao_digital(), self.versao_ponderadores)
+        if chave not in self._cache_contextos_nacionais:
+            self._cache_contextos_nacionais[chave] = self.resolver_contexto_nacional(base)
+        return self._cache_contextos_nacionais[chave]
+
+    def carregar_base_nacional(self, municipios, contexto_nacional: Dict = None) -> Dict[str, float]:
+        """
+        Define a base nacional usada para elegibilidade e denominador dos cálculos
+
+        Args:
+            municipios: Lista de dicionários ou BaseMunicipios
+            contexto_nacional: Contexto já resolvido para esta base e estes
+                ponderadores (ex.: lido do cache em disco); evita a varredura
+
+        Returns:
+            Totais nacionais por tipo
+        """
+        base = BaseMunicipios.como_base(municipios)
+        chave = (base.impressao_digital(), self.versao_ponderadores)
+        if contexto_nacional is not None:
+            self._cache_contextos_nacionais[chave] = contexto_nacional
+        self.contexto_nacional = self._contexto_memorizado(base)
+        self._origem_contexto = (chave, self.contexto_nacional)
+        return dict(self.contexto_nacional['totais'])
+
+    def identidade_contexto(self):
+        """
+        Identifica o contexto nacional em uso sem serializá-lo
+
+        [impressão digital da base nacional, versão dos ponderadores] quando o
+        contexto veio de carregar_base_nacional; o próprio contexto se foi
+        atribuído de outra forma; None sem base nacional.
+        """
+        if self.contexto_nacional is None:
+            return None
+        if self._origem_contexto is not None and self._origem_contexto[1] is self.contexto_nacional:
+            return list(self._origem_contexto[0])
+        return self.contexto_nacional
+
+    @cronometrar()
+    def totais_com_delta(
+        self,
+        municipio_original: Dict,
+        municipio_simulado: Dict,
+        totais_nacionais: Dict[str, float] = None
+    ) -> Dict[str, float]:
+        """
+        Atualiza os totais nacionais pela variação de um único município
+
+        Custa O(etapas): soma a diferença entre a contribuição simulada e a
+        original, sem varrer a base novamente. Não altera a base carregada.
+
+        Args:
+            municipio_original: Dados do município como estão na base
+            municipio_simulado: Mesmo município com matrículas alteradas
+            totais_nacionais: Totais de partida (padrão: base carregada)
+
+        Returns:
+            Novos totais nacionais por tipo
+        """
+        totais = dict(totais_nacionais or self.totais_nacionais)
+        for tipo in TIPOS_COMPLEMENTACAO:
+            totais[tipo] += (
+                self._contribuicao_nacional(municipio_simulado, tipo)
+                - self._contribuicao_nacional(municipio_original, tipo)
+            )
+        return totais
+
+    def empacotar_matriculas(self, municipios) -> np.ndarray:
+        """
+        Empacota matrículas em matriz municípios × etapas (ordem de ETAPAS)
+
+        Aceita lista de dicionários (etapas ausentes valem 0) ou BaseMunicipios,
+        cuja coluna de matrículas é usada diretamente.
+        """
+        return BaseMunicipios.como_base(municipios).matriculas.astype(np.float64)
+
+    def _fatores_lote(self, base: BaseMunicipios) -> Tuple[np.ndarray, np.ndarray]:
+        """Vetores (fator_nse, drec) dos municípios"""
+        nse = np.asarray(base.colunas['nse'], dtype=np.float64)
+        drec = np.asarray(base.colunas['drec'], dtype=np.float64)
+        return np.clip(0.95 + (nse / 1000), 0.95, 1.05), drec
+
+    def _valor_aluno_lote(
+        self,
+        base: BaseMunicipios,
+        tipo: str,
+        matriculas_totais: np.ndarray,
+        drec: np.ndarray,
+        total_ajustado: np.ndarray
+    ) -> np.ndarray:
+        """Vetor de valor por aluno (mesma regra de calcular_valor_aluno)"""
+        receita_informada = base.colunas[f'receita_{tipo}']
+        receita = np.where(
+            np.isnan(receita_informada),
+            self._receita_estimada(tipo, matriculas_totais, drec),
+            receita_informada
+        )
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(total_ajustado > 0, receita / total_ajustado, np.inf)
+
+    def _elegibilidade_lote(
+        self,
+        base: BaseMunicipios,
+        tipo: str,
+        valor_aluno: np.ndarray,
+        contexto_nacional: Dict = None
+    ) -> np.ndarray:
+        """Vetor booleano de elegibilidade (mesma regra de avaliar_elegibilidade)"""
+        if contexto_nacional is None:
+            return np.array(base.colunas[f'elegivel_{tipo}'], dtype=bool)
+        return valor_aluno < contexto_nacional['limiares'][tipo]
+
+    def _ajustar_lote(
+        self,
+        matriculas: np.ndarray,
+        tipo: str,
+        fator_nse: np.ndarray,
+        drec: np.ndarray
+    ) -> np.ndarray:
+        """Matriz de matrículas ajustadas (municípios × etapas)"""
+        # Mesmo arranjo do cálculo escalar: ponderador_base * fator_nse * drec
+        ponderador_final = (
+            self.vetores_ponderadores[tipo][np.newaxis, :]
+            * fator_nse[:, np.newaxis]
+            * drec[:, np.newaxis]
+        )
+        return matriculas * ponderador_final
+
+    @cronometrar()
+    def calcular_lote(
+        self,
+        municipios,
+        contexto_nacional: Dict = None
+    ) -> Dict:
+        """
+        Calcula VAAT e VAAF para vários municípios em uma única passada vetorizada
+
+        Produz os mesmos valores de calcular_ambas_complementacoes, mas com
+        operações sobre a matriz municípios × etapas em vez de laços por dicionário.
+
+        Args:
+            municipios: Lista de dados de municípios (mesmo formato de municipios.json)
+                ou BaseMunicipios
+            contexto_nacional: Limiares e totais nacionais (padrão: base carregada)
+
+        Returns:
+            Dicionário com listas de identificação e arrays NumPy:
+            matriculas (n × etapas), matriculas_totais (n), e para 'vaat'/'vaaf'
+            elegivel, valor_aluno_ano, limiar, matriculas_ajustadas (n × etapas),
+            total_ajustado, valor_total e valor_por_etapa (n × etapas)
+        """
+        base = BaseMunicipios.como_base(municipios)
+        matriculas = self.empacotar_matriculas(base)
+        fator_nse, drec = self._fatores_lote(base)
+        matriculas_totais = matriculas.sum(axis=1)
+        contexto_nacional = contexto_nacional or self.contexto_nacional
+
+        resultado = {
+            'codigo_ibge': base.colunas['codigo_ibge'].tolist(),
+            'municipio': base.colunas['nome'].tolist(),
+            'uf': base.siglas_uf.tolist(),
+            'etapas': ETAPAS,
+            'matriculas': matriculas,
+            'matriculas_totais': matriculas_totais,
+        }
+
+        total_complementacoes = np.zeros(len(base), dtype=np.float64)
+        for tipo in TIPOS_COMPLEMENTACAO:
+            ajustadas = self._ajustar_lote(matriculas, tipo, fator_nse, drec)
+            total_ajustado = ajustadas.sum(axis=1)
+            valor_aluno = self._valor_aluno_lote(base, tipo, matriculas_totais, drec, total_ajustado)
+            elegivel = self._elegibilidade_lote(base, tipo, valor_aluno, contexto_nacional)
+
+            if contexto_nacional is None:
+                # Sem base nacional, usa a mesma aproximação do cálculo escalar
+                total_nacional = total_ajustado * 5000
+            else:
+                total_nacional = np.float64(contexto_nacional['totais'][tipo])
+            total_complementacao_nacional = self._orcamento(tipo, contexto_nacional)
+
+            proporcao = np.divide(
+                total_ajustado, total_nacional,
+                out=np.zeros_like(total_ajustado), where=total_nacional > 0
+            )
+            valor_total = np.where(elegivel, total_complementacao_nacional * proporcao, 0.0)
+
+            proporcao_etapa = np.divide(
+                ajustadas, total_ajustado[:, np.newaxis],
+                out=np.zeros_like(ajustadas), where=total_ajustado[:, np.newaxis] > 0
+            )
+            valor_por_etapa = valor_total[:, np.newaxis] * proporcao_etapa
+
+            resultado[tipo] = {
+                'elegivel': elegivel,
+                'valor_aluno_ano': valor_aluno,
+                'limiar': None if contexto_nacional is None else contexto_nacional['limiares'][tipo],
+                'matriculas_ajustadas': ajustadas,
+                'total_ajustado': total_ajustado,
+                'valor_total': valor_total,
+                'valor_por_etapa': valor_por_etapa,
             }
+            total_complementacoes += valor_total
 
-        return valor_complementacao, detalhamento
+        resultado['total_complementacoes'] = total_complementacoes
+        return resultado
 
-    def calcular_ambas_complementacoes(self, municipio_data: Dict) -> Dict:
+    def calcular_cenario_nacional(self, municipios) -> Dict:
         """
-        Calcula VAAT e VAAF para um município
+        Recalcula a redistribuição e os valores para um cenário nacional inteiro
+
+        Diferente de calcular_lote, não usa a base carregada: os limiares de
+        elegibilidade e o denominador são resolvidos para os próprios municípios
+        do cenário (ex.: base nacional com matrículas projetadas).
 
         Returns:
-            Dicionário com resultados completos
+            Mesmo formato de calcular_lote, com 'contexto_nacional' resolvido
         """
-        valor_vaat, detalhe_vaat = self.calcular_complementacao(
-            municipio_data, 'vaat'
+        base = BaseMunicipios.como_base(municipios)
+        contexto_nacional = self.resolver_contexto_nacional(base)
+        resultado = self.calcular_lote(base, contexto_nacional)
+        resultado['contexto_nacional'] = contexto_nacional
+        return resultado
+
+    @cronometrar()
+    def calcular_cenarios(
+        self,
+        municipios,
+        nse: np.ndarray = None,
+        drec: np.ndarray = None,
+        fator_matriculas: np.ndarray = None,
+        pesos: Dict[str, np.ndarray] = None,
+        orcamentos: Dict[str, np.ndarray] = None,
+        fator_receita: np.ndarray = None
+    ) -> Dict:
+        """
+        Resolve vários cenários nacionais de uma vez (uma linha por cenário)
+
+        Cada cenário substitui NSE/DRec dos municípios e multiplica as matrículas
+        de cada etapa; a redistribuição (limiar, elegibilidade e denominador) é
+        resolvida linha a linha, sem laço em Python.
+
+        Args:
+            municipios: Lista de dicionários ou BaseMunicipios
+            nse: NSE por cenário × município (padrão: o da base)
+            drec: DRec por cenário × município (padrão: o da base)
+            fator_matriculas: Multiplicador por cenário × etapa (padrão: 1)
+            pesos: Ponderadores por tipo, cenário × etapa (padrão: os da calculadora)
+            orcamentos: Complementação total por tipo, um valor por cenário
+                (padrão: a do conjunto de ponderadores)
+            fator_receita: Multiplicador da receita por cenário (padrão: 1)
+
+        Returns:
+            Dicionário por tipo com valor_total e total_ajustado (cenários ×
+            municípios), limiar e denominador (cenários)
+        """
+        base = BaseMunicipios.como_base(municipios)
+        matriculas = self.empacotar_matriculas(base)
+        fator_nse_base, drec_base = self._fatores_lote(base)
+
+        if nse is None:
+            fator_nse = fator_nse_base[np.newaxis, :]
+        else:
+            fator_nse = np.clip(0.95 + (np.asarray(nse, dtype=np.float64) / 1000), 0.95, 1.05)
+        drec = drec_base[np.newaxis, :] if drec is None else np.asarray(drec, dtype=np.float64)
+        if fator_matriculas is None:
+            fator_matriculas = np.ones((1, len(ETAPAS)))
+        fator_matriculas = np.asarray(fator_matriculas, dtype=np.float64)
+
+        pesos = pesos or {}
+        orcamentos = orcamentos or {}
+        fator_receita = np.ones(1) if fator_receita is None else np.asarray(fator_receita, dtype=np.float64)
+
+        n_cenarios = max(
+            fator_nse.shape[0], drec.shape[0], fator_matriculas.shape[0], len(fator_receita),
+            *(np.shape(p)[0] for p in pesos.values()),
+            *(np.size(o) for o in orcamentos.values())
         )
+        forma = (n_cenarios, len(base))
+        fator_nse = np.broadcast_to(fator_nse, forma)
+        drec = np.broadcast_to(drec, forma)
+        fator_matriculas = np.broadcast_to(fator_matriculas, (n_cenarios, len(ETAPAS)))
 
-        valor_vaaf, detalhe_vaaf = self.calcular_complementacao(
-            municipio_data, 'vaaf'
+        # Produto matriz × vetor por cenário, sem materializar cenários × municípios × etapas
+        matriculas_totais = fator_matriculas @ matriculas.T
+        fracao_orcamento = np.minimum(
+            1.0, matriculas_totais.sum(axis=1) / self.ponderadores['matriculas_nacionais']['2025']
         )
 
+        resultado = {}
+        for tipo in TIPOS_COMPLEMENTACAO:
+            pesos_tipo = np.atleast_2d(pesos.get(tipo, self.vetores_ponderadores[tipo]))
+            total_ajustado = ((fator_matriculas * pesos_tipo) @ matriculas.T) * fator_nse * drec
+
+            receita_informada = base.colunas[f'receita_{tipo}']
+            receita = np.where(
+                np.isnan(receita_informada),
+                self._receita_estimada(tipo, matriculas_totais, drec),
+                receita_informada
+            ) * fator_receita[:, np.newaxis]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                valor_aluno = np.where(total_ajustado > 0, receita / total_ajustado, np.inf)
+
+            orcamento = np.asarray(
+                orcamentos.get(tipo, self.conjunto_ponderadores.complementacao_total(tipo)),
+                dtype=np.float64
+            ) * fracao_orcamento
+            limiar, elegivel = resolver_redistribuicao(valor_aluno, total_ajustado, orcamento)
+
+            denominador = np.where(elegivel, total_ajustado, 0.0).sum(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                valor_total = np.where(
+                    elegivel, orcamento[:, np.newaxis] * total_ajustado / denominador[:, np.newaxis], 0.0
+                )
+
+            resultado[tipo] = {
+                'valor_total': valor_total,
+                'total_ajustado': total_ajustado,
+                'limiar': limiar,
+                'denominador': denominador,
+            }
+
+        return resultado
+
+    @cronometrar()
+    def calcular_sensibilidade(
+        self,
+        municipios,
+        contexto_nacional: Dict = None,
+        matriculas_extras: float = 1
+    ) -> Dict:
+        """
+        Valor marginal de matrículas extras em cada etapa, para todos os municípios
+
+        Forma fechada, em uma passada vetorizada: as matrículas ajustadas são
+        lineares nas matrículas (A' = A + k·c, com c = ponderador × fator NSE ×
+        DRec), então o valor depois de k matrículas extras sai direto de
+        B·A'/D'. O denominador nacional D' muda pela contribuição do próprio
+        município, como em totais_com_delta (D' = D − A + A' se elegível), e a
+        elegibilidade é reavaliada com o novo valor por aluno (a receita
+        estimada cresce com as matrículas). Para k → 0 e elegibilidade
+        inalterada, o valor por matrícula tende a B·c·(D − A)/D².
+
+        Args:
+            municipios: Lista de dicionários ou BaseMunicipios
+            contexto_nacional: Limiares e totais nacionais (padrão: base carregada)
+            matriculas_extras: Matrículas acrescentadas por etapa (k)
+
+        Returns:
+            Dicionário com codigo_ibge, municipio, uf e etapas; para 'vaat'/'vaaf'
+            valor_por_matricula (municípios × etapas, em R$ por matrícula extra)
+            e muda_elegibilidade (municípios × etapas); e valor_por_matricula_total
+        """
+        base = BaseMunicipios.como_base(municipios)
+        matriculas = self.empacotar_matriculas(base)
+        fator_nse, drec = self._fatores_lote(base)
+        matriculas_totais = matriculas.sum(axis=1)
+        contexto_nacional = contexto_nacional or self.contexto_nacional
+        k = float(matriculas_extras)
+
+        resultado = {
+            'codigo_ibge': base.colunas['codigo_ibge'].tolist(),
+            'municipio': base.colunas['nome'].tolist(),
+            'uf': base.siglas_uf.tolist(),
+            'etapas': ETAPAS,
+        }
+
+        def valor(total_ajustado, denominador, elegivel):
+            proporcao = np.divide(
+                total_ajustado, denominador,
+                out=np.zeros(np.broadcast(total_ajustado, denominador).shape), where=denominador > 0
+            )
+            return np.where(elegivel, orcamento * proporcao, 0.0)
+
+        valor_total_geral = np.zeros(matriculas.shape, dtype=np.float64)
+        for tipo in TIPOS_COMPLEMENTACAO:
+            orcamento = self._orcamento(tipo, contexto_nacional)
+            # Matrículas ajustadas por matrícula extra de cada etapa (municípios × etapas)
+            coeficiente = self._ajustar_lote(np.ones_like(matriculas), tipo, fator_nse, drec)
+            total_ajustado = (matriculas * coeficiente).sum(axis=1)
+            novo_total = total_ajustado[:, np.newaxis] + k * coeficiente
+
+            valor_aluno = self._valor_aluno_lote(base, tipo, matriculas_totais, drec, total_ajustado)
+            elegivel = self._elegibilidade_lote(base, tipo, valor_aluno, contexto_nacional)
+            if contexto_nacional is None:
+                # Sem base nacional: mesma aproximação do cálculo escalar e elegibilidade dos dados
+                denominador = total_ajustado * 5000
+                novo_denominador = novo_total * 5000
+                novo_elegivel = np.broadcast_to(elegivel[:, np.newaxis], novo_total.shape)
+            else:
+                receita_informada = base.colunas[f'receita_{tipo}']
+                nova_receita = np.where(
+                    np.isnan(receita_informada),
+                    self._receita_estimada(tipo, matriculas_totais + k, drec),
+                    receita_informada
+                )[:, np.newaxis]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    novo_valor_aluno = np.where(novo_total > 0, nova_receita / novo_total, np.inf)
+                novo_elegivel = novo_valor_aluno < contexto_nacional['limiares'][tipo]
+
+                denominador = np.float64(contexto_nacional['totais'][tipo])
+                novo_denominador = (
+                    denominador - np.where(elegivel, total_ajustado, 0.0)[:, np.newaxis]
+                    + np.where(novo_elegivel, novo_total, 0.0)
+                )
+
+            variacao = (
+                valor(novo_total, novo_denominador, novo_elegivel)
+                - valor(total_ajustado, denominador, elegivel)[:, np.newaxis]
+            )
+            resultado[tipo] = {
+                'valor_por_matricula': variacao / k,
+                'muda_elegibilidade': novo_elegivel != elegivel[:, np.newaxis],
+            }
+            valor_total_geral += variacao / k
+
+        resultado['valor_por_matricula_total'] = valor_total_geral
+        return resultado
+
+    # ---------- Metas: matrículas necessárias e distância da elegibilidade ----------
+
+    def _parametros_meta(self, base: BaseMunicipios, tipo: str, contexto_nacional: Dict) -> Dict:
+        """
+        Termos da forma fechada de um tipo, em função de k matrículas extras
+
+        Matrículas ajustadas x(k) = A + k·c e receita R(k) = R0 + k·s (s > 0
+        só quando a receita é estimada pelas matrículas). Elegível enquanto
+        R(k)/x(k) < L; o valor é B·x/(outros + x), com 'outros' = total
+        nacional sem o próprio município.
+        """
+        matriculas = self.empacotar_matriculas(base)
+        fator_nse, drec = self._fatores_lote(base)
+        matriculas_totais = matriculas.sum(axis=1)
+        coeficientes = self._ajustar_lote(np.ones_like(matriculas), tipo, fator_nse, drec)
+        total_ajustado = self._ajustar_lote(matriculas, tipo, fator_nse, drec).sum(axis=1)
+
+        receita_informada = base.colunas[f'receita_{tipo}']
+        estimada = np.isnan(receita_informada)
+        valor_aluno = self._valor_aluno_lote(base, tipo, matriculas_totais, drec, total_ajustado)
+        elegivel = valor_aluno < contexto_nacional['limiares'][tipo]
         return {
-            'municipio': municipio_data['nome'],
-            'uf': municipio_data['uf'],
-            'vaat': {
-                'valor_total': valor_vaat,
-                'elegivel': municipio_data.get('elegivel_vaat', False),
-                'detalhamento': detalhe_vaat
-            },
-            'vaaf': {
-                'valor_total': valor_vaaf,
-                'elegivel': municipio_data.get('elegivel_vaaf', False),
-                'detalhamento': detalhe_vaaf
-            },
-            'total_complementacoes': valor_vaat + valor_vaaf,
-            'matriculas_totais': sum(municipio_data['matriculas'].values())
+            'A': total_ajustado,
+            'coeficientes': coeficientes,
+            'R0': np.where(estimada, self._receita_estimada(tipo, matriculas_totais, drec), receita_informada),
+            's': np.where(estimada, self._receita_estimada(tipo, 1.0, drec), 0.0),
+            'L': contexto_nacional['limiares'][tipo],
+            'B': self._orcamento(tipo, contexto_nacional),
+            'outros': contexto_nacional['totais'][tipo] - np.where(elegivel, total_ajustado, 0.0),
+            'elegivel': elegivel,
+            'valor_aluno': valor_aluno,
         }
 
+    @staticmethod
+    def _elegivel_com_extras(p: Dict, c: np.ndarray, k: np.ndarray) -> np.ndarray:
+        x = p['A'] + k * c
+        with np.errstate(divide='ignore', invalid='ignore'):
+            valor_aluno = np.where(x > 0, (p['R0'] + k * p['s']) / x, np.inf)
+        return valor_aluno < p['L']
+
+    @classmethod
+    def _valor_com_extras(cls, p: Dict, c: np.ndarray, k: np.ndarray) -> np.ndarray:
+        x = p['A'] + k * c
+        denominador = p['outros'] + x
+        proporcao = np.divide(x, denominador, out=np.zeros_like(x), where=denominador > 0)
+        return np.where(cls._elegivel_com_extras(p, c, k), p['B'] * proporcao, 0.0)
+
+    @classmethod
+    def _virada_elegibilidade(cls, p: Dict, c: np.ndarray, limite: int) -> np.ndarray:
+        """
+        Menor k ≥ 1 em que a elegibilidade muda (limite + 1 se não muda)
+
+        Elegível ⟺ h(k) = L·x(k) − R(k) > 0, e h é linear em k: a virada
+        sai de uma divisão, seguida de um ajuste de ±1 contra o arredondamento.
+        """
+        h0 = p['L'] * p['A'] - p['R0']
+        inclinacao = p['L'] * c - p['s']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            perde = np.where(p['elegivel'] & (inclinacao < 0), np.ceil(h0 / -inclinacao), np.inf)
+            ganha = np.where(~p['elegivel'] & (inclinacao > 0), np.floor(-h0 / inclinacao) + 1, np.inf)
+        k = np.clip(np.minimum(perde, ganha), 1, limite + 1).astype(np.int64)
+
+        virou = cls._elegivel_com_extras(p, c, k) != p['elegivel']
+        k = np.where(~virou & (k <= limite), k + 1, k)
+        anterior = np.maximum(k - 1, 1)
+        k = np.where((k > 1) & (cls._elegivel_com_extras(p, c, anterior) != p['elegivel']), anterior, k)
+        return k
+
+    @cronometrar()
+    def resolver_matriculas(
+        self,
+        municipios,
+        etapa: str,
+        valor_alvo,
+        tipo: str = 'total',
+        contexto_nacional: Dict = None,
+        limite: int = 1_000_000
+    ) -> Dict:
+        """
+        Menor número de matrículas extras em uma etapa para atingir um valor
+
+        Entre duas viradas de elegibilidade (forma fechada) o valor só cresce
+        com as matrículas, então a busca anda segmento a segmento: para VAAT
+        ou VAAF isolados a meta sai de B·x/(outros + x) ≥ alvo; para o total,
+        que soma dois termos com viradas próprias, usa bisseção inteira dentro
+        do segmento. Tudo vetorizado sobre os municípios.
+
+        Args:
+            municipios: Lista de dicionários ou BaseMunicipios
+            etapa: Etapa que recebe as matrículas (uma de ETAPAS)
+            valor_alvo: Valor desejado em R$ (escalar ou um por município)
+            tipo: 'vaat', 'vaaf' ou 'total'
+            contexto_nacional: Limiares e totais nacionais (padrão: base carregada)
+            limite: Maior número de matrículas extras considerado
+
+        Returns:
+            Dicionário com codigo_ibge, municipio, uf, matriculas_extras (-1 se a
+            meta não é alcançada até o limite), valor_atual e valor_final
+        """
+        if etapa not in _POSICAO_ETAPA:
+            raise ValueError(f"Etapa desconhecida: {etapa}")
+        if tipo != 'total' and tipo not in TIPOS_COMPLEMENTACAO:
+            raise ValueError(f"Tipo desconhecido: {tipo}")
+        contexto_nacional = contexto_nacional or self.contexto_nacional
+        if contexto_nacional is None:
+            raise ValueError("Metas exigem a base nacional (carregar_base_nacional ou contexto_nacional)")
+
+        base = BaseMunicipios.como_base(municipios)
+        n = len(base)
+        posicao = _POSICAO_ETAPA[etapa]
+        termos = []
+        for tipo_termo in (TIPOS_COMPLEMENTACAO if tipo == 'total' else (tipo,)):
+            p = self._parametros_meta(base, tipo_termo, contexto_nacional)
+            termos.append((p, p['coeficientes'][:, posicao]))
+
+        def valor(k):
+            return sum(self._valor_com_extras(p, c, k) for p, c in termos)
+
+        alvo = np.broadcast_to(np.asarray(valor_alvo, dtype=np.float64), (n,))
+        zero = np.zeros(n, dtype=np.int64)
+        fronteiras = np.sort(np.column_stack(
+            [zero]
+            + [self._virada_elegibilidade(p, c, limite) for p, c in termos]
+            + [np.full(n, limite + 1, dtype=np.int64)]
+        ), axis=1)
+
+        resposta = np.full(n, -1, dtype=np.int64)
+        for j in range(fronteiras.shape[1] - 1):
+            inicio, fim = fronteiras[:, j], fronteiras[:, j + 1]
+            ultimo = np.maximum(fim - 1, inicio)
+            alcanca = (resposta < 0) & (inicio < fim) & (valor(ultimo) >= alvo)
+            if not alcanca.any():
+                continue
+
+            if len(termos) == 1:
+                p, c = termos[0]
+                # Elegível no segmento: B·x/(outros + x) ≥ alvo ⟺ x ≥ alvo·outros/(B − alvo)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    x_necessario = np.where(alvo < p['B'], alvo * p['outros'] / (p['B'] - alvo), np.inf)
+                    k = np.where(c > 0, np.ceil((x_necessario - p['A']) / c),
+                                 np.where(x_necessario <= p['A'], 0, np.inf))
+                k = np.where(self._elegivel_com_extras(p, c, inicio), k, inicio)
+                k = np.clip(np.nan_to_num(k, posinf=limite + 1), inicio, ultimo).astype(np.int64)
+            else:
+                # Bisseção inteira: menor k em [inicio, ultimo] com valor(k) ≥ alvo
+                baixo, alto = inicio.copy(), ultimo.copy()
+                while np.any(alcanca & (baixo < alto)):
+                    meio = (baixo + alto) // 2
+                    atingiu = valor(meio) >= alvo
+                    alto = np.where(atingiu, meio, alto)
+                    baixo = np.where(atingiu, baixo, meio + 1)
+                k = baixo
+            resposta = np.where(alcanca, k, resposta)
+
+        # Ajuste de ±1 contra arredondamento na forma fechada
+        encontrada = resposta >= 0
+        resposta = np.where(encontrada & (valor(resposta) < alvo), resposta + 1, resposta)
+        anterior = np.maximum(resposta - 1, 0)
+        resposta = np.where(encontrada & (resposta > 0) & (valor(anterior) >= alvo), anterior, resposta)
+
+        return {
+            'codigo_ibge': base.colunas['codigo_ibge'].tolist(),
+            'municipio': base.colunas['nome'].tolist(),
+            'uf': base.siglas_uf.tolist(),
+            'etapa': etapa,
+            'tipo': tipo,
+            'matriculas_extras': resposta,
+            'valor_atual': valor(zero),
+            'valor_final': np.where(encontrada, valor(np.maximum(resposta, 0)), np.nan),
+        }
+
+    @cronometrar()
+    def distancia_elegibilidade(
+        self,
+        municipios,
+        tipo: str = 'vaat',
+        contexto_nacional: Dict = None,
+        limite: int = 1_000_000
+    ) -> Dict:
+        """
+        Quanto falta para cada município ficar elegível (ou deixar de ser)
+
+        Args:
+            municipios: Lista de dicionários ou BaseMunicipios
+            tipo: 'vaat' ou 'vaaf'
+            contexto_nacional: Limiares e totais nacionais (padrão: base carregada)
+            limite: Maior número de matrículas extras considerado
+
+        Returns:
+            Dicionário com codigo_ibge, municipio, uf, elegivel, valor_aluno_ano,
+            limiar, diferenca_valor_aluno (valor por aluno − limiar),
+            receita_acima_limiar (R$ de receita além do limiar, 0 se elegível) e
+            matriculas_extras (municípios × ETAPAS: menor número de matrículas
+            em cada etapa que torna o município elegível; 0 se já é, -1 se não
+            torna até o limite)
+        """
+        if tipo not in TIPOS_COMPLEMENTACAO:
+            raise ValueError(f"Tipo desconhecido: {tipo}")
+        contexto_nacional = contexto_nacional or self.contexto_nacional
+        if contexto_nacional is None:
+            raise ValueError("Elegibilidade exige a base nacional (carregar_base_nacional ou contexto_nacional)")
+
+        base = BaseMunicipios.como_base(municipios)
+        p = self._parametros_meta(base, tipo, contexto_nacional)
+        matriculas_extras = np.zeros(p['coeficientes'].shape, dtype=np.int64)
+        for posicao in range(len(ETAPAS)):
+            virada = self._virada_elegibilidade(p, p['coeficientes'][:, posicao], limite)
+            matriculas_extras[:, posicao] = np.where(
+                p['elegivel'], 0, np.where(virada <= limite, virada, -1)
+            )
+
+        return {
+            'codigo_ibge': base.colunas['codigo_ibge'].tolist(),
+            'municipio': base.colunas['nome'].tolist(),
+            'uf': base.siglas_uf.tolist(),
+            'etapas': ETAPAS,
+            'elegivel': p['elegivel'],
+            'valor_aluno_ano': p['valor_aluno'],
+            'limiar': p['L'],
+            'diferenca_valor_aluno': p['valor_aluno'] - p['L'],
+            'receita_acima_limiar': np.maximum(p['R0'] - p['L'] * p['A'], 0.0),
+            'matriculas_extras': matriculas_extras,
+        }
+
+
+def _finito(valor) -> float:
+    """float do valor, ou None se infinito/NaN"""
+    valor = float(valor)
+    return valor if np.isfinite(valor) else None
+
+
+def registros_lote(lote: Dict) -> Iterator[Dict]:
+    """
+    Um dicionário por município a partir do resultado de calcular_lote
+
+    Formato compacto (sem detalhamento por etapa), com tipos nativos do
+    Python, pronto para JSON: codigo_ibge, municipio, uf, vaat/vaaf
+    (valor_total, elegivel, valor_aluno_ano), total_complementacoes e
+    matriculas_totais. valor_aluno_ano infinito (sem matrículas) vira None.
+    """
+    for j in range(len(lote['municipio'])):
+        registro = {
+            'codigo_ibge': lote['codigo_ibge'][j],
+            'municipio': lote['municipio'][j],
+            'uf': lote['uf'][j],
+        }
+        for tipo in TIPOS_COMPLEMENTACAO:
+            registro[tipo] = {
+                'valor_total': float(lote[tipo]['valor_total'][j]),
+                'elegivel': bool(lote[tipo]['elegivel'][j]),
+                'valor_aluno_ano': _finito(lote[tipo]['valor_aluno_ano'][j]),
+            }
+        registro['total_complementacoes'] = float(lote['total_complementacoes'][j])
+        registro['matriculas_totais'] = int(lote['matriculas_totais'][j])
+        yield registro
+
 
 def formatar_moeda(valor: float) -> str:
     """Formata valor em reais"""
-    return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    # Agrupa milhares com '_' (não colide com o ponto decimal): duas trocas em vez de três
+    return f"R$ {valor:_.2f}".replace(".", ",").replace("_", ".")
 
 
 def formatar_numero(valor: float) -> str:
     """Formata número com separador de milhares"""
-    return f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"{valor:_.2f}".replace(".", ",").replace("_", ".")
+
+
+def formatar_coluna(valores, casas: int = 2, prefixo: str = '') -> np.ndarray:
+    """
+    Formata uma coluna inteira no padrão brasileiro
+
+    Junta os valores formatados em um único texto e troca os separadores uma
+    vez para a coluna toda, em vez de uma série de substituições por valor.
+    Valores não finitos viram '—'.
+
+    Args:
+        valores: Sequência ou array numérico
+        casas: Casas decimais
+        prefixo: Texto antes de cada valor (ex.: 'R$ '; sem '.' nem '_')
+
+    Returns:
+        Array de strings (dtype object)
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    if valores.size == 0:
+        return np.array([], dtype=object)
+    finitos = np.isfinite(valores)
+    texto = '\n'.join(map(f'{prefixo}{{:_.{casas}f}}'.format, np.where(finitos, valores, 0).tolist()))
+    formatados = np.array(texto.replace('.', ',').replace('_', '.').split('\n'), dtype=object)
+    formatados[~finitos] = '—'
+    return formatados
+
+
+def formatar_moeda_coluna(valores) -> np.ndarray:
+    """Coluna de valores em reais (formatar_coluna com 'R$ ')"""
+    return formatar_coluna(valores, 2, 'R$ ')
@@ -0,0 +1,301 @@
+"""
+Varredura de cenários (Monte Carlo e grades) sobre a CalculadoraFUNDEB
+
+Gera milhares de cenários nacionais perturbando NSE, DRec e o crescimento de
+matrículas, resolve-os em lotes vetorizados (calcular_cenarios) distribuídos
+por um pool de processos e acumula, por município, histogramas dos valores de
+VAAT e VAAF. Apenas os histogramas ficam em memória; as amostras de cada lote
+são descartadas depois de contadas.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+
+from base_municipios import ETAPAS, BaseMunicipios
+from calculadora import TIPOS_COMPLEMENTACAO, CalculadoraFUNDEB
+
+
+QUANTIS_PADRAO = (0.05, 0.50, 0.95)
+
+
+class Normal:
+    """Perturbação normal (aditiva para NSE/DRec, taxa para crescimento)"""
+
+    def __init__(self, media: float = 0.0, desvio: float = 1.0):
+        self.media = media
+        self.desvio = desvio
+
+    def amostrar(self, rng: np.random.Generator, forma: Tuple) -> np.ndarray:
+        return rng.normal(self.media, self.desvio, forma)
+
+
+class Uniforme:
+    """Perturbação uniforme em [minimo, maximo]"""
+
+    def __init__(self, minimo: float, maximo: float):
+        self.minimo = minimo
+        self.maximo = maximo
+
+    def amostrar(self, rng: np.random.Generator, forma: Tuple) -> np.ndarray:
+        return rng.uniform(self.minimo, self.maximo, forma)
+
+
+class Grade:
+    """
+    Valores fixos percorridos exaustivamente
+
+    Cada ponto da grade é aplicado igualmente a todos os municípios do cenário.
+    Com várias grades, a varredura percorre o produto cartesiano delas.
+    """
+
+    def __init__(self, valores):
+        self.valores = np.asarray(valores, dtype=np.float64)
+
+
+class ResultadoVarredura:
+    """Bandas de percentis por município acumuladas até o momento"""
+
+    def __init__(self, base: BaseMunicipios, quantis: Tuple, percentis: Dict[str, np.ndarray],
+                 fora_da_faixa: Dict[str, np.ndarray], n_cenarios: int):
+        self.codigo_ibge = base.colunas['codigo_ibge'].tolist()
+        self.municipio = base.colunas['nome'].tolist()
+        self.uf = base.siglas_uf.tolist()
+        self.quantis = quantis
+        self.percentis = percentis
+        self.fora_da_faixa = fora_da_faixa
+        self.n_cenarios = n_cenarios
+
+    def bandas(self, tipo_complementacao: str) -> Dict[str, np.ndarray]:
+        """Percentis de um tipo, ex.: {'p5': ..., 'p50': ..., 'p95': ...}"""
+        return {
+            f'p{round(q * 100)}': self.percentis[tipo_complementacao][:, j]
+            for j, q in enumerate(self.quantis)
+        }
+
+
+class _Histogramas:
+    """
+    Histogramas por município com largura de faixa própria
+
+    Zeros (município não elegível no cenário) são contados à parte, para que
+    percentis iguais a zero sejam exatos; valores acima do limite superior vão
+    para a última faixa e são contados em fora_da_faixa.
+    """
+
+    def __init__(self, limite_superior: np.ndarray, faixas: int):
+        self.faixas = faixas
+        self.largura = np.where(limite_superior > 0, limite_superior, 1.0) / faixas
+        n = len(limite_superior)
+        self.contagens = np.zeros((n, faixas), dtype=np.int64)
+        self.zeros = np.zeros(n, dtype=np.int64)
+        self.fora_da_faixa = np.zeros(n, dtype=np.int64)
+        self.total = 0
+
+    def adicionar(self, valores: np.ndarray):
+        """Conta um lote de valores (cenários × municípios)"""
+        n = self.contagens.shape[0]
+        positivo = valores > 0
+        faixa = np.floor(valores / self.largura).astype(np.int64)
+        excedente = positivo & (faixa >= self.faixas)
+        faixa = np.clip(faixa, 0, self.faixas - 1)
+
+        linhas = np.broadcast_to(np.arange(n), valores.shape)
+        posicao = (linhas * self.faixas + faixa)[positivo]
+        self.contagens += np.bincount(posicao, minlength=n * self.faixas).reshape(n, self.faixas)
+        self.zeros += (~positivo).sum(axis=0)
+        self.fora_da_faixa += excedente.sum(axis=0)
+        self.total += valores.shape[0]
+
+    def percentis(self, quantis: Tuple) -> np.ndarray:
+        """Percentis interpolados dentro da faixa (municípios × quantis)"""
+        acumulado = np.cumsum(self.contagens, axis=1)
+        resultado = np.zeros((self.contagens.shape[0], len(quantis)))
+        for j, q in enumerate(quantis):
+            alvo = q * self.total - self.zeros
+            faixa = np.minimum((acumulado < alvo[:, np.newaxis]).sum(axis=1), self.faixas - 1)
+            antes = np.where(
+                faixa > 0, np.take_along_axis(acumulado, np.maximum(faixa - 1, 0)[:, np.newaxis], 1)[:, 0], 0
+            )
+            na_faixa = np.take_along_axis(self.contagens, faixa[:, np.newaxis], 1)[:, 0]
+            fracao = np.clip(np.divide(alvo - antes, na_faixa, out=np.zeros(len(alvo)), where=na_faixa > 0), 0, 1)
+            resultado[:, j] = np.where(alvo > 0, (faixa + fracao) * self.largura, 0.0)
+        return resultado
+
+
+class VarreduraCenarios:
+    """
+    Varredura de cenários nacionais sob incerteza em NSE, DRec e matrículas
+
+    Exemplo:
+        varredura = VarreduraCenarios(
+            calculadora, municipios,
+            nse=Normal(0, 2), drec=Uniforme(-0.005, 0.005),
+            crescimento={'creche_integral': Normal(0.05, 0.02)},
+            n_cenarios=5000, semente=42
+        )
+        resultado = varredura.executar()
+        resultado.bandas('vaat')['p95']
+
+    A semente define todos os sorteios: cada lote recebe uma semente derivada
+    do seu índice (SeedSequence.spawn), então o resultado não depende do número
+    de processos nem da ordem em que os lotes terminam.
+    """
+
+    def __init__(
+        self,
+        calculadora: CalculadoraFUNDEB,
+        municipios,
+        nse=None,
+        drec=None,
+        crescimento=None,
+        n_cenarios: int = None,
+        semente: int = 0,
+        cenarios_por_lote: int = 64,
+        faixas: int = 512,
+        quantis: Tuple = QUANTIS_PADRAO
+    ):
+        """
+        Args:
+            calculadora: Calculadora com os ponderadores do cenário
+            municipios: Lista de dicionários ou BaseMunicipios
+            nse: Perturbação aditiva do NSE (por cenário e município, ou Grade)
+            drec: Perturbação aditiva do DRec, limitada à faixa de ajustes_drec
+            crescimento: Taxa de variação das matrículas; uma distribuição para
+                todas as etapas ou dicionário {etapa: distribuição}
+            n_cenarios: Número de cenários (padrão: tamanho do produto das grades)
+            semente: Semente que torna a varredura reprodutível
+            cenarios_por_lote: Cenários resolvidos juntos em cada tarefa
+            faixas: Resolução dos histogramas por município
+            quantis: Percentis reportados
+        """
+        self.calculadora = calculadora
+        self.base = BaseMunicipios.como_base(municipios)
+        self.entradas = {'nse': nse, 'drec': drec}
+        if isinstance(crescimento, dict):
+            self.entradas.update({f'crescimento:{e}': d for e, d in crescimento.items()})
+        else:
+            self.entradas.update({f'crescimento:{e}': crescimento for e in ETAPAS})
+        self.entradas = {k: d for k, d in self.entradas.items() if d is not None}
+
+        # Grades compartilhadas (mesmo objeto para todas as etapas) contam uma vez
+        self._grades = []
+        for distribuicao in self.entradas.values():
+            if isinstance(distribuicao, Grade) and all(distribuicao is not g for g in self._grades):
+                self._grades.append(distribuicao)
+        self._dimensoes_grade = tuple(len(g.valores) for g in self._grades)
+
+        if n_cenarios is None:
+            if not self._grades:
+                raise ValueError("Informe n_cenarios quando não há grades a percorrer")
+            n_cenarios = int(np.prod(self._dimensoes_grade))
+        self.n_cenarios = n_cenarios
+        self.semente = semente
+        self.cenarios_por_lote = cenarios_por_lote
+        self.faixas = faixas
+        self.quantis = tuple(quantis)
+
+    @property
+    def n_lotes(self) -> int:
+        return -(-self.n_cenarios // self.cenarios_por_lote)
+
+    def calcular_lote(self, indice_lote: int) -> Dict[str, np.ndarray]:
+        """Valores de VAAT e VAAF (cenários × municípios) de um lote"""
+        inicio = indice_lote * self.cenarios_por_lote
+        cenarios = np.arange(inicio, min(inicio + self.cenarios_por_lote, self.n_cenarios))
+        semente = np.random.SeedSequence(self.semente).spawn(self.n_lotes)[indice_lote]
+        rng = np.random.default_rng(semente)
+
+        # Índice de cada cenário no produto cartesiano das grades (cíclico)
+        pontos = {}
+        if self._grades:
+            coordenadas = np.unravel_index(cenarios % int(np.prod(self._dimensoes_grade)), self._dimensoes_grade)
+            pontos = {id(g): g.valores[c] for g, c in zip(self._grades, coordenadas)}
+
+        def sortear(chave, colunas):
+            distribuicao = self.entradas.get(chave)
+            if distribuicao is None:
+                return np.zeros((len(cenarios), 1))
+            if isinstance(distribuicao, Grade):
+                return pontos[id(distribuicao)][:, np.newaxis]
+            return distribuicao.amostrar(rng, (len(cenarios), colunas))
+
+        n = len(self.base)
+        nse = np.asarray(self.base.colunas['nse']) + sortear('nse', n)
+        drec_min, drec_max = self.calculadora.ponderadores['ajustes_drec']['range']
+        drec = np.clip(np.asarray(self.base.colunas['drec']) + sortear('drec', n), drec_min, drec_max)
+        fator_matriculas = 1.0 + np.hstack([sortear(f'crescimento:{e}', 1) for e in ETAPAS])
+
+        cenarios_resolvidos = self.calculadora.calcular_cenarios(self.base, nse, drec, fator_matriculas)
+        return {tipo: cenarios_resolvidos[tipo]['valor_total'] for tipo in TIPOS_COMPLEMENTACAO}
+
+    def iterar(self, processos: int = None) -> Iterator[ResultadoVarredura]:
+        """
+        Executa a varredura emitindo as bandas parciais após cada lote concluído
+
+        Args:
+            processos: Tamanho do pool (padrão: núcleos disponíveis; 1 roda no
+                próprio processo)
+        """
+        for histogramas in self._acumular_lotes(processos):
+            yield self._resultado(histogramas)
+
+    def executar(self, processos: int = None) -> ResultadoVarredura:
+        """Executa a varredura completa e retorna as bandas finais"""
+        for histogramas in self._acumular_lotes(processos):
+            pass
+        return self._resultado(histogramas)
+
+    def _acumular_lotes(self, processos: int = None) -> Iterator[Dict]:
+        """Resolve os lotes e devolve os histogramas após cada um ser contado"""
+        # O primeiro lote, resolvido aqui, define a escala dos histogramas
+        piloto = self.calcular_lote(0)
+        histogramas = {}
+        for tipo in TIPOS_COMPLEMENTACAO:
+            limite = 2.0 * piloto[tipo].max(axis=0)
+            # Municípios sem valor no piloto usam a maior escala observada
+            limite = np.where(limite > 0, limite, limite.max())
+            histogramas[tipo] = _Histogramas(limite, self.faixas)
+        yield self._acumular(histogramas, piloto)
+
+        if self.n_lotes == 1:
+            return
+
+        processos = processos or os.cpu_count() or 1
+        if processos == 1:
+            for indice in range(1, self.n_lotes):
+                yield self._acumular(histogramas, self.calcular_lote(indice))
+            return
+
+        with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_worker, initargs=(self,)) as pool:
+            pendentes = {pool.submit(_calcular_lote_worker, indice) for indice in range(1, self.n_lotes)}
+            for tarefa in as_completed(pendentes):
+                yield self._acumular(histogramas, tarefa.result())
+
+    def _acumular(self, histogramas: Dict, valores: Dict[str, np.ndarray]) -> Dict:
+        for tipo in TIPOS_COMPLEMENTACAO:
+            histogramas[tipo].adicionar(valores[tipo])
+        return histogramas
+
+    def _resultado(self, histogramas: Dict) -> ResultadoVarredura:
+        return ResultadoVarredura(
+            self.base,
+            self.quantis,
+            {tipo: h.percentis(self.quantis) for tipo, h in histogramas.items()},
+            {tipo: h.fora_da_faixa / h.total for tipo, h in histogramas.items()},
+            histogramas['vaat'].total
+        )
+
+
+# Estado de cada processo do pool (definido uma vez por worker)
+_varredura_worker = None
+
+
+def _iniciar_worker(varredura: VarreduraCenarios):
+    global _varredura_worker
+    _varredura_worker = varredura
+
+
+def _calcular_lote_worker(indice_lote: int) -> Dict[str, np.ndarray]:
+    return _varredura_worker.calcular_lote(indice_lote)
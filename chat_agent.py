@@ -1,92 +1,260 @@
 """
 Agente de chat para explicações sobre FUNDEB
 """
+import hashlib
+import json
 import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Iterator, Optional
+
 from anthropic import Anthropic
 
+from cache_resultados import DIRETORIO_PADRAO, CacheDisco
+from ferramentas_chat import FerramentasCalculadora, blocos_para_mensagem, executar_chamadas
+from indice_legal import RAIZ, IndiceLegal, obter_indice_legal
+from metricas import METRICAS, contar, cronometrar, registrar
 
-class ChatAgentFUNDEB:
-    """Agente conversacional para explicações sobre FUNDEB"""
 
-    def __init__(self, api_key: str = None):
-        """Inicializa agente Claude"""
-        self.client = Anthropic(api_key=api_key or os.getenv('ANTHROPIC_API_KEY'))
-        self.model = "claude-sonnet-4-5"
+# Resumo legal que acompanha o prefixo fixo do prompt em todos os turnos
+CAMINHO_RESUMO_LEGAL = os.path.join(RAIZ, 'dados', 'legal', 'fundeb_resumo.md')
 
-        # Contexto legal embutido (sem RAG para MVP)
-        self.contexto_legal = """
-        # CONTEXTO LEGAL DO FUNDEB
 
-        ## Lei 14.113/2020 - FUNDEB Permanente
+def carregar_resumo_legal(caminho: str = CAMINHO_RESUMO_LEGAL) -> str:
+    """Texto do resumo legal ('' se o arquivo não existir)"""
+    try:
+        with open(caminho, encoding='utf-8') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ''
 
-        ### Complementação da União - Modalidades:
 
-        **VAAT (Valor Aluno Ano Total):**
-        - Objetivo: Elevar municípios com menores valores/aluno a patamar mínimo nacional
-        - Base: Nível Socioeconômico (NSE) dos estudantes e capacidade de arrecadação local
-        - Valor 2025: R$ 24,2 bilhões
-        - Beneficiários: 2.425 municípios
+def normalizar_pergunta(pergunta: str) -> str:
+    """Forma canônica da pergunta: Unicode NFKC, minúsculas, espaços colapsados, sem pontuação final"""
+    texto = unicodedata.normalize('NFKC', pergunta).casefold()
+    texto = re.sub(r'\s+', ' ', texto).strip()
+    return texto.rstrip(' ?!.')
 
-        **VAAF (Valor Aluno Ano Final):**
-        - Objetivo: Complementar fundos estaduais que não atingem valor mínimo nacional
-        - Valor 2025: R$ 26,9 bilhões
-        - Beneficiários: 10 estados e 1.849 municípios
 
-        ### Ponderadores (multiplicam matrículas no cálculo):
+class CacheRespostas:
+    """
+    Cache em disco de respostas do agente, com LRU por tamanho e validade (TTL)
 
-        **VAAT:**
-        - Creche integral: 1,90 (mais alto - reflete custo com professores especializados)
-        - Creche parcial: 1,50
-        - Pré-escola integral: 1,88
-        - Pré-escola parcial: 1,45
-        - Anos iniciais urbano: 1,00 (base)
-        - Anos iniciais rural: 1,15
-        - Educação especial: +1,40 (aditivo)
+    Exemplo:
+        cache = CacheRespostas(ttl=7 * 24 * 3600)
+        agente = ChatAgentFUNDEB(cache=cache)
+    """
 
-        **VAAF:**
-        - Ponderadores menores que VAAT (complementação menos redistributiva)
-        - Creche integral: 1,55
-        - Pré-escola integral: 1,50
+    def __init__(
+        self,
+        diretorio: str = DIRETORIO_PADRAO,
+        max_bytes: int = 32 * 1024 * 1024,
+        ttl: Optional[float] = 30 * 24 * 3600
+    ):
+        """
+        Args:
+            diretorio: Raiz do cache (as respostas ficam em respostas/)
+            max_bytes: Tamanho máximo em disco; as menos usadas são descartadas
+            ttl: Validade de cada resposta em segundos (None = sem validade)
+        """
+        self.disco = CacheDisco(os.path.join(diretorio, 'respostas'), max_bytes)
+        self.ttl = ttl
+        self._trava = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+
+    @staticmethod
+    def chave(*partes) -> str:
+        serializado = json.dumps(partes, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+
+    def obter(self, chave: str) -> Optional[str]:
+        """Resposta guardada, ou None se ausente ou expirada"""
+        dados = self.disco.ler(chave)
+        resposta = None
+        if dados is not None:
+            try:
+                entrada = json.loads(dados)
+                if self.ttl is None or time.time() - entrada['criado_em'] < self.ttl:
+                    resposta = entrada['resposta']
+                else:
+                    self.disco.remover(chave)
+            except (ValueError, KeyError):
+                self.disco.remover(chave)
+
+        with self._trava:
+            if resposta is None:
+                self.falhas += 1
+            else:
+                self.acertos += 1
+        return resposta
+
+    def guardar(self, chave: str, resposta: str):
+        entrada = {'criado_em': time.time(), 'resposta': resposta}
+        self.disco.gravar(chave, json.dumps(entrada, ensure_ascii=False).encode('utf-8'))
+
+    def estatisticas(self) -> dict:
+        total = self.acertos + self.falhas
+        return {
+            'acertos': self.acertos,
+            'falhas': self.falhas,
+            'taxa_acerto': self.acertos / total if total else 0.0,
+        }
+
+
+# Menor prefixo que a API guarda em cache (abaixo disso o cache_control é ignorado)
+MINIMO_TOKENS_CACHE = 1024
+
+
+def estimar_tokens(texto: str) -> int:
+    """Estimativa rápida de tokens (~4 caracteres por token em português)"""
+    return len(texto) // 4 + 1
+
+
+class GerenciadorHistorico:
+    """
+    Mantém o histórico enviado ao modelo dentro de um orçamento de tokens
+
+    Quando as mensagens ainda não resumidas passam do limite, as mais antigas
+    são condensadas em um resumo acumulado e só os turnos recentes seguem
+    literais. O histórico completo continua com a interface; o gerenciador
+    guarda apenas o resumo e quantas mensagens ele já cobre.
+
+    preparar só lê o estado atual (nenhuma chamada à API antes da resposta);
+    o resumo é atualizado depois de cada resposta, em segundo plano
+    (compactar_em_segundo_plano), e passa a valer no turno seguinte.
+    """
+
+    def __init__(self, limite_tokens: int = 3000, mensagens_recentes: int = 4):
+        """
+        Args:
+            limite_tokens: Orçamento do histórico literal enviado a cada turno
+            mensagens_recentes: Mensagens finais nunca resumidas (par = turnos completos)
+        """
+        self.limite_tokens = limite_tokens
+        self.mensagens_recentes = mensagens_recentes
+        self.resumo = ''
+        self.compactadas = 0
+        self._trava = threading.Lock()
+        self._tarefa = None
+
+    def preparar(self, historico: list) -> tuple:
+        """
+        Resumo atual e mensagens literais a enviar (sem chamar a API)
 
-        ### Ajustes Multiplicativos:
+        Args:
+            historico: Histórico completo [{'role', 'content'}], sem a pergunta atual
 
-        **NSE (Nível Socioeconômico):**
-        - Range: 0,95 a 1,05
-        - Alunos mais vulneráveis geram fator maior
-        - Fórmula: 0,95 + (NSE/1000)
+        Returns:
+            (resumo, mensagens literais a enviar)
+        """
+        historico = historico or []
+        with self._trava:
+            if len(historico) < self.compactadas:
+                # Histórico foi limpo na interface
+                self.resumo, self.compactadas = '', 0
+            return self.resumo, historico[self.compactadas:]
+
+    def compactar(self, historico: list, resumir):
+        """
+        Resume as mensagens antigas se as não resumidas passarem do orçamento
 
-        **DRec (Disponibilidade de Recursos):**
-        - Range: 0,965 a 1,035
-        - Capacidade fiscal local
-        - Menor capacidade = maior fator
+        Args:
+            historico: Histórico completo, já com a última resposta
+            resumir: Função (resumo_anterior, mensagens) -> novo resumo
+        """
+        resumo, pendentes = self.preparar(historico)
+        compactadas = len(historico) - len(pendentes)
+        tokens = sum(estimar_tokens(m['content']) for m in pendentes)
+        if tokens <= self.limite_tokens or len(pendentes) <= self.mensagens_recentes:
+            return
+
+        corte = len(pendentes) - self.mensagens_recentes
+        # As mensagens literais precisam começar por uma do usuário
+        while corte < len(pendentes) and pendentes[corte]['role'] != 'user':
+            corte += 1
+        novo_resumo = resumir(resumo, pendentes[:corte])
+        with self._trava:
+            # Descarta se o histórico foi limpo enquanto o resumo era gerado
+            if self.compactadas == compactadas:
+                self.resumo, self.compactadas = novo_resumo, compactadas + corte
+
+    def compactar_em_segundo_plano(self, historico: list, resumir) -> threading.Thread:
+        """Executa compactar numa thread (uma por vez; se já houver uma, ela é devolvida)"""
+        with self._trava:
+            if self._tarefa is not None and self._tarefa.is_alive():
+                return self._tarefa
+            self._tarefa = threading.Thread(
+                target=self._compactar_protegido, args=(list(historico), resumir), daemon=True
+            )
+            self._tarefa.start()
+            return self._tarefa
+
+    def _compactar_protegido(self, historico: list, resumir):
+        try:
+            self.compactar(historico, resumir)
+        except Exception:
+            # Sem resumo novo o turno seguinte envia mais histórico literal e tenta de novo
+            contar('chat.falhas_resumo')
+
+    def aguardar(self, timeout: float = None):
+        """Espera a compactação em andamento terminar"""
+        tarefa = self._tarefa
+        if tarefa is not None:
+            tarefa.join(timeout)
 
-        ### Fórmula Completa:
-        Matrículas Ajustadas = Matrículas × Ponderador Base × NSE × DRec
 
-        ### Bases Legais:
-        - Lei 14.113/2020, Art. 5º (VAAT) e Art. 6º (VAAF)
-        - Portaria MEC nº 567/2024 (ponderadores)
-        """
+class ChatAgentFUNDEB:
+    """Agente conversacional para explicações sobre FUNDEB"""
 
-    def gerar_resposta(
+    def __init__(
         self,
-        pergunta: str,
-        contexto_municipio: dict = None,
-        historico: list = None
-    ) -> str:
+        api_key: str = None,
+        client=None,
+        cache: CacheRespostas = None,
+        indice: IndiceLegal = None,
+        k_trechos: int = 5,
+        ferramentas: FerramentasCalculadora = None,
+        resumo_legal: str = None
+    ):
         """
-        Gera resposta usando Claude
+        Inicializa agente Claude
 
         Args:
-            pergunta: Pergunta do usuário
-            contexto_municipio: Dados do município selecionado (opcional)
-            historico: Histórico da conversa (opcional)
-
-        Returns:
-            Resposta do agente
+            api_key: Chave da API Anthropic (padrão: ANTHROPIC_API_KEY)
+            client: Cliente com a interface messages.create (ex.: um falso nos testes)
+            cache: Cache de respostas (opcional)
+            indice: Índice legal (padrão: índice das fontes locais, um por processo)
+            k_trechos: Trechos legais recuperados por pergunta
+            ferramentas: Operações da calculadora oferecidas ao modelo (uma por conversa)
+            resumo_legal: Texto legal fixo do prefixo cacheado (padrão: dados/legal/fundeb_resumo.md)
         """
-        # Monta prompt do sistema
-        system_prompt = f"""Você é um especialista em financiamento educacional brasileiro,
+        self.client = client or Anthropic(api_key=api_key or os.getenv('ANTHROPIC_API_KEY'))
+        self.model = "claude-sonnet-4-5"
+        self.max_tokens = 2000
+        self.max_tokens_resumo = 500
+        self.cache = cache
+        self.latencia_primeiro_token = None
+
+        # Trechos legais recuperados por pergunta (BM25 sobre dados/legal e docs)
+        self.indice = indice if indice is not None else obter_indice_legal()
+        self.k_trechos = k_trechos
+
+        self.ferramentas = ferramentas
+        self.max_rodadas_ferramentas = 5 if ferramentas is not None else 1
+
+        # Prefixo fixo do prompt do sistema (idêntico em todos os turnos): papel,
+        # instruções, método de cálculo e o resumo legal completo, somando mais que
+        # MINIMO_TOKENS_CACHE; os trechos recuperados vêm depois
+        if resumo_legal is None:
+            resumo_legal = carregar_resumo_legal()
+            # Já vai inteiro no prefixo: não repete os trechos dele entre os recuperados
+            self.fontes_no_prefixo = {os.path.relpath(CAMINHO_RESUMO_LEGAL, RAIZ)}
+        else:
+            self.fontes_no_prefixo = set()
+        self.prompt_fixo = f"""Você é um especialista em financiamento educacional brasileiro,
 especialmente no FUNDEB (Fundo de Manutenção e Desenvolvimento da Educação Básica).
 
 Seu papel é:
@@ -100,17 +268,219 @@ IMPORTANTE:
 - Cite sempre as bases legais (Lei 14.113/2020, Portarias MEC)
 - Explique passo-a-passo quando falar de cálculos
 - Seja conciso mas completo
-
-{self.contexto_legal}
+- Baseie-se no resumo legal abaixo e nos trechos da legislação fornecidos, indicando a fonte de cada um
+
+COMO A CALCULADORA CALCULA (use estas definições ao explicar resultados):
+
+1. Matrículas ajustadas: em cada etapa, matrículas × ponderador da etapa (Portaria MEC
+em vigor, um conjunto para o VAAT e outro para o VAAF) × fator NSE × fator DRec. O fator
+NSE é 0,95 + NSE/1000, na faixa de 0,95 a 1,05; o DRec vem dos dados do município, na
+faixa de 0,965 a 1,035. A soma das etapas é o total ajustado do município.
+
+2. Valor por aluno: receita do município dividida pelo total ajustado. Quando o município
+não informa receita_vaat/receita_vaaf, a receita é estimada como valor de referência por
+aluno × matrículas × (0,5 + posição do DRec na faixa): metade da referência no piso da
+faixa e 1,5 vez no teto. Deixe claro que essa receita é uma estimativa do simulador.
+
+3. Elegibilidade: com a base nacional carregada, o município recebe a complementação
+quando o valor por aluno fica abaixo do limiar nacional. O limiar é o ponto em que o
+orçamento da complementação (R$ 24,2 bilhões no VAAT e R$ 26,9 bilhões no VAAF em 2025,
+proporcional quando a base tem menos matrículas que o país) se esgota elevando primeiro
+os municípios de menor valor por aluno.
+
+4. Valor recebido: orçamento × total ajustado do município ÷ soma dos totais ajustados
+dos municípios elegíveis no país. Município não elegível recebe zero naquela
+complementação. O total do município é VAAT + VAAF.
+
+5. Simulações: alterar matrículas muda o total ajustado do município e também o total
+nacional (o denominador), por isso uma matrícula a mais rende um pouco menos que a média
+por aluno. A mudança também pode cruzar o limiar e mudar a elegibilidade, nos dois
+sentidos.
+
+ETAPAS (identificadores usados nos dados):
+- creche_integral, creche_parcial: creche em tempo integral e em tempo parcial
+- pre_escola_integral, pre_escola_parcial: pré-escola em tempo integral e parcial
+- anos_iniciais_urbano, anos_iniciais_rural: ensino fundamental, anos iniciais
+- anos_finais_urbano, anos_finais_rural: ensino fundamental, anos finais
+- ensino_medio_urbano: ensino médio
+- eja: educação de jovens e adultos
+- educacao_especial: educação especial
+Nas respostas, use os nomes por extenso (ex.: "creche em tempo integral"), não os
+identificadores.
+
+FORMATO DAS RESPOSTAS:
+- Valores em reais no formato brasileiro (R$ 1.234.567,89)
+- Ao explicar um cálculo, comece pelo resultado e depois mostre matrículas ajustadas,
+  valor por aluno, comparação com o limiar e valor recebido, nessa ordem
+- Ao citar a legislação, indique a lei ou portaria e o artigo quando constarem das
+  fontes; se um ponto não estiver nos trechos nem neste prompt, diga que não consta das
+  fontes disponíveis em vez de supor
+- Separe regra legal de simplificação do simulador (receita estimada, DRec informado)
+- Em cenários, diga quais premissas foram alteradas e quais ficaram iguais
+
+{resumo_legal}
 """
 
-        # Adiciona contexto do município se disponível
+    @cronometrar('chat.gerar_resposta')
+    def gerar_resposta(
+        self,
+        pergunta: str,
+        contexto_municipio: dict = None,
+        historico: list = None,
+        gerenciador: GerenciadorHistorico = None
+    ) -> str:
+        """
+        Gera resposta usando Claude
+
+        Args:
+            pergunta: Pergunta do usuário
+            contexto_municipio: Dados do município selecionado (opcional)
+            historico: Histórico da conversa (opcional)
+            gerenciador: Compacta o histórico em um resumo acima do orçamento (opcional)
+
+        Returns:
+            Resposta do agente
+        """
+        requisicao, chave = self._montar_requisicao(pergunta, contexto_municipio, historico, gerenciador)
+
+        # Perguntas repetidas sobre o mesmo contexto não chamam a API
+        if chave is not None:
+            resposta = self.cache.obter(chave)
+            if resposta is not None:
+                contar('chat.respostas_cache')
+                self._compactar_historico(gerenciador, historico, pergunta, resposta)
+                return resposta
+
+        # Chama Claude (e executa as ferramentas pedidas, por algumas rodadas)
+        for _ in range(self.max_rodadas_ferramentas):
+            response = self.client.messages.create(**requisicao)
+            self._contar_uso(response)
+            if self.ferramentas is None or response.stop_reason != 'tool_use':
+                break
+            self._anexar_chamadas(requisicao['messages'], response.content)
+        resposta = ''.join(bloco.text for bloco in response.content if bloco.type == 'text')
+
+        if chave is not None:
+            self.cache.guardar(chave, resposta)
+        self._compactar_historico(gerenciador, historico, pergunta, resposta)
+        return resposta
+
+    def gerar_resposta_stream(
+        self,
+        pergunta: str,
+        contexto_municipio: dict = None,
+        historico: list = None,
+        gerenciador: GerenciadorHistorico = None
+    ) -> Iterator[str]:
+        """
+        Gera resposta em fluxo, entregando cada trecho de texto assim que chega
+
+        Mesmos argumentos de gerar_resposta. O tempo até o primeiro trecho fica
+        em self.latencia_primeiro_token (segundos). Ao final do fluxo a resposta
+        completa é guardada no cache e o histórico é compactado em segundo plano.
+
+        Yields:
+            Trechos de texto da resposta
+        """
+        inicio = time.perf_counter()
+        self.latencia_primeiro_token = None
+        requisicao, chave = self._montar_requisicao(pergunta, contexto_municipio, historico, gerenciador)
+
+        if chave is not None:
+            resposta = self.cache.obter(chave)
+            if resposta is not None:
+                self.latencia_primeiro_token = time.perf_counter() - inicio
+                contar('chat.respostas_cache')
+                yield resposta
+                self._compactar_historico(gerenciador, historico, pergunta, resposta)
+                return
+
+        trechos = []
+        for _ in range(self.max_rodadas_ferramentas):
+            with self.client.messages.stream(**requisicao) as fluxo:
+                for texto in fluxo.text_stream:
+                    if self.latencia_primeiro_token is None:
+                        self.latencia_primeiro_token = time.perf_counter() - inicio
+                        registrar('chat.primeiro_token', self.latencia_primeiro_token)
+                    trechos.append(texto)
+                    yield texto
+                final = None
+                if self.ferramentas is not None or METRICAS.ativo:
+                    final = fluxo.get_final_message()
+            self._contar_uso(final)
+
+            if self.ferramentas is None or final.stop_reason != 'tool_use':
+                break
+            self._anexar_chamadas(requisicao['messages'], final.content)
+
+        registrar('chat.gerar_resposta_stream', time.perf_counter() - inicio)
+        if chave is not None:
+            self.cache.guardar(chave, ''.join(trechos))
+        self._compactar_historico(gerenciador, historico, pergunta, ''.join(trechos))
+
+    def _compactar_historico(self, gerenciador, historico: list, pergunta: str, resposta: str):
+        """Depois da resposta: resume o histórico em segundo plano para o próximo turno"""
+        if gerenciador is None:
+            return
+        completo = list(historico or []) + [
+            {'role': 'user', 'content': pergunta},
+            {'role': 'assistant', 'content': resposta},
+        ]
+        gerenciador.compactar_em_segundo_plano(completo, self.resumir_conversa)
+
+    @staticmethod
+    def _contar_uso(response):
+        """Soma os tokens informados pela API aos contadores de métricas"""
+        uso = getattr(response, 'usage', None)
+        if uso is None or not METRICAS.ativo:
+            return
+        contar('chat.chamadas_api')
+        contar('chat.tokens_entrada', getattr(uso, 'input_tokens', 0) or 0)
+        contar('chat.tokens_saida', getattr(uso, 'output_tokens', 0) or 0)
+        contar('chat.tokens_cache_lidos', getattr(uso, 'cache_read_input_tokens', 0) or 0)
+        contar('chat.tokens_cache_gravados', getattr(uso, 'cache_creation_input_tokens', 0) or 0)
+
+    def _anexar_chamadas(self, messages: list, conteudo):
+        """Acrescenta o turno com tool_use e os resultados das ferramentas"""
+        messages.append({'role': 'assistant', 'content': blocos_para_mensagem(conteudo)})
+        messages.append({'role': 'user', 'content': executar_chamadas(self.ferramentas, conteudo)})
+
+    def _montar_requisicao(self, pergunta: str, contexto_municipio: dict, historico: list, gerenciador=None):
+        """
+        Parâmetros de messages.create/stream e chave de cache (None sem cache)
+
+        O prompt do sistema vai em blocos: o bloco fixo (papel, instruções e
+        resumo legal) é marcado como prefixo cacheável e se repete idêntico em
+        todos os turnos; trechos legais recuperados para a pergunta, contexto
+        do município e resumo da conversa vêm depois do ponto de cache, em
+        blocos próprios que podem mudar sem invalidar o prefixo.
+        """
+        resumo = ''
+        if gerenciador is not None:
+            resumo, historico = gerenciador.preparar(historico)
+
+        system = [{
+            'type': 'text',
+            'text': self.prompt_fixo,
+            'cache_control': {'type': 'ephemeral'},
+        }]
+
+        # Apenas os trechos legais relevantes para esta pergunta
+        trechos = self.contexto_legal(pergunta)
+        if trechos:
+            system.append({'type': 'text', 'text': f"TRECHOS DA LEGISLAÇÃO E DOCUMENTOS:\n\n{trechos}"})
+
+        # Adiciona contexto do município se disponível; com ferramentas, só a
+        # referência (o modelo calcula o que precisar)
+        if self.ferramentas is not None:
+            contexto_formatado = self._referenciar_municipio(contexto_municipio)
+        else:
+            contexto_formatado = self._formatar_contexto_municipio(contexto_municipio)
         if contexto_municipio:
-            system_prompt += f"""
+            system.append({'type': 'text', 'text': f"MUNICÍPIO SELECIONADO NA CALCULADORA:\n{contexto_formatado}"})
 
-MUNICÍPIO SELECIONADO NA CALCULADORA:
-{self._formatar_contexto_municipio(contexto_municipio)}
-"""
+        if resumo:
+            system.append({'type': 'text', 'text': f"RESUMO DA CONVERSA ATÉ AQUI:\n{resumo}"})
 
         # Monta mensagens
         messages = []
@@ -125,16 +495,89 @@ MUNICÍPIO SELECIONADO NA CALCULADORA:
             "content": pergunta
         })
 
-        # Chama Claude
+        requisicao = {
+            'model': self.model,
+            'max_tokens': self.max_tokens,
+            'system': system,
+            'messages': messages,
+        }
+        if self.ferramentas is not None:
+            requisicao['tools'] = self.ferramentas.definicoes
+        chave = None
+        if self.cache is not None:
+            texto_sistema = '\n\n'.join(bloco['text'] for bloco in system)
+            chave = self._chave_cache(pergunta, contexto_formatado, historico, texto_sistema)
+        return requisicao, chave
+
+    def contexto_legal(self, pergunta: str) -> str:
+        """Trechos legais mais relevantes para a pergunta, com a fonte de cada um"""
+        trechos = self.indice.buscar(pergunta, k=self.k_trechos, excluir_fontes=self.fontes_no_prefixo)
+        return '\n\n'.join(
+            f"[{t['fonte']}{' — ' + t['titulo'] if t['titulo'] else ''}]\n{t['texto']}" for t in trechos
+        )
+
+    def resumir_conversa(self, resumo_anterior: str, mensagens: list) -> str:
+        """
+        Condensa mensagens antigas (e o resumo anterior) em um novo resumo curto
+
+        Args:
+            resumo_anterior: Resumo acumulado até aqui ('' se nenhum)
+            mensagens: Mensagens a incorporar
+
+        Returns:
+            Novo resumo
+        """
+        transcricao = '\n'.join(
+            f"{'Usuário' if m['role'] == 'user' else 'Assistente'}: {m['content']}" for m in mensagens
+        )
+        pedido = f"""Atualize o resumo desta conversa sobre FUNDEB em no máximo 10 tópicos curtos.
+Preserve municípios, valores, premissas de simulação e dúvidas em aberto.
+
+RESUMO ANTERIOR:
+{resumo_anterior or '(nenhum)'}
+
+NOVAS MENSAGENS:
+{transcricao}"""
         response = self.client.messages.create(
             model=self.model,
-            max_tokens=2000,
-            system=system_prompt,
-            messages=messages
+            max_tokens=self.max_tokens_resumo,
+            messages=[{'role': 'user', 'content': pedido}]
         )
-
+        self._contar_uso(response)
         return response.content[0].text
 
+    def _chave_cache(self, pergunta: str, contexto_formatado: str, historico: list, texto_sistema: str) -> str:
+        """
+        Chave: pergunta normalizada e contexto compactado
+
+        O contexto compactado é o contexto do município, o prompt do sistema
+        (que inclui o resumo da conversa) e só as mensagens literais recentes,
+        não o histórico inteiro.
+        """
+        hash_contexto = hashlib.sha256(contexto_formatado.encode('utf-8')).hexdigest()
+        hash_prompt = hashlib.sha256(texto_sistema.encode('utf-8')).hexdigest()
+        return CacheRespostas.chave(
+            normalizar_pergunta(pergunta),
+            hash_contexto,
+            self.model,
+            self.max_tokens,
+            hash_prompt,
+            historico or [],
+            self.ferramentas.versao if self.ferramentas is not None else None,
+        )
+
+    def _referenciar_municipio(self, contexto: dict) -> str:
+        """Referência curta ao resultado exibido na calculadora, com o código IBGE para as ferramentas"""
+        if not contexto:
+            return ""
+        return (
+            f"{contexto.get('municipio', 'N/A')} - {contexto.get('uf', 'N/A')}, "
+            f"código IBGE {contexto.get('codigo_ibge', 'N/A')} "
+            f"(resultado exibido: VAAT R$ {contexto.get('vaat', {}).get('valor_total', 0):,.2f}, "
+            f"VAAF R$ {contexto.get('vaaf', {}).get('valor_total', 0):,.2f}). "
+            "Use as ferramentas para detalhes, comparações e simulações."
+        )
+
     def _formatar_contexto_municipio(self, contexto: dict) -> str:
         """Formata contexto do município para o prompt"""
         if not contexto:
@@ -0,0 +1,252 @@
+"""
+Cubo de agregação da comparação nacional
+
+Somas de VAAT, VAAF, total e matrículas e contagem de municípios por
+UF × faixa de população × elegibilidade VAAT × elegibilidade VAAF, montadas
+uma vez a partir do resultado de calcular_lote. Filtros e agrupamentos (UF,
+região, faixa, elegibilidade) somam células do cubo, sem varrer os
+municípios. Simular um município ajusta só as duas células envolvidas
+(subtrai a linha antiga e soma a nova).
+
+Uso:
+    cubo = CuboAgregado.de_lote(lote, base)
+    cubo.consultar(por=('regiao',), faixa_populacao=['Até 5 mil'], elegivel_vaat=True)
+    simulado = cubo.simulado(base.indice(codigo_ibge), resultado)
+"""
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from calculadora import TIPOS_COMPLEMENTACAO
+
+REGIOES = {
+    'AC': 'Norte', 'AM': 'Norte', 'AP': 'Norte', 'PA': 'Norte', 'RO': 'Norte', 'RR': 'Norte', 'TO': 'Norte',
+    'AL': 'Nordeste', 'BA': 'Nordeste', 'CE': 'Nordeste', 'MA': 'Nordeste', 'PB': 'Nordeste',
+    'PE': 'Nordeste', 'PI': 'Nordeste', 'RN': 'Nordeste', 'SE': 'Nordeste',
+    'DF': 'Centro-Oeste', 'GO': 'Centro-Oeste', 'MS': 'Centro-Oeste', 'MT': 'Centro-Oeste',
+    'ES': 'Sudeste', 'MG': 'Sudeste', 'RJ': 'Sudeste', 'SP': 'Sudeste',
+    'PR': 'Sul', 'RS': 'Sul', 'SC': 'Sul',
+}
+
+# Faixas de população do IBGE (limite inferior de cada faixa a partir da segunda)
+LIMITES_POPULACAO = (5_000, 10_000, 20_000, 50_000, 100_000, 500_000)
+FAIXAS_POPULACAO = (
+    'Até 5 mil', '5 a 10 mil', '10 a 20 mil', '20 a 50 mil', '50 a 100 mil', '100 a 500 mil', 'Mais de 500 mil',
+)
+
+DIMENSOES = ('uf', 'regiao', 'faixa_populacao', 'elegivel_vaat', 'elegivel_vaaf')
+
+# Medidas guardadas em cada célula (última dimensão do cubo)
+MEDIDAS = ('Municípios', 'VAAT', 'VAAF', 'Total', 'Matrículas')
+
+
+def faixa_populacao(populacao) -> np.ndarray:
+    """Índice em FAIXAS_POPULACAO de cada população"""
+    return np.searchsorted(LIMITES_POPULACAO, np.asarray(populacao), side='right')
+
+
+def _lista(valor) -> List:
+    return [valor] if isinstance(valor, (str, bool, np.bool_)) else list(valor)
+
+
+class CuboAgregado:
+    """
+    Somas por UF × faixa de população × elegível VAAT × elegível VAAF
+
+    As linhas de cada município (célula e medidas) ficam guardadas para que
+    atualizar possa tirar a contribuição antiga; as linhas alteradas vão
+    para um dicionário à parte, e as da base nunca são modificadas, então
+    um cubo simulado compartilha os arrays do original.
+    """
+
+    def __init__(self, ufs: Sequence[str], celula: np.ndarray, medidas: np.ndarray):
+        """
+        Args:
+            ufs: Siglas das UFs (primeira dimensão do cubo)
+            celula: Célula de cada município (índice plano no cubo sem MEDIDAS)
+            medidas: Matriz municípios × MEDIDAS
+        """
+        self.ufs = list(ufs)
+        self.forma = (len(self.ufs), len(FAIXAS_POPULACAO), 2, 2)
+        self._celula = celula
+        self._medidas = medidas
+        self._alterados: Dict[int, tuple] = {}
+
+        n_celulas = int(np.prod(self.forma))
+        valores = np.column_stack([
+            np.bincount(celula, weights=medidas[:, j], minlength=n_celulas) for j in range(len(MEDIDAS))
+        ]) if len(celula) else np.zeros((n_celulas, len(MEDIDAS)))
+        self._valores = valores.reshape(self.forma + (len(MEDIDAS),))
+
+    @classmethod
+    def de_lote(cls, lote: Dict, municipios) -> 'CuboAgregado':
+        """
+        Monta o cubo a partir de calcular_lote
+
+        Args:
+            lote: Resultado de CalculadoraFUNDEB.calcular_lote
+            municipios: BaseMunicipios (ou lista) usada no lote, para a população
+        """
+        if hasattr(municipios, 'colunas'):
+            populacao = municipios.colunas['populacao']
+        else:
+            populacao = np.array([m.get('populacao', 0) for m in municipios], dtype=np.int64)
+
+        ufs, codigo_uf = np.unique(np.asarray(lote['uf'], dtype=str), return_inverse=True)
+        celula = np.ravel_multi_index((
+            codigo_uf,
+            faixa_populacao(populacao),
+            np.asarray(lote['vaat']['elegivel'], dtype=np.int64),
+            np.asarray(lote['vaaf']['elegivel'], dtype=np.int64),
+        ), (len(ufs), len(FAIXAS_POPULACAO), 2, 2))
+        medidas = np.column_stack([
+            np.ones(len(celula)),
+            lote['vaat']['valor_total'],
+            lote['vaaf']['valor_total'],
+            lote['total_complementacoes'],
+            np.asarray(lote['matriculas_totais'], dtype=np.float64),
+        ])
+        return cls(ufs.tolist(), celula, medidas)
+
+    # ---------- Atualização incremental ----------
+
+    def _linha(self, indice: int):
+        if indice in self._alterados:
+            return self._alterados[indice]
+        return int(self._celula[indice]), self._medidas[indice]
+
+    def atualizar(self, indice: int, resultado: Dict, populacao: int = None):
+        """
+        Troca a contribuição de um município pelo novo resultado
+
+        Args:
+            indice: Linha do município no lote
+            resultado: Saída de calcular_ambas_complementacoes (ou registro de registros_lote)
+            populacao: Nova população (padrão: a do lote)
+        """
+        celula_antiga, medidas_antigas = self._linha(indice)
+        uf, faixa, _, _ = np.unravel_index(celula_antiga, self.forma)
+        if populacao is not None:
+            faixa = int(faixa_populacao(populacao))
+
+        celula = int(np.ravel_multi_index(
+            (uf, faixa, int(resultado['vaat']['elegivel']), int(resultado['vaaf']['elegivel'])), self.forma
+        ))
+        medidas = np.array([
+            1.0,
+            resultado['vaat']['valor_total'],
+            resultado['vaaf']['valor_total'],
+            resultado['total_complementacoes'],
+            resultado['matriculas_totais'],
+        ], dtype=np.float64)
+
+        valores = self._valores.reshape(-1, len(MEDIDAS))
+        valores[celula_antiga] -= medidas_antigas
+        valores[celula] += medidas
+        self._alterados[indice] = (celula, medidas)
+
+    def simulado(self, indice: int, resultado: Dict, populacao: int = None) -> 'CuboAgregado':
+        """Cópia do cubo com um município trocado (o original não muda)"""
+        copia = object.__new__(CuboAgregado)
+        copia.__dict__.update(self.__dict__)
+        copia._valores = self._valores.copy()
+        copia._alterados = dict(self._alterados)
+        copia.atualizar(indice, resultado, populacao)
+        return copia
+
+    # ---------- Consulta ----------
+
+    @property
+    def regioes(self) -> List[str]:
+        """Regiões presentes no cubo, em ordem alfabética"""
+        return sorted({REGIOES.get(uf, 'Sem região') for uf in self.ufs})
+
+    def consultar(
+        self,
+        por: Iterable[str] = ('uf',),
+        uf=None,
+        regiao=None,
+        faixa_populacao=None,
+        elegivel_vaat: bool = None,
+        elegivel_vaaf: bool = None
+    ) -> pd.DataFrame:
+        """
+        Somas filtradas e agrupadas, lidas só das células do cubo
+
+        Args:
+            por: Dimensões de agrupamento (DIMENSOES; vazio = uma linha de total)
+            uf: Sigla ou lista de siglas
+            regiao: Região ou lista de regiões
+            faixa_populacao: Rótulo ou lista de rótulos de FAIXAS_POPULACAO
+            elegivel_vaat: Só elegíveis (True) ou só não elegíveis (False) ao VAAT
+            elegivel_vaaf: Idem para VAAF
+
+        Returns:
+            DataFrame com as dimensões de 'por' como colunas, MEDIDAS e
+            '<tipo> por aluno' (soma do valor / soma das matrículas); grupos
+            sem municípios são omitidos
+        """
+        por = list(por)
+        desconhecidas = set(por) - set(DIMENSOES)
+        if desconhecidas:
+            raise ValueError(f"Dimensões desconhecidas: {', '.join(sorted(desconhecidas))}")
+        if 'uf' in por and 'regiao' in por:
+            raise ValueError("Agrupe por 'uf' ou por 'regiao', não pelos dois")
+
+        regiao_uf = [REGIOES.get(sigla, 'Sem região') for sigla in self.ufs]
+        selecao_uf = np.ones(len(self.ufs), dtype=bool)
+        if uf is not None:
+            selecao_uf &= np.isin(self.ufs, _lista(uf))
+        if regiao is not None:
+            selecao_uf &= np.isin(regiao_uf, _lista(regiao))
+        selecoes = [
+            selecao_uf,
+            np.ones(len(FAIXAS_POPULACAO), dtype=bool) if faixa_populacao is None
+            else np.isin(FAIXAS_POPULACAO, _lista(faixa_populacao)),
+            np.ones(2, dtype=bool) if elegivel_vaat is None else np.array([not elegivel_vaat, elegivel_vaat]),
+            np.ones(2, dtype=bool) if elegivel_vaaf is None else np.array([not elegivel_vaaf, elegivel_vaaf]),
+        ]
+        valores = self._valores
+        for eixo, selecao in enumerate(selecoes):
+            valores = valores * selecao.reshape([-1 if i == eixo else 1 for i in range(valores.ndim)])
+
+        rotulos = {
+            'uf': self.ufs,
+            'faixa_populacao': list(FAIXAS_POPULACAO),
+            'elegivel_vaat': [False, True],
+            'elegivel_vaaf': [False, True],
+        }
+        if 'regiao' in por:
+            nomes_regioes = self.regioes
+            codigo_regiao = np.array([nomes_regioes.index(r) for r in regiao_uf], dtype=np.int64)
+            por_regiao = np.zeros((len(nomes_regioes),) + valores.shape[1:])
+            np.add.at(por_regiao, codigo_regiao, valores)
+            valores = por_regiao
+            rotulos['uf'] = nomes_regioes
+
+        eixos = ['regiao' if 'regiao' in por else 'uf', 'faixa_populacao', 'elegivel_vaat', 'elegivel_vaaf']
+        valores = valores.sum(axis=tuple(i for i, nome in enumerate(eixos) if nome not in por))
+        mantidos = [nome for nome in eixos if nome in por]
+
+        # Tudo em NumPy; o DataFrame é montado uma vez no final
+        valores = valores.reshape(-1, len(MEDIDAS))
+        colunas = {}
+        if mantidos:
+            rotulos_mantidos = [np.asarray(rotulos['uf' if nome == 'regiao' else nome]) for nome in mantidos]
+            com_municipios = valores[:, 0] > 0.5
+            posicoes = np.unravel_index(np.flatnonzero(com_municipios), [len(r) for r in rotulos_mantidos])
+            for nome, rotulo, posicao in zip(mantidos, rotulos_mantidos, posicoes):
+                colunas[nome] = rotulo[posicao]
+            valores = valores[com_municipios]
+
+        colunas['Municípios'] = np.rint(valores[:, 0]).astype(np.int64)
+        for j, medida in enumerate(MEDIDAS[1:], 1):
+            colunas[medida] = valores[:, j]
+        matriculas = valores[:, MEDIDAS.index('Matrículas')]
+        for tipo in TIPOS_COMPLEMENTACAO:
+            rotulo = tipo.upper()
+            colunas[f'{rotulo} por aluno'] = np.divide(
+                colunas[rotulo], matriculas, out=np.zeros(len(matriculas)), where=matriculas > 0
+            )
+        return pd.DataFrame(colunas)
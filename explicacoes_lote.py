@@ -0,0 +1,322 @@
+"""
+Geração em lote de explicações de cálculo para muitos municípios
+
+Chama ChatAgentFUNDEB.explicar_calculo para centenas de municípios com
+concorrência limitada, um balde de fichas que respeita o limite de
+requisições por minuto da API (só requisições, não tokens), novas tentativas
+com espera exponencial e progresso gravado em um arquivo NDJSON. Ao
+reexecutar com o mesmo arquivo, os municípios já explicados são pulados.
+
+Uso:
+    python explicacoes_lote.py explicacoes.ndjson --uf SP --concorrencia 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Set
+
+from anthropic import APIConnectionError
+
+
+class BaldeFichas:
+    """
+    Limitador de taxa (token bucket) compartilhado pelas tarefas
+
+    Cada requisição retira uma ficha; as fichas se recompõem à taxa
+    configurada até a capacidade. Uma resposta 429 pausa todo o balde pelo
+    tempo indicado pela API, em vez de cada tarefa insistir sozinha.
+
+    Limita apenas requisições por minuto. Os limites de tokens de entrada e
+    de saída por minuto não são contados: se forem eles a estourar, a API
+    responde 429 e o balde pausa pelo retry-after como em qualquer 429.
+    Para ficar abaixo deles, reduza requisicoes_por_minuto em proporção ao
+    tamanho das explicações.
+    """
+
+    def __init__(self, requisicoes_por_minuto: float, capacidade: float = None):
+        self.taxa = requisicoes_por_minuto / 60.0
+        self.capacidade = capacidade if capacidade is not None else max(1.0, self.taxa)
+        self.fichas = self.capacidade
+        self._atualizado = time.monotonic()
+        self._pausado_ate = 0.0
+        self._trava = asyncio.Lock()
+
+    async def retirar(self, quantidade: float = 1.0):
+        """Aguarda até haver fichas e retira a quantidade pedida"""
+        async with self._trava:
+            while True:
+                agora = time.monotonic()
+                if agora < self._pausado_ate:
+                    await asyncio.sleep(self._pausado_ate - agora)
+                    continue
+
+                self.fichas = min(self.capacidade, self.fichas + (agora - self._atualizado) * self.taxa)
+                self._atualizado = agora
+                if self.fichas >= quantidade:
+                    self.fichas -= quantidade
+                    return
+                await asyncio.sleep((quantidade - self.fichas) / self.taxa)
+
+    def pausar(self, segundos: float):
+        """Suspende novas retiradas (ex.: após 429 com retry-after)"""
+        self._pausado_ate = max(self._pausado_ate, time.monotonic() + segundos)
+        self.fichas = 0.0
+
+
+def _repetivel(erro: Exception) -> bool:
+    """Erros transitórios: limite de taxa, sobrecarga, falha de rede"""
+    status = getattr(erro, 'status_code', None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    return isinstance(erro, (ConnectionError, TimeoutError, APIConnectionError))
+
+
+def _retry_after(erro: Exception) -> Optional[float]:
+    """Espera sugerida pela API no cabeçalho retry-after, se houver"""
+    resposta = getattr(erro, 'response', None)
+    cabecalhos = getattr(resposta, 'headers', None) or {}
+    try:
+        return float(cabecalhos.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+def preparar_resultados(
+    calculadora,
+    municipios,
+    codigos: Set[str] = None,
+    concluidos: Set[str] = None
+) -> Iterator[Dict]:
+    """
+    Resultados de cálculo prontos para explicar, um município por vez
+
+    Os códigos são filtrados antes do cálculo: municípios fora de 'codigos'
+    ou já em 'concluidos' não são calculados (nem, numa BaseMunicipios,
+    montados como dicionário).
+
+    Args:
+        calculadora: CalculadoraFUNDEB (de preferência com a base nacional carregada)
+        municipios: Lista de dicionários ou BaseMunicipios
+        codigos: Códigos IBGE a incluir (padrão: todos)
+        concluidos: Códigos IBGE a pular (ex.: GeradorExplicacoes.concluidos())
+    """
+    if hasattr(municipios, 'colunas'):
+        registros = ((codigo, i) for i, codigo in enumerate(municipios.colunas['codigo_ibge'].tolist()))
+    else:
+        registros = ((str(m.get('codigo_ibge', '')), m) for m in municipios)
+
+    for codigo, municipio in registros:
+        if codigos is not None and codigo not in codigos:
+            continue
+        if concluidos is not None and codigo in concluidos:
+            continue
+        if isinstance(municipio, int):
+            municipio = municipios[municipio]
+        resultado = calculadora.calcular_ambas_complementacoes(municipio)
+        resultado.update(codigo_ibge=codigo, nse=municipio['nse'], drec=municipio['drec'])
+        yield resultado
+
+
+class GeradorExplicacoes:
+    """
+    Pipeline assíncrono de explicações com progresso retomável
+
+    Exemplo:
+        gerador = GeradorExplicacoes(agente, 'explicacoes.ndjson', concorrencia=4)
+        pendentes = preparar_resultados(calculadora, municipios, concluidos=gerador.concluidos())
+        resumo = gerador.executar(pendentes)
+    """
+
+    def __init__(
+        self,
+        agente,
+        arquivo_resultados: str,
+        concorrencia: int = 4,
+        requisicoes_por_minuto: float = 50,
+        max_tentativas: int = 5,
+        espera_base: float = 1.0,
+        espera_maxima: float = 60.0
+    ):
+        """
+        Args:
+            agente: ChatAgentFUNDEB (ou objeto com explicar_calculo)
+            arquivo_resultados: Arquivo NDJSON de progresso (uma linha por município)
+            concorrencia: Máximo de chamadas simultâneas
+            requisicoes_por_minuto: Limite de requisições (não de tokens) do balde de fichas
+            max_tentativas: Tentativas por município antes de registrar erro
+            espera_base: Espera inicial entre tentativas (dobra a cada falha)
+            espera_maxima: Teto da espera entre tentativas
+        """
+        self.agente = agente
+        self.arquivo_resultados = arquivo_resultados
+        self.concorrencia = concorrencia
+        self.requisicoes_por_minuto = requisicoes_por_minuto
+        self.max_tentativas = max_tentativas
+        self.espera_base = espera_base
+        self.espera_maxima = espera_maxima
+
+    def concluidos(self) -> Set[str]:
+        """Códigos IBGE já explicados com sucesso no arquivo de resultados"""
+        codigos = set()
+        if not os.path.exists(self.arquivo_resultados):
+            return codigos
+        with open(self.arquivo_resultados, 'r', encoding='utf-8') as f:
+            for linha in f:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    # Linha truncada por interrupção
+                    continue
+                if registro.get('status') == 'ok':
+                    codigos.add(registro['codigo_ibge'])
+        return codigos
+
+    def executar(self, resultados: Iterable[Dict], ao_concluir: Callable[[Dict], None] = None) -> Dict[str, int]:
+        """Versão síncrona de executar_async"""
+        return asyncio.run(self.executar_async(resultados, ao_concluir))
+
+    async def executar_async(
+        self,
+        resultados: Iterable[Dict],
+        ao_concluir: Callable[[Dict], None] = None
+    ) -> Dict[str, int]:
+        """
+        Gera as explicações pendentes
+
+        Args:
+            resultados: Resultados de cálculo com 'codigo_ibge' (ver preparar_resultados)
+            ao_concluir: Chamado com o registro gravado de cada município
+
+        Returns:
+            Contagem de 'ok', 'erro' e 'pulados'
+        """
+        feitos = self.concluidos()
+        balde = BaldeFichas(self.requisicoes_por_minuto)
+        contagem = {'ok': 0, 'erro': 0, 'pulados': 0}
+        fila = asyncio.Queue(maxsize=self.concorrencia * 2)
+
+        with open(self.arquivo_resultados, 'a+', encoding='utf-8') as arquivo:
+            # Separa de uma última linha truncada por interrupção anterior
+            if arquivo.tell() > 0:
+                arquivo.seek(arquivo.tell() - 1)
+                if arquivo.read(1) != '\n':
+                    arquivo.write('\n')
+
+            async def trabalhador():
+                while True:
+                    resultado = await fila.get()
+                    if resultado is None:
+                        return
+                    registro = await self._explicar(resultado, balde)
+                    arquivo.write(json.dumps(registro, ensure_ascii=False) + '\n')
+                    arquivo.flush()
+                    contagem[registro['status']] += 1
+                    if ao_concluir is not None:
+                        ao_concluir(registro)
+
+            # Fila limitada: os resultados são consumidos sob demanda, sem carregar todos
+            tarefas = [asyncio.create_task(trabalhador()) for _ in range(self.concorrencia)]
+            for resultado in resultados:
+                if resultado['codigo_ibge'] in feitos:
+                    contagem['pulados'] += 1
+                    continue
+                await fila.put(resultado)
+            for _ in tarefas:
+                await fila.put(None)
+            await asyncio.gather(*tarefas)
+
+        return contagem
+
+    async def _explicar(self, resultado: Dict, balde: BaldeFichas) -> Dict:
+        """Explica um município com novas tentativas; devolve o registro a gravar"""
+        registro = {
+            'codigo_ibge': resultado['codigo_ibge'],
+            'municipio': resultado.get('municipio'),
+            'uf': resultado.get('uf'),
+        }
+        inicio = time.perf_counter()
+
+        for tentativa in range(1, self.max_tentativas + 1):
+            await balde.retirar()
+            try:
+                explicacao = await asyncio.to_thread(self.agente.explicar_calculo, resultado)
+            except Exception as erro:
+                if not _repetivel(erro) or tentativa == self.max_tentativas:
+                    registro.update(status='erro', erro=f"{type(erro).__name__}: {erro}")
+                    break
+
+                espera = min(self.espera_maxima, self.espera_base * 2 ** (tentativa - 1))
+                espera *= random.uniform(0.5, 1.0)
+                sugerida = _retry_after(erro)
+                if sugerida is not None:
+                    espera = max(espera, sugerida)
+                if getattr(erro, 'status_code', None) == 429:
+                    balde.pausar(espera)
+                await asyncio.sleep(espera)
+            else:
+                registro.update(status='ok', explicacao=explicacao)
+                break
+
+        registro.update(tentativas=tentativa, duracao=round(time.perf_counter() - inicio, 3))
+        return registro
+
+
+def main(argv=None):
+    from anthropic import Anthropic
+
+    from base_municipios import carregar_municipios
+    from calculadora import CalculadoraFUNDEB
+    from chat_agent import CacheRespostas, ChatAgentFUNDEB
+
+    parser = argparse.ArgumentParser(description="Gera explicações de cálculo para vários municípios")
+    parser.add_argument('saida', help="Arquivo NDJSON de resultados (retomado se já existir)")
+    parser.add_argument('--base', default='dados/municipios.json', help="Base de municípios (JSON ou colunar)")
+    parser.add_argument('--uf', action='append', help="Restringe a uma UF (pode repetir)")
+    parser.add_argument('--codigos', help="Arquivo com um código IBGE por linha")
+    parser.add_argument('--concorrencia', type=int, default=4)
+    parser.add_argument('--rpm', type=float, default=50, help="Requisições por minuto (tokens não são limitados)")
+    parser.add_argument('--tentativas', type=int, default=5)
+    parser.add_argument('--base-url', help="Endpoint alternativo da API (ex.: servidor local de testes)")
+    parser.add_argument('--sem-cache', action='store_true', help="Não usa o cache de respostas em disco")
+    args = parser.parse_args(argv)
+
+    municipios = carregar_municipios(args.base)
+    calculadora = CalculadoraFUNDEB()
+    calculadora.carregar_base_nacional(municipios)
+
+    codigos = None
+    if args.codigos:
+        with open(args.codigos, 'r', encoding='utf-8') as f:
+            codigos = {linha.strip() for linha in f if linha.strip()}
+    if args.uf:
+        municipios = [m for uf in args.uf for m in municipios.por_uf(uf)]
+
+    # As novas tentativas ficam com o pipeline (balde de fichas + espera exponencial)
+    client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'), base_url=args.base_url, max_retries=0)
+    agente = ChatAgentFUNDEB(client=client, cache=None if args.sem_cache else CacheRespostas())
+
+    gerador = GeradorExplicacoes(
+        agente,
+        args.saida,
+        concorrencia=args.concorrencia,
+        requisicoes_por_minuto=args.rpm,
+        max_tentativas=args.tentativas
+    )
+
+    def progresso(registro):
+        simbolo = '✅' if registro['status'] == 'ok' else '❌'
+        print(f"{simbolo} {registro['municipio']} - {registro['uf']} ({registro['duracao']:.1f} s)", flush=True)
+
+    # Os já explicados são pulados antes do cálculo
+    feitos = gerador.concluidos()
+    contagem = gerador.executar(preparar_resultados(calculadora, municipios, codigos, feitos), progresso)
+    print(f"Concluídos: {contagem['ok']} | Erros: {contagem['erro']} | Já no arquivo: {len(feitos)}")
+    return 0 if contagem['erro'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
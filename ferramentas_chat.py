@@ -0,0 +1,249 @@
+"""
+Ferramentas da calculadora expostas ao modelo do chat
+
+Em vez de colar um resultado pronto no prompt, o agente oferece ao modelo
+três operações da CalculadoraFUNDEB: buscar município (por código IBGE ou
+nome), calcular um município e simular um cenário de matrículas. O modelo
+chama o que precisar para responder "e se a creche integral crescer 20%?"
+ou "compare com Acrelândia". Os resultados ficam em cache pela conversa.
+"""
+import json
+import unicodedata
+from typing import Dict, List
+
+from base_municipios import ETAPAS, BaseMunicipios
+from ponderadores import impressao_digital
+
+
+def _normalizar_nome(texto: str) -> str:
+    texto = unicodedata.normalize('NFKD', texto.casefold())
+    return ''.join(c for c in texto if not unicodedata.combining(c)).strip()
+
+
+_ESQUEMA_ETAPAS = {
+    'type': 'object',
+    'properties': {etapa: {'type': 'number'} for etapa in ETAPAS},
+    'additionalProperties': False,
+}
+
+DEFINICOES = [
+    {
+        'name': 'buscar_municipio',
+        'description': (
+            "Busca municípios da base pelo código IBGE ou por parte do nome (sem "
+            "diferenciar acentos). Use antes de calcular quando só tiver o nome."
+        ),
+        'input_schema': {
+            'type': 'object',
+            'properties': {
+                'consulta': {'type': 'string', 'description': "Código IBGE ou nome (ou parte)"},
+                'uf': {'type': 'string', 'description': "Sigla da UF para filtrar (opcional)"},
+            },
+            'required': ['consulta'],
+        },
+    },
+    {
+        'name': 'calcular_municipio',
+        'description': (
+            "Calcula as complementações VAAT e VAAF de um município com os dados "
+            "atuais: valor total, elegibilidade, valor aluno/ano, limiar nacional "
+            "e matrículas por etapa."
+        ),
+        'input_schema': {
+            'type': 'object',
+            'properties': {'codigo_ibge': {'type': 'string'}},
+            'required': ['codigo_ibge'],
+        },
+    },
+    {
+        'name': 'simular_cenario',
+        'description': (
+            "Simula um cenário para um município alterando matrículas (variação "
+            "percentual ou valor absoluto por etapa), NSE ou DRec, e devolve o "
+            "resultado atual, o simulado e a diferença. Etapas: " + ', '.join(ETAPAS)
+        ),
+        'input_schema': {
+            'type': 'object',
+            'properties': {
+                'codigo_ibge': {'type': 'string'},
+                'variacao_percentual': dict(
+                    _ESQUEMA_ETAPAS, description="Ex.: {'creche_integral': 20} = +20% (mínimo -100)"
+                ),
+                'matriculas': dict(_ESQUEMA_ETAPAS, description="Novo número absoluto de matrículas por etapa"),
+                'nse': {'type': 'number'},
+                'drec': {'type': 'number'},
+            },
+            'required': ['codigo_ibge'],
+        },
+    },
+]
+
+
+class FerramentasCalculadora:
+    """
+    Executor das ferramentas do chat, com cache de resultados por conversa
+
+    Crie uma instância por conversa (ex.: em st.session_state) para que
+    chamadas repetidas com os mesmos argumentos não recalculem.
+    """
+
+    def __init__(self, calculadora, municipios, max_resultados_busca: int = 5):
+        """
+        Args:
+            calculadora: CalculadoraFUNDEB com a base nacional carregada
+            municipios: Lista de dicionários ou BaseMunicipios
+            max_resultados_busca: Limite de municípios devolvidos por buscar_municipio
+        """
+        self.calculadora = calculadora
+        self.base = BaseMunicipios.como_base(municipios)
+        self.max_resultados_busca = max_resultados_busca
+        self.definicoes = DEFINICOES
+        self.cache: Dict[str, Dict] = {}
+        self.chamadas = 0
+        self._nomes = None
+
+        # Identifica dados + ponderadores (entra na chave do cache de respostas)
+        self.versao = impressao_digital([
+            self.base.impressao_digital(), calculadora.versao_ponderadores, calculadora.contexto_nacional
+        ])[:16]
+
+    def executar(self, nome: str, argumentos: Dict) -> Dict:
+        """
+        Executa uma ferramenta (ou devolve o resultado já calculado na conversa)
+
+        Raises:
+            KeyError: Ferramenta ou município inexistente
+            ValueError: Argumentos inválidos
+        """
+        chave = json.dumps([nome, argumentos], sort_keys=True, ensure_ascii=False)
+        if chave not in self.cache:
+            metodo = {
+                'buscar_municipio': self.buscar_municipio,
+                'calcular_municipio': self.calcular_municipio,
+                'simular_cenario': self.simular_cenario,
+            }.get(nome)
+            if metodo is None:
+                raise KeyError(f"Ferramenta desconhecida: {nome}")
+            self.cache[chave] = metodo(**argumentos)
+            self.chamadas += 1
+        return self.cache[chave]
+
+    # ---------- Ferramentas ----------
+
+    def buscar_municipio(self, consulta: str, uf: str = None) -> Dict:
+        consulta = str(consulta).strip()
+        if consulta.isdigit():
+            try:
+                indices = [self.base.indice(consulta)]
+            except KeyError:
+                indices = []
+        else:
+            if self._nomes is None:
+                self._nomes = [_normalizar_nome(nome) for nome in self.base.colunas['nome'].tolist()]
+            alvo = _normalizar_nome(consulta)
+            candidatos = self.base.indices_uf(uf.upper()).tolist() if uf else range(len(self.base))
+            # Nome exato primeiro, depois os que começam com a consulta, depois os que a contêm
+            indices = sorted(
+                (i for i in candidatos if alvo in self._nomes[i]),
+                key=lambda i: (self._nomes[i] != alvo, not self._nomes[i].startswith(alvo), self._nomes[i])
+            )
+
+        municipios = []
+        for i in indices[:self.max_resultados_busca]:
+            registro = self.base[i]
+            municipios.append({campo: registro[campo] for campo in ('codigo_ibge', 'nome', 'uf', 'populacao')})
+        return {'municipios': municipios, 'total_encontrados': len(indices)}
+
+    def calcular_municipio(self, codigo_ibge: str) -> Dict:
+        municipio = self.base.por_codigo(codigo_ibge)
+        resultado = self.calculadora.calcular_ambas_complementacoes(municipio)
+        return self._resumir(municipio, resultado)
+
+    def simular_cenario(
+        self,
+        codigo_ibge: str,
+        variacao_percentual: Dict[str, float] = None,
+        matriculas: Dict[str, float] = None,
+        nse: float = None,
+        drec: float = None
+    ) -> Dict:
+        original = self.base.por_codigo(codigo_ibge)
+        simulado = dict(original, matriculas=dict(original['matriculas']))
+
+        for etapa, variacao in (variacao_percentual or {}).items():
+            if etapa not in simulado['matriculas']:
+                raise ValueError(f"Etapa desconhecida: {etapa}")
+            if variacao < -100:
+                raise ValueError(f"Variação de {etapa} abaixo de -100% ({variacao}%): matrículas ficariam negativas")
+            simulado['matriculas'][etapa] = round(simulado['matriculas'][etapa] * (1 + variacao / 100))
+        for etapa, valor in (matriculas or {}).items():
+            if etapa not in simulado['matriculas']:
+                raise ValueError(f"Etapa desconhecida: {etapa}")
+            simulado['matriculas'][etapa] = max(0, round(valor))
+        if nse is not None:
+            simulado['nse'] = nse
+        if drec is not None:
+            simulado['drec'] = drec
+
+        atual = self.calcular_municipio(codigo_ibge)
+        totais = self.calculadora.totais_com_delta(original, simulado)
+        cenario = self._resumir(simulado, self.calculadora.calcular_ambas_complementacoes(simulado, totais))
+        return {
+            'atual': atual,
+            'simulado': cenario,
+            'diferenca': {
+                tipo: round(cenario[tipo]['valor_total'] - atual[tipo]['valor_total'], 2)
+                for tipo in ('vaat', 'vaaf', 'total_complementacoes')
+            },
+        }
+
+    @staticmethod
+    def _resumir(municipio: Dict, resultado: Dict) -> Dict:
+        """Resultado compacto para o modelo (sem o detalhamento por etapa)"""
+        resumo = {
+            'codigo_ibge': municipio.get('codigo_ibge'),
+            'municipio': resultado['municipio'],
+            'uf': resultado['uf'],
+            'nse': municipio['nse'],
+            'drec': municipio['drec'],
+            'matriculas': municipio['matriculas'],
+            'matriculas_totais': resultado['matriculas_totais'],
+        }
+        for tipo in ('vaat', 'vaaf'):
+            dados = resultado[tipo]
+            resumo[tipo] = {
+                'valor_total': round(dados['valor_total'], 2),
+                'elegivel': bool(dados['elegivel']),
+                'valor_aluno_ano': round(dados['valor_aluno_ano'], 2),
+                'limiar': None if dados['limiar'] is None else round(dados['limiar'], 2),
+            }
+        resumo['total_complementacoes'] = {'valor_total': round(resultado['total_complementacoes'], 2)}
+        return resumo
+
+
+def blocos_para_mensagem(conteudo) -> List[Dict]:
+    """Converte blocos de resposta (texto e tool_use) em dicionários reenviáveis"""
+    blocos = []
+    for bloco in conteudo:
+        if bloco.type == 'text':
+            blocos.append({'type': 'text', 'text': bloco.text})
+        elif bloco.type == 'tool_use':
+            blocos.append({'type': 'tool_use', 'id': bloco.id, 'name': bloco.name, 'input': bloco.input})
+    return blocos
+
+
+def executar_chamadas(ferramentas: FerramentasCalculadora, conteudo) -> List[Dict]:
+    """Executa os blocos tool_use de uma resposta e monta os tool_result"""
+    resultados = []
+    for bloco in conteudo:
+        if bloco.type != 'tool_use':
+            continue
+        try:
+            saida = json.dumps(ferramentas.executar(bloco.name, bloco.input), ensure_ascii=False)
+            resultados.append({'type': 'tool_result', 'tool_use_id': bloco.id, 'content': saida})
+        except (KeyError, ValueError, TypeError) as erro:
+            resultados.append({
+                'type': 'tool_result', 'tool_use_id': bloco.id,
+                'content': f"Erro: {erro}", 'is_error': True,
+            })
+    return resultados
@@ -0,0 +1,193 @@
+"""
+Gráficos da comparação nacional com tamanho limitado
+
+Uma barra por município deixa a figura (e o JSON enviado ao navegador)
+proporcional ao número de municípios. Aqui os dados são reduzidos no
+servidor antes de virar figura: soma por UF, histograma, maiores e menores
+valores e uma dispersão em WebGL (Scattergl) com amostra de no máximo
+max_pontos municípios. Todas as funções recebem o resultado de
+CalculadoraFUNDEB.calcular_lote.
+"""
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from calculadora import TIPOS_COMPLEMENTACAO
+
+ROTULOS = {'vaat': 'VAAT', 'vaaf': 'VAAF'}
+
+MODOS = ('Por UF', 'Distribuição', 'Maiores e menores', 'Dispersão (WebGL)', 'Por município')
+
+
+def por_aluno(lote: Dict, tipo: str) -> np.ndarray:
+    """Complementação por matrícula (0 para municípios sem matrículas)"""
+    matriculas = np.asarray(lote['matriculas_totais'], dtype=np.float64)
+    return np.divide(
+        lote[tipo]['valor_total'], matriculas,
+        out=np.zeros_like(matriculas), where=matriculas > 0
+    )
+
+
+def agregar_por_uf(lote: Dict) -> pd.DataFrame:
+    """
+    Soma por UF (uma linha por UF, ordenada pelo total)
+
+    Returns:
+        DataFrame com UF, Municípios, VAAT, VAAF, Total, Matrículas e
+        colunas '<tipo> por aluno'
+    """
+    ufs, codigos = np.unique(np.asarray(lote['uf']), return_inverse=True)
+
+    def somar(valores):
+        return np.bincount(codigos, weights=np.asarray(valores, dtype=np.float64), minlength=len(ufs))
+
+    df = pd.DataFrame({
+        'UF': ufs,
+        'Municípios': np.bincount(codigos, minlength=len(ufs)),
+        'VAAT': somar(lote['vaat']['valor_total']),
+        'VAAF': somar(lote['vaaf']['valor_total']),
+        'Total': somar(lote['total_complementacoes']),
+        'Matrículas': somar(lote['matriculas_totais']),
+    })
+    for tipo in TIPOS_COMPLEMENTACAO:
+        df[f'{ROTULOS[tipo]} por aluno'] = np.divide(
+            df[ROTULOS[tipo]], df['Matrículas'],
+            out=np.zeros(len(df)), where=df['Matrículas'] > 0
+        )
+    return df.sort_values('Total', ascending=False, ignore_index=True)
+
+
+def figura_por_uf(lote: Dict) -> go.Figure:
+    """Barras empilhadas VAAT + VAAF por UF"""
+    df = agregar_por_uf(lote)
+    fig = go.Figure([
+        go.Bar(name=ROTULOS[tipo], x=df['UF'], y=df[ROTULOS[tipo]], customdata=df['Municípios'],
+               hovertemplate='%{x}: R$ %{y:,.2f} (%{customdata} municípios)<extra></extra>')
+        for tipo in TIPOS_COMPLEMENTACAO
+    ])
+    fig.update_layout(title='Complementações por UF', xaxis_title='UF', yaxis_title='Valor (R$)',
+                      barmode='stack')
+    return fig
+
+
+def figura_distribuicao(lote: Dict, tipo: str = 'vaat', faixas: int = 40) -> go.Figure:
+    """
+    Histograma da complementação por aluno entre os municípios que recebem
+
+    As contagens são calculadas no servidor (np.histogram); a figura leva só
+    as faixas, não os valores de cada município.
+    """
+    valores = por_aluno(lote, tipo)
+    valores = valores[valores > 0]
+    contagens, bordas = np.histogram(valores, bins=faixas) if len(valores) else (np.zeros(0), np.zeros(1))
+    centros = (bordas[:-1] + bordas[1:]) / 2
+    fig = go.Figure(go.Bar(
+        x=centros, y=contagens, width=np.diff(bordas),
+        customdata=np.column_stack([bordas[:-1], bordas[1:]]),
+        hovertemplate='R$ %{customdata[0]:,.0f} – %{customdata[1]:,.0f}: %{y} municípios<extra></extra>'
+    ))
+    fig.update_layout(
+        title=f'Distribuição da complementação {ROTULOS[tipo]} por aluno ({len(valores)} municípios que recebem)',
+        xaxis_title='R$ por aluno', yaxis_title='Municípios', bargap=0.02
+    )
+    return fig
+
+
+def maiores_e_menores(lote: Dict, tipo: str = 'vaat', k: int = 15) -> pd.DataFrame:
+    """
+    Os k maiores e os k menores valores por aluno entre os que recebem
+
+    Usa np.argpartition (sem ordenar a base inteira).
+
+    Returns:
+        DataFrame com Município, UF, Por aluno e Grupo ('Maiores'/'Menores')
+    """
+    valores = por_aluno(lote, tipo)
+    recebem = np.flatnonzero(valores > 0)
+    k = min(k, len(recebem))
+    if k == 0:
+        return pd.DataFrame(columns=['Município', 'UF', 'Por aluno', 'Grupo'])
+
+    def selecionar(chaves, grupo):
+        parcial = recebem[np.argpartition(chaves, k - 1)[:k]] if k < len(recebem) else recebem
+        parcial = parcial[np.argsort(valores[parcial])[::-1]]
+        return pd.DataFrame({
+            'Município': [lote['municipio'][i] for i in parcial],
+            'UF': [lote['uf'][i] for i in parcial],
+            'Por aluno': valores[parcial],
+            'Grupo': grupo,
+        })
+
+    return pd.concat([
+        selecionar(-valores[recebem], 'Maiores'),
+        selecionar(valores[recebem], 'Menores'),
+    ], ignore_index=True)
+
+
+def figura_maiores_e_menores(lote: Dict, tipo: str = 'vaat', k: int = 15) -> go.Figure:
+    """Barras horizontais com os k maiores e k menores valores por aluno"""
+    df = maiores_e_menores(lote, tipo, k)
+    fig = go.Figure([
+        go.Bar(name=grupo, orientation='h', x=parte['Por aluno'][::-1],
+               y=(parte['Município'] + ' - ' + parte['UF'])[::-1],
+               hovertemplate='%{y}: R$ %{x:,.2f} por aluno<extra></extra>')
+        for grupo, parte in df.groupby('Grupo', sort=False)
+    ])
+    fig.update_layout(title=f'{ROTULOS[tipo]} por aluno: {k} maiores e {k} menores',
+                      xaxis_title='R$ por aluno', height=300 + 18 * len(df))
+    return fig
+
+
+def figura_dispersao(lote: Dict, max_pontos: int = 20000, semente: int = 0) -> go.Figure:
+    """
+    Matrículas × complementação total por aluno em WebGL (Scattergl)
+
+    Acima de max_pontos municípios, desenha uma amostra aleatória fixa
+    (mesma semente, mesmos pontos) e informa o total no título.
+    """
+    n = len(lote['municipio'])
+    indices = np.arange(n)
+    if n > max_pontos:
+        indices = np.sort(np.random.default_rng(semente).choice(n, size=max_pontos, replace=False))
+
+    matriculas = np.asarray(lote['matriculas_totais'], dtype=np.float64)[indices]
+    total_por_aluno = np.divide(
+        np.asarray(lote['total_complementacoes'])[indices], matriculas,
+        out=np.zeros_like(matriculas), where=matriculas > 0
+    )
+    ufs = np.asarray(lote['uf'])[indices]
+    nomes = np.asarray(lote['municipio'], dtype=object)[indices]
+    fig = go.Figure(go.Scattergl(
+        x=matriculas,
+        y=total_por_aluno,
+        mode='markers',
+        marker={'size': 5, 'opacity': 0.6},
+        text=nomes + ' - ' + ufs,
+        hovertemplate='%{text}<br>%{x:,.0f} matrículas<br>R$ %{y:,.2f} por aluno<extra></extra>'
+    ))
+    amostra = f' (amostra de {len(indices):,} de {n:,})' if len(indices) < n else ''
+    fig.update_layout(title=f'Matrículas × complementação por aluno{amostra}',
+                      xaxis_title='Matrículas', yaxis_title='R$ por aluno', xaxis_type='log')
+    return fig
+
+
+def figura_por_municipio(lote: Dict, max_barras: int = 50) -> go.Figure:
+    """Barras empilhadas por município (os max_barras maiores totais)"""
+    totais = np.asarray(lote['total_complementacoes'])
+    indices = np.arange(len(totais))
+    if len(totais) > max_barras:
+        indices = np.argpartition(-totais, max_barras - 1)[:max_barras]
+    indices = indices[np.argsort(-totais[indices], kind='stable')]
+    nomes = [lote['municipio'][i] for i in indices]
+
+    fig = go.Figure([
+        go.Bar(name=ROTULOS[tipo], x=nomes, y=np.asarray(lote[tipo]['valor_total'])[indices])
+        for tipo in TIPOS_COMPLEMENTACAO
+    ])
+    titulo = 'Complementações por Município'
+    if len(indices) < len(totais):
+        titulo += f' ({len(indices)} maiores de {len(totais):,})'
+    fig.update_layout(title=titulo, xaxis_title='Município', yaxis_title='Valor (R$)', barmode='stack')
+    return fig
@@ -0,0 +1,317 @@
+"""
+Índice lexical (BM25) sobre textos legais locais
+
+Divide os documentos de dados/legal/ (Markdown e texto) e os PDFs de docs/
+em trechos curtos e monta um índice BM25 invertido em arrays NumPy, gravado
+em disco ao lado dos documentos. Cada pergunta do chat recupera apenas os
+k trechos mais relevantes, de modo que a cobertura legal pode crescer sem
+aumentar o prompt.
+
+Uso:
+    python indice_legal.py "qual o ponderador da creche integral?"
+"""
+import glob
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence
+
+import numpy as np
+
+from base_municipios import criar_versao, trocar_diretorio
+from ponderadores import impressao_digital
+
+
+VERSAO_INDICE = 1
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+FONTES_PADRAO = (
+    os.path.join(RAIZ, 'dados', 'legal', '*.md'),
+    os.path.join(RAIZ, 'dados', 'legal', '*.txt'),
+    os.path.join(RAIZ, 'docs', '*.pdf'),
+)
+DIRETORIO_PADRAO = os.path.join(RAIZ, 'dados', 'legal.indice')
+
+STOPWORDS = frozenset("""
+a ao aos as com como da das de do dos e ela ele em entre era essa esse esta este eu foi
+ha isso ja la mais mas me mesmo muito na nas nem no nos o os ou para pela pelas pelo pelos
+por qual quando que quem se sem ser seu sua sao so tambem tem um uma umas uns
+""".split())
+
+
+def normalizar_termos(texto: str) -> List[str]:
+    """Termos de busca: minúsculas, sem acentos e sem palavras vazias"""
+    texto = unicodedata.normalize('NFKD', texto.casefold())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return [t for t in re.findall(r'\w+', texto) if t not in STOPWORDS]
+
+
+def _dividir_em_trechos(texto: str, fonte: str, max_palavras: int = 180) -> List[Dict]:
+    """
+    Trechos de até max_palavras, respeitando parágrafos e títulos Markdown
+
+    Cada trecho leva o título da seção em que está, para manter contexto
+    quando é recuperado isoladamente.
+    """
+    trechos = []
+    titulo = ''
+    atual: List[str] = []
+
+    def fechar():
+        if atual:
+            corpo = '\n'.join(atual).strip()
+            if corpo:
+                trechos.append({'fonte': fonte, 'titulo': titulo, 'texto': corpo})
+            atual.clear()
+
+    for paragrafo in re.split(r'\n\s*\n', texto):
+        paragrafo = paragrafo.strip()
+        if not paragrafo:
+            continue
+        if paragrafo.startswith('#'):
+            fechar()
+            linhas = paragrafo.split('\n')
+            titulo = linhas[0].lstrip('#').strip()
+            paragrafo = '\n'.join(linhas[1:]).strip()
+            if not paragrafo:
+                continue
+
+        palavras = paragrafo.split()
+        if len(palavras) > max_palavras:
+            # Parágrafo longo (ex.: página de PDF): janelas com sobreposição
+            fechar()
+            passo = max_palavras - max_palavras // 6
+            for inicio in range(0, len(palavras), passo):
+                atual.append(' '.join(palavras[inicio:inicio + max_palavras]))
+                fechar()
+                if inicio + max_palavras >= len(palavras):
+                    break
+            continue
+
+        if sum(len(p.split()) for p in atual) + len(palavras) > max_palavras:
+            fechar()
+        atual.append(paragrafo)
+
+    fechar()
+    return trechos
+
+
+def _ler_documento(caminho: str) -> List[Dict]:
+    """Trechos de um arquivo .md/.txt ou .pdf (PDF requer pypdf)"""
+    nome = os.path.relpath(caminho, RAIZ)
+    if caminho.lower().endswith('.pdf'):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            print(f"⚠️ pypdf não instalado; {nome} ignorado (pip install pypdf)", file=sys.stderr)
+            return []
+        trechos = []
+        for numero, pagina in enumerate(PdfReader(caminho).pages, start=1):
+            trechos.extend(_dividir_em_trechos(pagina.extract_text() or '', f'{nome}, p. {numero}'))
+        return trechos
+
+    with open(caminho, 'r', encoding='utf-8') as f:
+        return _dividir_em_trechos(f.read(), nome)
+
+
+def _arquivos(fontes: Sequence[str]) -> List[str]:
+    return sorted({caminho for padrao in fontes for caminho in glob.glob(padrao)})
+
+
+def _assinatura_fontes(arquivos: Sequence[str]) -> str:
+    """Identifica o conjunto de documentos (caminho, tamanho e data de modificação)"""
+    return impressao_digital([
+        VERSAO_INDICE,
+        [(os.path.relpath(c, RAIZ), os.path.getsize(c), int(os.path.getmtime(c))) for c in arquivos],
+    ])
+
+
+class IndiceLegal:
+    """
+    Índice BM25 invertido
+
+    As listas de ocorrências ficam em formato CSR: para o termo t, os trechos
+    estão em documentos[inicio[t]:inicio[t + 1]] e as frequências em
+    frequencias[...] na mesma faixa.
+    """
+
+    def __init__(
+        self,
+        trechos: List[Dict],
+        vocabulario: Dict[str, int],
+        inicio: np.ndarray,
+        documentos: np.ndarray,
+        frequencias: np.ndarray,
+        comprimentos: np.ndarray,
+        assinatura: str = '',
+        k1: float = 1.5,
+        b: float = 0.75
+    ):
+        self.trechos = trechos
+        self.vocabulario = vocabulario
+        self.inicio = inicio
+        self.documentos = documentos
+        self.frequencias = frequencias
+        self.comprimentos = comprimentos
+        self.assinatura = assinatura
+        self.k1 = k1
+        self.b = b
+
+        n = len(trechos)
+        self._comprimento_medio = float(comprimentos.mean()) if n else 0.0
+        df = np.diff(inicio)
+        self._idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    @classmethod
+    def construir(cls, trechos: List[Dict], assinatura: str = '') -> 'IndiceLegal':
+        """Monta o índice a partir dos trechos"""
+        vocabulario: Dict[str, int] = {}
+        ocorrencias: List[Dict[int, int]] = []
+        comprimentos = np.zeros(len(trechos), dtype=np.int32)
+
+        for i, trecho in enumerate(trechos):
+            termos = normalizar_termos(f"{trecho['titulo']} {trecho['texto']}")
+            comprimentos[i] = len(termos)
+            for termo in termos:
+                t = vocabulario.setdefault(termo, len(vocabulario))
+                if t == len(ocorrencias):
+                    ocorrencias.append({})
+                ocorrencias[t][i] = ocorrencias[t].get(i, 0) + 1
+
+        inicio = np.zeros(len(vocabulario) + 1, dtype=np.int64)
+        inicio[1:] = np.cumsum([len(o) for o in ocorrencias])
+        documentos = np.zeros(inicio[-1], dtype=np.int32)
+        frequencias = np.zeros(inicio[-1], dtype=np.float32)
+        for t, lista in enumerate(ocorrencias):
+            documentos[inicio[t]:inicio[t + 1]] = list(lista.keys())
+            frequencias[inicio[t]:inicio[t + 1]] = list(lista.values())
+
+        return cls(trechos, vocabulario, inicio, documentos, frequencias, comprimentos, assinatura)
+
+    # ---------- Persistência ----------
+
+    def salvar(self, diretorio: str):
+        """Grava o índice (troca atômica do diretório, como na base colunar)"""
+        destino = os.path.abspath(diretorio)
+        temporario = criar_versao(destino)
+        try:
+            np.savez(
+                os.path.join(temporario, 'postings.npz'),
+                inicio=self.inicio, documentos=self.documentos,
+                frequencias=self.frequencias, comprimentos=self.comprimentos
+            )
+            meta = {
+                'formato': VERSAO_INDICE,
+                'assinatura': self.assinatura,
+                'vocabulario': self.vocabulario,
+                'trechos': self.trechos,
+            }
+            with open(os.path.join(temporario, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+
+            trocar_diretorio(temporario, destino)
+        except BaseException:
+            shutil.rmtree(temporario, ignore_errors=True)
+            raise
+
+    @classmethod
+    def abrir(cls, diretorio: str) -> 'IndiceLegal':
+        diretorio = os.path.realpath(diretorio)
+        with open(os.path.join(diretorio, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta['formato'] != VERSAO_INDICE:
+            raise ValueError(f"Índice legal incompatível em {diretorio}")
+        with np.load(os.path.join(diretorio, 'postings.npz')) as p:
+            return cls(
+                meta['trechos'], meta['vocabulario'],
+                p['inicio'], p['documentos'], p['frequencias'], p['comprimentos'],
+                meta['assinatura']
+            )
+
+    # ---------- Busca ----------
+
+    def buscar(self, pergunta: str, k: int = 5, excluir_fontes: Iterable[str] = ()) -> List[Dict]:
+        """
+        Trechos mais relevantes para a pergunta
+
+        Args:
+            pergunta: Texto livre
+            k: Número máximo de trechos
+            excluir_fontes: Fontes cujos trechos são ignorados (ex.: as já enviadas inteiras)
+
+        Returns:
+            Trechos (fonte, titulo, texto, pontuacao) em ordem decrescente de pontuação
+        """
+        pontuacao = np.zeros(len(self.trechos), dtype=np.float64)
+        normalizacao = self.k1 * (1 - self.b + self.b * self.comprimentos / max(self._comprimento_medio, 1e-9))
+
+        for termo in set(normalizar_termos(pergunta)):
+            t = self.vocabulario.get(termo)
+            if t is None:
+                continue
+            faixa = slice(self.inicio[t], self.inicio[t + 1])
+            docs = self.documentos[faixa]
+            tf = self.frequencias[faixa]
+            pontuacao[docs] += self._idf[t] * tf * (self.k1 + 1) / (tf + normalizacao[docs])
+
+        candidatos = np.flatnonzero(pontuacao > 0)
+        excluir_fontes = set(excluir_fontes)
+        if excluir_fontes:
+            candidatos = np.array(
+                [i for i in candidatos if self.trechos[i]['fonte'] not in excluir_fontes], dtype=np.int64
+            )
+        if len(candidatos) > k:
+            candidatos = candidatos[np.argpartition(-pontuacao[candidatos], k)[:k]]
+        ordem = candidatos[np.argsort(-pontuacao[candidatos], kind='stable')]
+        return [dict(self.trechos[i], pontuacao=float(pontuacao[i])) for i in ordem]
+
+    def __len__(self) -> int:
+        return len(self.trechos)
+
+
+def construir_indice(fontes: Sequence[str] = FONTES_PADRAO) -> IndiceLegal:
+    """Lê os documentos e monta o índice em memória"""
+    arquivos = _arquivos(fontes)
+    trechos = [trecho for caminho in arquivos for trecho in _ler_documento(caminho)]
+    return IndiceLegal.construir(trechos, _assinatura_fontes(arquivos))
+
+
+def carregar_indice(fontes: Sequence[str] = FONTES_PADRAO, diretorio: str = DIRETORIO_PADRAO) -> IndiceLegal:
+    """
+    Índice gravado em disco, reconstruído se os documentos mudaram
+
+    Sem permissão de escrita, mantém o índice apenas em memória.
+    """
+    assinatura = _assinatura_fontes(_arquivos(fontes))
+    try:
+        indice = IndiceLegal.abrir(diretorio)
+        if indice.assinatura == assinatura:
+            return indice
+    except (OSError, ValueError, KeyError):
+        pass
+
+    indice = construir_indice(fontes)
+    try:
+        indice.salvar(diretorio)
+    except OSError:
+        pass
+    return indice
+
+
+@lru_cache(maxsize=None)
+def obter_indice_legal() -> IndiceLegal:
+    """Índice das fontes padrão, carregado uma única vez por processo"""
+    return carregar_indice()
+
+
+if __name__ == '__main__':
+    indice = carregar_indice()
+    print(f"Índice legal: {len(indice)} trechos, {len(indice.vocabulario)} termos")
+    if len(sys.argv) > 1:
+        for trecho in indice.buscar(' '.join(sys.argv[1:])):
+            print(f"\n[{trecho['fonte']} — {trecho['titulo']}] ({trecho['pontuacao']:.2f})\n{trecho['texto'][:300]}")
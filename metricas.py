@@ -0,0 +1,195 @@
+"""
+Métricas de tempo do processo (cálculos, chat e etapas da interface)
+
+Um registro único por processo acumula durações e contadores com nome
+(ex.: 'CalculadoraFUNDEB.calcular_lote', 'chat.tokens_saida'). Cada métrica
+guarda contagem, soma e máximo, mais uma janela circular das últimas
+amostras para os percentis. Desligado (padrão), cronometrar e medir custam
+uma verificação de atributo; ligue com FUNDEB_METRICAS=1 ou pelo painel
+de administração do app.
+
+Uso:
+    from metricas import contar, cronometrar, medir
+
+    @cronometrar()
+    def calcular(...): ...
+
+    with medir('app.tabela'):
+        ...
+"""
+import contextlib
+import functools
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+import numpy as np
+
+QUANTIS = (0.5, 0.9, 0.99)
+
+_NULO = contextlib.nullcontext()
+
+
+class _Serie:
+    """Contagem, soma, máximo e janela circular das últimas amostras"""
+
+    __slots__ = ('n', 'total', 'maximo', 'amostras', 'posicao')
+
+    def __init__(self, max_amostras: int):
+        self.n = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self.amostras = np.empty(max_amostras, dtype=np.float64)
+        self.posicao = 0
+
+    def adicionar(self, valor: float):
+        self.n += 1
+        self.total += valor
+        self.maximo = max(self.maximo, valor)
+        self.amostras[self.posicao] = valor
+        self.posicao = (self.posicao + 1) % len(self.amostras)
+
+    def janela(self) -> np.ndarray:
+        return self.amostras[:min(self.n, len(self.amostras))]
+
+
+class _Cronometro:
+    __slots__ = ('registro', 'nome', 'inicio')
+
+    def __init__(self, registro: 'RegistroMetricas', nome: str):
+        self.registro = registro
+        self.nome = nome
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registro.registrar(self.nome, time.perf_counter() - self.inicio)
+        return False
+
+
+class RegistroMetricas:
+    """Registro de durações (com percentis) e contadores, seguro entre threads"""
+
+    def __init__(self, ativo: bool = False, max_amostras: int = 4096):
+        """
+        Args:
+            ativo: Coleta ligada desde o início
+            max_amostras: Tamanho da janela usada nos percentis de cada métrica
+        """
+        self.ativo = ativo
+        self.max_amostras = max_amostras
+        self._duracoes: Dict[str, _Serie] = {}
+        self._contadores: Dict[str, float] = {}
+        self._trava = threading.Lock()
+
+    # ---------- Coleta ----------
+
+    def registrar(self, nome: str, segundos: float):
+        """Acrescenta uma duração (ignorado com a coleta desligada)"""
+        if not self.ativo:
+            return
+        with self._trava:
+            serie = self._duracoes.get(nome)
+            if serie is None:
+                serie = self._duracoes[nome] = _Serie(self.max_amostras)
+            serie.adicionar(segundos)
+
+    def contar(self, nome: str, valor: float = 1):
+        """Soma valor ao contador (ex.: tokens); ignorado com a coleta desligada"""
+        if not self.ativo or not valor:
+            return
+        with self._trava:
+            self._contadores[nome] = self._contadores.get(nome, 0) + valor
+
+    def medir(self, nome: str):
+        """Gerenciador de contexto que registra a duração do bloco"""
+        if not self.ativo:
+            return _NULO
+        return _Cronometro(self, nome)
+
+    def cronometrar(self, nome: str = None) -> Callable:
+        """
+        Decorador que registra a duração de cada chamada
+
+        Args:
+            nome: Nome da métrica (padrão: nome qualificado da função)
+        """
+        def decorador(funcao):
+            rotulo = nome or funcao.__qualname__
+
+            @functools.wraps(funcao)
+            def envolvida(*args, **kwargs):
+                if not self.ativo:
+                    return funcao(*args, **kwargs)
+                inicio = time.perf_counter()
+                try:
+                    return funcao(*args, **kwargs)
+                finally:
+                    self.registrar(rotulo, time.perf_counter() - inicio)
+            return envolvida
+        return decorador
+
+    def limpar(self):
+        with self._trava:
+            self._duracoes.clear()
+            self._contadores.clear()
+
+    # ---------- Consulta ----------
+
+    def resumo(self) -> Dict:
+        """
+        Estado atual das métricas
+
+        Returns:
+            {'duracoes': {nome: {n, total_s, media_s, p50_s, p90_s, p99_s, max_s}},
+             'contadores': {nome: valor}}
+        """
+        with self._trava:
+            series = {nome: (s.n, s.total, s.maximo, s.janela().copy()) for nome, s in self._duracoes.items()}
+            contadores = dict(self._contadores)
+
+        duracoes = {}
+        for nome, (n, total, maximo, janela) in sorted(series.items()):
+            percentis = np.quantile(janela, QUANTIS)
+            duracoes[nome] = {
+                'n': n,
+                'total_s': total,
+                'media_s': total / n,
+                **{f'p{round(q * 100)}_s': float(p) for q, p in zip(QUANTIS, percentis)},
+                'max_s': maximo,
+            }
+        return {'duracoes': duracoes, 'contadores': dict(sorted(contadores.items()))}
+
+    def exportar_texto(self) -> str:
+        """Métricas em texto no formato de exposição do Prometheus"""
+        resumo = self.resumo()
+        linhas = [
+            '# HELP fundeb_duracao_segundos Duração das operações instrumentadas',
+            '# TYPE fundeb_duracao_segundos summary',
+        ]
+        for nome, m in resumo['duracoes'].items():
+            for q in QUANTIS:
+                linhas.append(
+                    f'fundeb_duracao_segundos{{nome="{nome}",quantile="{q}"}} {m[f"p{round(q * 100)}_s"]:.6g}'
+                )
+            linhas.append(f'fundeb_duracao_segundos_sum{{nome="{nome}"}} {m["total_s"]:.6g}')
+            linhas.append(f'fundeb_duracao_segundos_count{{nome="{nome}"}} {m["n"]}')
+        linhas += [
+            '# HELP fundeb_contador_total Contadores acumulados (ex.: tokens do chat)',
+            '# TYPE fundeb_contador_total counter',
+        ]
+        for nome, valor in resumo['contadores'].items():
+            linhas.append(f'fundeb_contador_total{{nome="{nome}"}} {valor:g}')
+        return '\n'.join(linhas) + '\n'
+
+
+# Registro do processo
+METRICAS = RegistroMetricas(ativo=os.environ.get('FUNDEB_METRICAS', '') not in ('', '0'))
+
+registrar = METRICAS.registrar
+contar = METRICAS.contar
+medir = METRICAS.medir
+cronometrar = METRICAS.cronometrar
@@ -0,0 +1,133 @@
+"""
+Registro versionado de ponderadores do FUNDEB
+
+Cada conjunto de ponderadores (ex.: Portaria MEC nº 567/2024 para 2025, ou um
+rascunho em discussão) é lido uma única vez por processo e guardado com seus
+vetores densos na ordem de ETAPAS, prontos para produto escalar. Comparar
+versões não exige reabrir JSON nem reconstruir dicionários.
+"""
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from base_municipios import ETAPAS
+
+
+TIPOS_COMPLEMENTACAO = ('vaat', 'vaaf')
+
+CAMINHO_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dados', 'ponderadores.json')
+
+
+def impressao_digital(dados) -> str:
+    """Hash SHA-256 estável de uma estrutura serializável em JSON"""
+    serializado = json.dumps(dados, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+
+
+class ConjuntoPonderadores:
+    """Uma versão de ponderadores com coeficientes pré-calculados"""
+
+    def __init__(self, portaria: str, ano: int, dados: Dict):
+        """
+        Args:
+            portaria: Identificação da Portaria (ex.: '567/2024' ou 'rascunho')
+            ano: Ano de vigência
+            dados: Estrutura no formato de ponderadores.json
+        """
+        self.portaria = portaria
+        self.ano = ano
+        self.dados = dados
+        self.versao = impressao_digital(dados)[:16]
+
+        # Vetores densos na ordem de ETAPAS (0 para etapa sem ponderador)
+        self.vetores = {}
+        for tipo in TIPOS_COMPLEMENTACAO:
+            vetor = np.array([dados[tipo].get(etapa, 0.0) for etapa in ETAPAS], dtype=np.float64)
+            vetor.flags.writeable = False
+            self.vetores[tipo] = vetor
+
+    @property
+    def chave(self) -> Tuple[str, int]:
+        return (self.portaria, self.ano)
+
+    def complementacao_total(self, tipo_complementacao: str) -> float:
+        """Complementação total do tipo no ano de vigência (ou em 2025)"""
+        totais = self.dados['complementacao_total']
+        return totais.get(f'{tipo_complementacao}_{self.ano}', totais[f'{tipo_complementacao}_2025'])
+
+    def __repr__(self) -> str:
+        return f"ConjuntoPonderadores(portaria={self.portaria!r}, ano={self.ano}, versao={self.versao})"
+
+
+class RegistroPonderadores:
+    """Conjuntos de ponderadores indexados por (portaria, ano), na ordem de registro"""
+
+    def __init__(self):
+        # Ordem de inserção = ordem de registro (substituir move para o fim)
+        self._conjuntos: Dict[Tuple[str, int], ConjuntoPonderadores] = {}
+        self.padrao: Tuple[str, int] = None
+
+    def registrar(self, portaria: str, ano: int, dados: Dict, padrao: bool = False) -> ConjuntoPonderadores:
+        """
+        Registra (ou substitui) um conjunto de ponderadores
+
+        Args:
+            portaria: Identificação da Portaria ou do rascunho
+            ano: Ano de vigência
+            dados: Estrutura no formato de ponderadores.json
+            padrao: Torna este conjunto o usado quando nenhuma versão é pedida
+
+        Returns:
+            Conjunto registrado
+        """
+        conjunto = ConjuntoPonderadores(portaria, ano, dados)
+        self._conjuntos.pop(conjunto.chave, None)
+        self._conjuntos[conjunto.chave] = conjunto
+        if padrao or self.padrao is None:
+            self.padrao = conjunto.chave
+        return conjunto
+
+    def carregar_arquivo(self, caminho: str, padrao: bool = False) -> ConjuntoPonderadores:
+        """Registra um arquivo no formato de ponderadores.json (campos portaria e ano)"""
+        with open(caminho, 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+        return self.registrar(dados['portaria'], dados['ano'], dados, padrao=padrao)
+
+    def obter(self, portaria: str = None, ano: int = None) -> ConjuntoPonderadores:
+        """
+        Retorna um conjunto registrado
+
+        Sem argumentos, retorna o padrão. Só com ano, retorna a Portaria
+        registrada por último para aquele ano (identificações como '9/2025' e
+        '10/2025' não têm ordem confiável como texto). Só com portaria,
+        retorna o ano mais recente.
+        """
+        if portaria is None and ano is None:
+            return self._conjuntos[self.padrao]
+        if portaria is None:
+            candidatos = [chave for chave in self._conjuntos if chave[1] == ano]
+            if not candidatos:
+                raise KeyError(f"Nenhum conjunto de ponderadores registrado para {ano}")
+            return self._conjuntos[candidatos[-1]]
+        if ano is None:
+            candidatos = sorted(chave for chave in self._conjuntos if chave[0] == portaria)
+            if not candidatos:
+                raise KeyError(f"Portaria {portaria} não registrada")
+            return self._conjuntos[candidatos[-1]]
+        return self._conjuntos[(portaria, ano)]
+
+    def versoes(self) -> List[Tuple[str, int]]:
+        """Chaves (portaria, ano) registradas"""
+        return sorted(self._conjuntos)
+
+
+@lru_cache(maxsize=None)
+def obter_registro() -> RegistroPonderadores:
+    """Registro do processo, com dados/ponderadores.json carregado uma única vez"""
+    registro = RegistroPonderadores()
+    registro.carregar_arquivo(CAMINHO_PADRAO, padrao=True)
+    return registro
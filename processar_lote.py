@@ -0,0 +1,309 @@
+"""
+Processamento em lote por linha de comando, com memória constante
+
+Lê municípios em NDJSON ou CSV (arquivo ou stdin), calcula VAAT/VAAF em
+blocos de tamanho fixo com calcular_lote e grava cada bloco assim que fica
+pronto (NDJSON ou CSV). Só um número limitado de blocos fica em memória,
+então arquivos nacionais de vários anos e cenários passam sem virar lista.
+
+O contexto nacional (limiares e totais) vem da base indicada em --base;
+os registros de entrada são calculados contra ele, como na calculadora.
+
+Uso:
+    python processar_lote.py cenarios.ndjson -o resultados.ndjson
+    cat municipios.csv | python processar_lote.py --formato-entrada csv --processos 4
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from base_municipios import ETAPAS, BaseMunicipios, carregar_municipios, validar_municipio
+from calculadora import TIPOS_COMPLEMENTACAO, CalculadoraFUNDEB, registros_lote
+from ponderadores import ConjuntoPonderadores
+
+# Colunas da saída CSV (registros_lote achatado)
+COLUNAS_SAIDA = (
+    ['codigo_ibge', 'municipio', 'uf']
+    + [f'{tipo}_{campo}' for tipo in TIPOS_COMPLEMENTACAO for campo in ('valor_total', 'elegivel', 'valor_aluno_ano')]
+    + ['total_complementacoes', 'matriculas_totais']
+)
+
+
+class RegistroInvalido(ValueError):
+    """Registro de entrada sem os campos necessários ao cálculo"""
+
+
+# ---------- Entrada ----------
+
+def ler_ndjson(entrada) -> Iterator[Dict]:
+    """Um objeto por linha; linhas em branco são ignoradas"""
+    for numero, linha in enumerate(entrada, 1):
+        if not linha.strip():
+            continue
+        try:
+            yield json.loads(linha)
+        except json.JSONDecodeError as erro:
+            yield RegistroInvalido(f"linha {numero}: JSON inválido ({erro.msg})")
+
+
+def ler_csv(entrada) -> Iterator[Dict]:
+    """
+    Uma linha por município
+
+    Colunas: nome, uf, nse, drec, uma coluna por etapa (ETAPAS) e,
+    opcionalmente, codigo_ibge, populacao, elegivel_vaat/vaaf e receita_vaat/vaaf.
+    Etapas ausentes contam como zero matrículas.
+    """
+    for linha in csv.DictReader(entrada):
+        registro = {
+            campo: valor for campo, valor in linha.items()
+            if campo not in ETAPAS and valor not in (None, '')
+        }
+        try:
+            registro['matriculas'] = {etapa: int(float(linha.get(etapa) or 0)) for etapa in ETAPAS}
+            for campo in ('nse', 'drec', 'receita_vaat', 'receita_vaaf'):
+                if campo in registro:
+                    registro[campo] = float(registro[campo])
+            if 'populacao' in registro:
+                registro['populacao'] = int(float(registro['populacao']))
+            for campo in ('elegivel_vaat', 'elegivel_vaaf'):
+                if campo in registro:
+                    registro[campo] = registro[campo].strip().lower() in ('1', 'true', 'sim', 's')
+        except ValueError as erro:
+            yield RegistroInvalido(f"linha {linha.get('codigo_ibge') or linha.get('nome')}: {erro}")
+            continue
+        yield registro
+
+
+def validar_registro(registro) -> Dict:
+    """validar_municipio com o erro como RegistroInvalido"""
+    if isinstance(registro, RegistroInvalido):
+        raise registro
+    try:
+        return validar_municipio(registro)
+    except ValueError as erro:
+        raise RegistroInvalido(str(erro))
+
+
+def _validados(registros: Iterable) -> Iterator:
+    """Cada registro validado, ou o RegistroInvalido no lugar dele"""
+    for registro in registros:
+        try:
+            yield validar_registro(registro)
+        except RegistroInvalido as erro:
+            yield erro
+
+
+def em_blocos(registros: Iterable, tamanho_bloco: int) -> Iterator[List]:
+    """Agrupa um iterável em listas de até tamanho_bloco itens"""
+    bloco = []
+    for registro in registros:
+        bloco.append(registro)
+        if len(bloco) == tamanho_bloco:
+            yield bloco
+            bloco = []
+    if bloco:
+        yield bloco
+
+
+# ---------- Cálculo ----------
+
+def calcular_bloco(calculadora: CalculadoraFUNDEB, bloco: List, contexto_nacional: Dict = None) -> List[Tuple]:
+    """
+    Calcula um bloco de registros em uma passada vetorizada
+
+    Args:
+        bloco: Registros já validados (validar_registro) ou RegistroInvalido
+
+    Returns:
+        Lista na ordem de entrada com ('ok', resultado) ou ('erro', mensagem)
+    """
+    validos, saida = [], []
+    for registro in bloco:
+        if isinstance(registro, RegistroInvalido):
+            saida.append(('erro', str(registro)))
+        else:
+            validos.append(registro)
+            saida.append(None)
+
+    if validos:
+        try:
+            lote = calculadora.calcular_lote(BaseMunicipios.de_registros(validos), contexto_nacional)
+            resultados = (('ok', resultado) for resultado in registros_lote(lote))
+        except (KeyError, TypeError, ValueError):
+            # Algum registro com tipo inesperado: recalcula um a um para isolá-lo
+            resultados = (
+                _calcular_um(calculadora, registro, contexto_nacional) for registro in validos
+            )
+        saida = [item or next(resultados) for item in saida]
+    return saida
+
+
+def _calcular_um(calculadora: CalculadoraFUNDEB, registro: Dict, contexto_nacional: Dict) -> Tuple:
+    try:
+        lote = calculadora.calcular_lote(BaseMunicipios.de_registros([registro]), contexto_nacional)
+        return ('ok', next(registros_lote(lote)))
+    except (KeyError, TypeError, ValueError) as erro:
+        return ('erro', f"{registro.get('nome')}: {erro!r}")
+
+
+# Estado de cada processo do pool (montado uma vez pelo inicializador)
+_calculadora_processo = None
+
+
+def _iniciar_processo(ponderadores: Tuple, contexto_nacional: Dict):
+    """Monta a calculadora do processo com os mesmos ponderadores e contexto do pai"""
+    global _calculadora_processo
+    _calculadora_processo = CalculadoraFUNDEB(ConjuntoPonderadores(*ponderadores))
+    _calculadora_processo.contexto_nacional = contexto_nacional
+
+
+def _calcular_bloco_processo(bloco: List) -> List[Tuple]:
+    return calcular_bloco(_calculadora_processo, bloco)
+
+
+def processar(
+    registros: Iterable,
+    calculadora: CalculadoraFUNDEB,
+    tamanho_bloco: int = 5000,
+    processos: int = 1
+) -> Iterator[Tuple]:
+    """
+    Resultados na ordem de entrada, calculados bloco a bloco
+
+    Os registros são validados aqui, antes de qualquer cálculo: os
+    inválidos seguem só como RegistroInvalido. Com processos > 1, distribui
+    blocos a um pool mantendo no máximo 2 × processos blocos em voo, para a
+    memória não crescer com a entrada; cada processo usa os ponderadores e
+    o contexto nacional da calculadora recebida.
+
+    Args:
+        registros: Iterável de dicionários (ou RegistroInvalido vindos do leitor)
+        calculadora: Calculadora com o contexto nacional carregado
+        tamanho_bloco: Registros por passada vetorizada
+        processos: Processos de cálculo (1 = no próprio processo)
+
+    Yields:
+        ('ok', resultado) ou ('erro', mensagem) por registro
+    """
+    blocos = em_blocos(_validados(registros), tamanho_bloco)
+    if processos <= 1:
+        for bloco in blocos:
+            yield from calcular_bloco(calculadora, bloco)
+        return
+
+    conjunto = calculadora.conjunto_ponderadores
+    ponderadores = (conjunto.portaria, conjunto.ano, conjunto.dados)
+    with ProcessPoolExecutor(
+        processos, initializer=_iniciar_processo, initargs=(ponderadores, calculadora.contexto_nacional)
+    ) as pool:
+        em_voo = deque()
+        for bloco in blocos:
+            em_voo.append(pool.submit(_calcular_bloco_processo, bloco))
+            if len(em_voo) >= 2 * processos:
+                yield from em_voo.popleft().result()
+        while em_voo:
+            yield from em_voo.popleft().result()
+
+
+# ---------- Saída ----------
+
+def achatar(resultado: Dict) -> Dict:
+    """Resultado de registros_lote em uma linha plana (COLUNAS_SAIDA)"""
+    linha = {campo: resultado[campo] for campo in ('codigo_ibge', 'municipio', 'uf')}
+    for tipo in TIPOS_COMPLEMENTACAO:
+        for campo, valor in resultado[tipo].items():
+            linha[f'{tipo}_{campo}'] = valor
+    linha['total_complementacoes'] = resultado['total_complementacoes']
+    linha['matriculas_totais'] = resultado['matriculas_totais']
+    return linha
+
+
+def gravar(resultados: Iterable[Tuple], saida, formato: str = 'ndjson', erros=None) -> Dict[str, int]:
+    """
+    Grava os resultados à medida que chegam
+
+    Em NDJSON, registros inválidos viram uma linha {'indice', 'erro'}; em CSV
+    vão para o fluxo erros (padrão: stderr).
+
+    Returns:
+        Contagem {'processados', 'erros'}
+    """
+    erros = erros or sys.stderr
+    escritor = None
+    if formato == 'csv':
+        escritor = csv.DictWriter(saida, fieldnames=COLUNAS_SAIDA, lineterminator='\n')
+        escritor.writeheader()
+
+    contagem = {'processados': 0, 'erros': 0}
+    for indice, (status, dados) in enumerate(resultados):
+        if status == 'erro':
+            contagem['erros'] += 1
+            if escritor is None:
+                saida.write(json.dumps({'indice': indice, 'erro': dados}, ensure_ascii=False) + '\n')
+            else:
+                erros.write(f"Registro {indice}: {dados}\n")
+            continue
+        contagem['processados'] += 1
+        if escritor is None:
+            saida.write(json.dumps(dados, ensure_ascii=False) + '\n')
+        else:
+            escritor.writerow(achatar(dados))
+    return contagem
+
+
+def _abrir(caminho: str, modo: str, padrao):
+    if caminho in (None, '-'):
+        return padrao
+    return open(caminho, modo, encoding='utf-8', newline='' if modo == 'r' else None)
+
+
+def _formato(caminho: str, informado: str) -> str:
+    if informado:
+        return informado
+    if caminho and caminho.lower().endswith('.csv'):
+        return 'csv'
+    return 'ndjson'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cálculo FUNDEB em lote (NDJSON/CSV, memória constante)")
+    parser.add_argument('entrada', nargs='?', default='-', help="Arquivo de entrada (padrão: stdin)")
+    parser.add_argument('-o', '--saida', default='-', help="Arquivo de saída (padrão: stdout)")
+    parser.add_argument('--formato-entrada', choices=('ndjson', 'csv'))
+    parser.add_argument('--formato-saida', choices=('ndjson', 'csv'))
+    parser.add_argument('--base', default='dados/municipios.json',
+                        help="Base nacional para limiares e totais (JSON ou colunar)")
+    parser.add_argument('--tamanho-bloco', type=int, default=5000)
+    parser.add_argument('--processos', type=int, default=1,
+                        help="Processos de cálculo (0 = todos os núcleos)")
+    args = parser.parse_args(argv)
+
+    calculadora = CalculadoraFUNDEB()
+    calculadora.carregar_base_nacional(carregar_municipios(args.base))
+    processos = args.processos or os.cpu_count() or 1
+
+    formato_entrada = _formato(args.entrada, args.formato_entrada)
+    formato_saida = _formato(args.saida, args.formato_saida)
+    entrada = _abrir(args.entrada, 'r', sys.stdin)
+    saida = _abrir(args.saida, 'w', sys.stdout)
+    try:
+        leitor = ler_csv(entrada) if formato_entrada == 'csv' else ler_ndjson(entrada)
+        contagem = gravar(processar(leitor, calculadora, args.tamanho_bloco, processos), saida, formato_saida)
+    finally:
+        if entrada is not sys.stdin:
+            entrada.close()
+        if saida is not sys.stdout:
+            saida.close()
+
+    print(f"{contagem['processados']} municípios calculados, {contagem['erros']} com erro", file=sys.stderr)
+    return 1 if contagem['erros'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+"""
+Projeção plurianual (2025–2035) das complementações VAAT e VAAF
+
+Cada ano é tratado como um cenário nacional: matrículas crescem por etapa,
+a complementação total e a tabela de ponderadores podem mudar ano a ano, e a
+redistribuição é resolvida para todos os anos em uma única chamada vetorizada
+de CalculadoraFUNDEB.calcular_cenarios. O resultado é um cubo NumPy
+município × ano × tipo que a interface fatia sob demanda.
+"""
+from typing import Dict, Sequence
+
+import numpy as np
+
+from base_municipios import ETAPAS, BaseMunicipios
+from calculadora import TIPOS_COMPLEMENTACAO, CalculadoraFUNDEB
+from ponderadores import ConjuntoPonderadores
+
+
+ANOS_PADRAO = tuple(range(2025, 2036))
+
+
+class ProjecaoPlurianual:
+    """
+    Cubo de projeção município × ano × tipo (ordem de TIPOS_COMPLEMENTACAO)
+
+    O primeiro ano é o ano-base dos dados; nos seguintes, as matrículas de cada
+    etapa crescem à taxa anual informada.
+    """
+
+    def __init__(
+        self,
+        calculadora: CalculadoraFUNDEB,
+        municipios,
+        anos: Sequence[int] = ANOS_PADRAO,
+        crescimento_matriculas=0.0,
+        complementacao_total: Dict[int, Dict[str, float]] = None,
+        crescimento_complementacao: float = 0.0,
+        ponderadores_por_ano: Dict[int, Dict[str, Dict[str, float]]] = None,
+        crescimento_receita: float = 0.0
+    ):
+        """
+        Args:
+            calculadora: Calculadora com os ponderadores do ano-base
+            municipios: Lista de dicionários ou BaseMunicipios
+            anos: Anos projetados, em ordem crescente
+            crescimento_matriculas: Taxa anual única, dicionário {etapa: taxa}
+                ou array anos × etapas com a taxa de cada ano
+            complementacao_total: {ano: {'vaat': valor, 'vaaf': valor}}; anos
+                ausentes repetem o anterior corrigido por crescimento_complementacao
+            crescimento_complementacao: Taxa anual da complementação total
+            ponderadores_por_ano: {ano: ConjuntoPonderadores ou
+                {'vaat': {etapa: peso}, 'vaaf': {...}}}; cada ano usa a tabela
+                mais recente até ele
+            crescimento_receita: Taxa anual da receita própria dos municípios
+        """
+        self.calculadora = calculadora
+        self.base = BaseMunicipios.como_base(municipios)
+        self.anos = tuple(anos)
+        self.tipos = TIPOS_COMPLEMENTACAO
+        self._posicao_ano = {ano: i for i, ano in enumerate(self.anos)}
+
+        fator_matriculas = self._fator_matriculas(crescimento_matriculas)
+        pesos = self._pesos_por_ano(ponderadores_por_ano or {})
+        orcamentos = self._orcamentos_por_ano(complementacao_total or {}, crescimento_complementacao)
+        fator_receita = (1.0 + crescimento_receita) ** np.arange(len(self.anos))
+
+        cenarios = calculadora.calcular_cenarios(
+            self.base,
+            fator_matriculas=fator_matriculas,
+            pesos=pesos,
+            orcamentos=orcamentos,
+            fator_receita=fator_receita
+        )
+
+        # Município na primeira dimensão: a série de um município é contígua
+        self.cubo = np.ascontiguousarray(
+            np.stack([cenarios[tipo]['valor_total'] for tipo in self.tipos], axis=-1).transpose(1, 0, 2)
+        )
+        self.limiares = {tipo: cenarios[tipo]['limiar'] for tipo in self.tipos}
+        self.matriculas_totais = fator_matriculas @ np.asarray(self.base.matriculas, dtype=np.float64).T
+
+    def _fator_matriculas(self, crescimento) -> np.ndarray:
+        """Multiplicador acumulado das matrículas (anos × etapas)"""
+        if isinstance(crescimento, dict):
+            taxas = np.array([crescimento.get(etapa, 0.0) for etapa in ETAPAS], dtype=np.float64)
+        else:
+            taxas = np.asarray(crescimento, dtype=np.float64)
+        taxas = np.broadcast_to(taxas, (len(self.anos), len(ETAPAS))).copy()
+
+        # O ano-base não cresce
+        taxas[0] = 0.0
+        return np.cumprod(1.0 + taxas, axis=0)
+
+    def _pesos_por_ano(self, ponderadores_por_ano: Dict) -> Dict[str, np.ndarray]:
+        """Vetores de ponderadores por ano (anos × etapas), por tipo"""
+        pesos = {}
+        for tipo in self.tipos:
+            atual = self.calculadora.vetores_ponderadores[tipo]
+            linhas = []
+            for ano in self.anos:
+                tabela = ponderadores_por_ano.get(ano)
+                if isinstance(tabela, ConjuntoPonderadores):
+                    atual = tabela.vetores[tipo]
+                elif tabela is not None and tipo in tabela:
+                    atual = np.array([tabela[tipo].get(etapa, 0.0) for etapa in ETAPAS], dtype=np.float64)
+                linhas.append(atual)
+            pesos[tipo] = np.vstack(linhas)
+        return pesos
+
+    def _orcamentos_por_ano(self, complementacao_total: Dict, crescimento: float) -> Dict[str, np.ndarray]:
+        """Complementação total por ano, por tipo"""
+        totais_base = self.calculadora.ponderadores['complementacao_total']
+        orcamentos = {}
+        for tipo in self.tipos:
+            atual = totais_base[f'{tipo}_2025']
+            valores = []
+            for i, ano in enumerate(self.anos):
+                informado = complementacao_total.get(ano, {}).get(tipo, totais_base.get(f'{tipo}_{ano}'))
+                if informado is not None:
+                    atual = informado
+                elif i > 0:
+                    atual = atual * (1.0 + crescimento)
+                valores.append(atual)
+            orcamentos[tipo] = np.array(valores, dtype=np.float64)
+        return orcamentos
+
+    # ---------- Fatias ----------
+
+    def municipio(self, codigo_ibge) -> Dict[str, np.ndarray]:
+        """Série de um município em todos os anos (views do cubo, sem cópia)"""
+        serie = self.cubo[self.base.indice(codigo_ibge)]
+        resultado = {'anos': np.array(self.anos)}
+        for j, tipo in enumerate(self.tipos):
+            resultado[tipo] = serie[:, j]
+        resultado['total'] = serie.sum(axis=1)
+        return resultado
+
+    def ano(self, ano: int) -> Dict[str, np.ndarray]:
+        """Valores de todos os municípios em um ano"""
+        fatia = self.cubo[:, self._posicao_ano[ano]]
+        return {tipo: fatia[:, j] for j, tipo in enumerate(self.tipos)}
+
+    def tipo(self, tipo_complementacao: str) -> np.ndarray:
+        """Matriz município × ano de um tipo"""
+        return self.cubo[:, :, self.tipos.index(tipo_complementacao)]
@@ -0,0 +1,191 @@
+"""
+Resultados compactos da calculadora
+
+calcular_ambas_complementacoes devolvia dicionários aninhados, com um
+sub-dicionário por etapa para cada tipo. Estes tipos guardam só os escalares
+e dois vetores NumPy na ordem de ETAPAS (matrículas brutas, compartilhado
+entre VAAT e VAAF, e matrículas ajustadas); o detalhamento por etapa é
+montado sob demanda. Continuam se comportando como dicionários
+(resultado['vaat']['valor_total'], .get, .update, iteração), então app.py,
+chat_agent.py e o serviço HTTP não precisam mudar.
+"""
+from collections.abc import Mapping, MutableMapping
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from base_municipios import ETAPAS
+
+COLUNAS_DETALHAMENTO = ('matriculas_brutas', 'matriculas_ajustadas', 'valor_complementacao', 'ponderador_efetivo')
+
+
+def _numero(valor: float):
+    """Inteiro quando o valor é inteiro (matrículas vêm como int nos dados)"""
+    return int(valor) if valor.is_integer() else valor
+
+
+class ResultadoComplementacao(Mapping):
+    """
+    Resultado de VAAT ou VAAF para um município
+
+    Chaves: valor_total, elegivel, valor_aluno_ano, limiar e detalhamento
+    (calculado a cada acesso a partir dos vetores, sem ficar guardado).
+    """
+
+    __slots__ = ('valor_total', 'elegivel', 'valor_aluno_ano', 'limiar', '_brutas', '_ajustadas', '_mascara')
+
+    CAMPOS = ('valor_total', 'elegivel', 'valor_aluno_ano', 'limiar', 'detalhamento')
+
+    def __init__(
+        self,
+        valor_total: float,
+        elegivel: bool,
+        valor_aluno_ano: float,
+        limiar: float = None,
+        brutas: np.ndarray = None,
+        ajustadas: np.ndarray = None,
+        mascara: int = 0
+    ):
+        """
+        Args:
+            valor_total: Complementação do município
+            elegivel: Se o município recebe a complementação
+            valor_aluno_ano: Valor por matrícula ajustada antes da complementação
+            limiar: Limiar nacional de elegibilidade (None sem base nacional)
+            brutas: Matrículas na ordem de ETAPAS
+            ajustadas: Matrículas ajustadas na ordem de ETAPAS (None se não elegível)
+            mascara: Bits das etapas que entram no detalhamento (bit i = ETAPAS[i])
+        """
+        self.valor_total = valor_total
+        self.elegivel = elegivel
+        self.valor_aluno_ano = valor_aluno_ano
+        self.limiar = limiar
+        self._brutas = brutas
+        self._ajustadas = ajustadas
+        self._mascara = mascara
+
+    def __getitem__(self, chave: str):
+        if chave == 'detalhamento':
+            return self.detalhamento
+        if chave in self.CAMPOS:
+            return getattr(self, chave)
+        raise KeyError(chave)
+
+    def __iter__(self):
+        return iter(self.CAMPOS)
+
+    def __len__(self) -> int:
+        return len(self.CAMPOS)
+
+    def __repr__(self) -> str:
+        return (f"ResultadoComplementacao(valor_total={self.valor_total!r}, elegivel={self.elegivel!r}, "
+                f"valor_aluno_ano={self.valor_aluno_ano!r}, limiar={self.limiar!r})")
+
+    def _linhas(self):
+        """(etapa, brutas, ajustadas, valor, ponderador efetivo) das etapas detalhadas"""
+        if self._ajustadas is None:
+            return
+        posicoes = [i for i in range(len(ETAPAS)) if self._mascara >> i & 1]
+        brutas = self._brutas.tolist()
+        ajustadas = self._ajustadas.tolist()
+        total_ajustado = sum(ajustadas[i] for i in posicoes)
+        for i in posicoes:
+            yield (
+                ETAPAS[i],
+                _numero(brutas[i]),
+                ajustadas[i],
+                self.valor_total * (ajustadas[i] / total_ajustado),
+                ajustadas[i] / brutas[i] if brutas[i] > 0 else 0,
+            )
+
+    @property
+    def detalhamento(self) -> Dict[str, Dict[str, float]]:
+        """{etapa: {matriculas_brutas, matriculas_ajustadas, valor_complementacao, ponderador_efetivo}}"""
+        return {linha[0]: dict(zip(COLUNAS_DETALHAMENTO, linha[1:])) for linha in self._linhas()}
+
+    def para_dataframe(self) -> pd.DataFrame:
+        """Detalhamento por etapa em um DataFrame (índice 'Etapa')"""
+        linhas = list(self._linhas())
+        return pd.DataFrame([linha[1:] for linha in linhas], columns=COLUNAS_DETALHAMENTO,
+                            index=pd.Index([linha[0] for linha in linhas], name='Etapa'))
+
+    def para_dict(self) -> Dict:
+        """Cópia em dicionários simples (ex.: para JSON)"""
+        return dict(self.items())
+
+
+class ResultadoMunicipio(MutableMapping):
+    """
+    Resultado de calcular_ambas_complementacoes
+
+    Chaves fixas: municipio, uf, vaat, vaaf, total_complementacoes e
+    matriculas_totais. Chaves extras (ex.: codigo_ibge acrescentado pelo
+    serviço) ficam em um dicionário criado só quando necessário.
+    """
+
+    __slots__ = ('municipio', 'uf', 'vaat', 'vaaf', 'total_complementacoes', 'matriculas_totais', '_extras')
+
+    CAMPOS = ('municipio', 'uf', 'vaat', 'vaaf', 'total_complementacoes', 'matriculas_totais')
+
+    def __init__(
+        self,
+        municipio: str,
+        uf: str,
+        vaat: ResultadoComplementacao,
+        vaaf: ResultadoComplementacao,
+        total_complementacoes: float,
+        matriculas_totais
+    ):
+        self.municipio = municipio
+        self.uf = uf
+        self.vaat = vaat
+        self.vaaf = vaaf
+        self.total_complementacoes = total_complementacoes
+        self.matriculas_totais = matriculas_totais
+        self._extras = None
+
+    def __getitem__(self, chave: str):
+        if chave in self.CAMPOS:
+            return getattr(self, chave)
+        if self._extras is None:
+            raise KeyError(chave)
+        return self._extras[chave]
+
+    def __setitem__(self, chave: str, valor):
+        if chave in self.CAMPOS:
+            setattr(self, chave, valor)
+        else:
+            if self._extras is None:
+                self._extras = {}
+            self._extras[chave] = valor
+
+    def __delitem__(self, chave: str):
+        if chave in self.CAMPOS or self._extras is None:
+            raise KeyError(chave)
+        del self._extras[chave]
+
+    def __iter__(self):
+        yield from self.CAMPOS
+        if self._extras:
+            yield from self._extras
+
+    def __len__(self) -> int:
+        return len(self.CAMPOS) + len(self._extras or ())
+
+    def __repr__(self) -> str:
+        return (f"ResultadoMunicipio(municipio={self.municipio!r}, uf={self.uf!r}, "
+                f"total_complementacoes={self.total_complementacoes!r})")
+
+    def para_dataframe(self) -> pd.DataFrame:
+        """Detalhamento por etapa de VAAT e VAAF em um DataFrame (coluna 'tipo')"""
+        return pd.concat(
+            [self[tipo].para_dataframe().assign(tipo=tipo) for tipo in ('vaat', 'vaaf')]
+        )
+
+    def para_dict(self) -> Dict:
+        """Cópia em dicionários simples, com o detalhamento por etapa (ex.: para JSON)"""
+        return {
+            chave: valor.para_dict() if isinstance(valor, ResultadoComplementacao) else valor
+            for chave, valor in self.items()
+        }
@@ -0,0 +1,465 @@
+"""
+Serviço HTTP (sem interface) para cálculos em massa
+
+Aplicação WSGI que envolve a CalculadoraFUNDEB para outros sistemas:
+
+    GET  /saude             Estado do serviço e versão dos dados
+    POST /calcular          Um município (código IBGE ou dados completos) → JSON
+    POST /calcular/lote     Array JSON (ou NDJSON) de municípios → NDJSON em fluxo
+    GET  /estatisticas      Vazão e latência agregadas de todos os workers
+
+Base de municípios e ponderadores são carregados uma vez, antes de criar os
+workers (processos filhos compartilham as páginas por cópia sob escrita e o
+mmap da base colunar). As estatísticas ficam em memória compartilhada, então
+qualquer worker responde pelo conjunto.
+
+Uso:
+    python servico.py --porta 8000 --processos 4
+"""
+import argparse
+import json
+import mmap
+import os
+import signal
+import socketserver
+import threading
+import time
+from collections.abc import Mapping
+from typing import Dict, Iterable, Iterator
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import numpy as np
+
+from base_municipios import CAMPOS_OBRIGATORIOS, BaseMunicipios, carregar_municipios, validar_municipio
+from calculadora import CalculadoraFUNDEB, registros_lote
+
+
+ROTAS = ('/saude', '/calcular', '/calcular/lote', '/estatisticas', 'outras')
+
+# Faixas de latência em escala logarítmica: 0,1 ms a 100 s
+LIMITES_LATENCIA = np.logspace(-4, 2, 61)
+
+
+def _para_json(valor):
+    """
+    Converte tipos NumPy e resultados da calculadora para json.dumps
+
+    Floats não finitos (valor por aluno de município sem matrículas é
+    infinito) viram None: Infinity/NaN não existem em JSON estrito.
+    """
+    if isinstance(valor, float):
+        return valor if np.isfinite(valor) else None
+    if isinstance(valor, Mapping):
+        return {chave: _para_json(v) for chave, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_para_json(v) for v in valor]
+    if isinstance(valor, np.generic):
+        return _para_json(valor.item())
+    if isinstance(valor, np.ndarray):
+        return _para_json(valor.tolist())
+    return valor
+
+
+def _json(dados) -> bytes:
+    return json.dumps(_para_json(dados), ensure_ascii=False, allow_nan=False).encode('utf-8')
+
+
+class ErroRequisicao(Exception):
+    """Erro do cliente (responde 4xx)"""
+
+    def __init__(self, mensagem: str, status: str = '400 Bad Request'):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class EstatisticasCompartilhadas:
+    """
+    Contadores por worker × rota em memória anônima compartilhada
+
+    Criada antes do fork; cada worker escreve só na sua linha e qualquer um
+    lê todas para agregar. Por rota: requisições, erros, municípios
+    calculados e histograma de latência (LIMITES_LATENCIA).
+    """
+
+    def __init__(self, n_workers: int):
+        self.n_workers = n_workers
+        self._colunas = 3 + len(LIMITES_LATENCIA) + 1
+        forma = (n_workers, len(ROTAS), self._colunas)
+        self._memoria = mmap.mmap(-1, int(np.prod(forma)) * 8 + 8)
+        self.contadores = np.ndarray(forma, dtype=np.int64, buffer=self._memoria, offset=8)
+        self._inicio = np.ndarray((1,), dtype=np.float64, buffer=self._memoria)
+        self._inicio[0] = time.time()
+        self.worker = 0
+        self._trava = threading.Lock()
+
+    def registrar(self, rota: str, segundos: float, erro: bool = False, municipios: int = 0):
+        r = ROTAS.index(rota) if rota in ROTAS else len(ROTAS) - 1
+        faixa = int(np.searchsorted(LIMITES_LATENCIA, segundos))
+        with self._trava:
+            linha = self.contadores[self.worker, r]
+            linha[0] += 1
+            linha[1] += int(erro)
+            linha[2] += municipios
+            linha[3 + faixa] += 1
+
+    def resumo(self) -> Dict:
+        """Totais, vazão e percentis de latência por rota, somados entre workers"""
+        decorrido = max(time.time() - float(self._inicio[0]), 1e-9)
+        total = self.contadores.sum(axis=0)
+        rotas = {}
+        for r, rota in enumerate(ROTAS):
+            requisicoes = int(total[r, 0])
+            if requisicoes == 0:
+                continue
+            histograma = total[r, 3:]
+            acumulado = np.cumsum(histograma)
+            percentis = {}
+            for p in (50, 95, 99):
+                faixa = int(np.searchsorted(acumulado, np.ceil(requisicoes * p / 100)))
+                limite = LIMITES_LATENCIA[min(faixa, len(LIMITES_LATENCIA) - 1)]
+                percentis[f'p{p}_ms'] = round(float(limite) * 1000, 3)
+            rotas[rota] = {
+                'requisicoes': requisicoes,
+                'erros': int(total[r, 1]),
+                'municipios': int(total[r, 2]),
+                'requisicoes_por_segundo': round(requisicoes / decorrido, 3),
+                'municipios_por_segundo': round(int(total[r, 2]) / decorrido, 3),
+                # Limite superior da faixa do histograma que contém o percentil
+                **percentis,
+            }
+        return {
+            'desde': float(self._inicio[0]),
+            'segundos': round(decorrido, 3),
+            'workers': self.n_workers,
+            'requisicoes_por_worker': self.contadores[:, :, 0].sum(axis=1).tolist(),
+            'rotas': rotas,
+        }
+
+
+class ServicoFUNDEB:
+    """Aplicação WSGI"""
+
+    def __init__(
+        self,
+        calculadora: CalculadoraFUNDEB,
+        municipios,
+        estatisticas: EstatisticasCompartilhadas = None,
+        tamanho_bloco: int = 1000,
+        max_corpo: int = 64 * 1024 * 1024
+    ):
+        """
+        Args:
+            calculadora: Calculadora com a base nacional carregada
+            municipios: Base usada para resolver códigos IBGE
+            estatisticas: Contadores compartilhados (padrão: um worker)
+            tamanho_bloco: Municípios calculados por passada vetorizada no lote
+            max_corpo: Tamanho máximo do corpo da requisição em bytes
+        """
+        self.calculadora = calculadora
+        self.base = BaseMunicipios.como_base(municipios)
+        self.estatisticas = estatisticas or EstatisticasCompartilhadas(1)
+        self.tamanho_bloco = tamanho_bloco
+        self.max_corpo = max_corpo
+
+    def __call__(self, environ, start_response):
+        rota = environ.get('PATH_INFO', '/').rstrip('/') or '/'
+        metodo = environ['REQUEST_METHOD']
+        inicio = time.perf_counter()
+
+        try:
+            if rota == '/saude' and metodo == 'GET':
+                corpo = _json(self.saude())
+            elif rota == '/estatisticas' and metodo == 'GET':
+                corpo = _json(self.estatisticas.resumo())
+            elif rota == '/calcular' and metodo == 'POST':
+                corpo = _json(self.calcular(json.loads(self._ler_corpo(environ))))
+            elif rota == '/calcular/lote' and metodo == 'POST':
+                start_response('200 OK', [('Content-Type', 'application/x-ndjson; charset=utf-8')])
+                return self._medir_fluxo(rota, inicio, environ)
+            elif rota in ROTAS:
+                raise ErroRequisicao(f"Método {metodo} não permitido", '405 Method Not Allowed')
+            else:
+                raise ErroRequisicao(f"Rota inexistente: {rota}", '404 Not Found')
+        except (ErroRequisicao, ValueError, KeyError) as erro:
+            status = getattr(erro, 'status', '400 Bad Request')
+            if isinstance(erro, KeyError):
+                status, erro = '404 Not Found', f"Município não encontrado: {erro.args[0]}"
+            start_response(status, [('Content-Type', 'application/json; charset=utf-8')])
+            self.estatisticas.registrar(rota, time.perf_counter() - inicio, erro=True)
+            return [_json({'erro': str(erro)})]
+
+        start_response('200 OK', [
+            ('Content-Type', 'application/json; charset=utf-8'),
+            ('Content-Length', str(len(corpo))),
+        ])
+        self.estatisticas.registrar(rota, time.perf_counter() - inicio, municipios=int(rota == '/calcular'))
+        return [corpo]
+
+    # ---------- Rotas ----------
+
+    def saude(self) -> Dict:
+        return {
+            'status': 'ok',
+            'pid': os.getpid(),
+            'municipios': len(self.base),
+            'versao_ponderadores': self.calculadora.versao_ponderadores,
+            'base': self.base.impressao_digital()[:16],
+        }
+
+    def calcular(self, pedido: Dict) -> Dict:
+        """
+        Calcula um município
+
+        O pedido traz 'codigo_ibge' (dados da base, com campos opcionais que
+        os substituem) ou todos os campos de municipios.json. Para um município
+        da base com dados alterados, os totais nacionais são ajustados pela
+        variação (totais_com_delta).
+        """
+        municipio, totais = self._resolver(pedido)
+        resultado = self.calculadora.calcular_ambas_complementacoes(municipio, totais)
+        resultado['codigo_ibge'] = municipio.get('codigo_ibge')
+        return resultado
+
+    def _resolver(self, pedido) -> tuple:
+        """
+        Município a calcular e totais nacionais ajustados (None = os da base)
+
+        Usado por /calcular e por cada item de /calcular/lote, para que os
+        dois dêem o mesmo resultado para o mesmo pedido. Um código IBGE solto
+        equivale a {'codigo_ibge': código}.
+        """
+        if isinstance(pedido, (str, int)) and not isinstance(pedido, bool):
+            pedido = {'codigo_ibge': pedido}
+        if not isinstance(pedido, dict):
+            raise ErroRequisicao("Esperado um objeto JSON")
+
+        completo = all(campo in pedido for campo in CAMPOS_OBRIGATORIOS)
+        original = None
+        if pedido.get('codigo_ibge') is not None:
+            try:
+                original = self.base.por_codigo(pedido['codigo_ibge'])
+            except KeyError:
+                if not completo:
+                    raise
+
+        if completo:
+            municipio = self._validar(pedido)
+        elif original is not None:
+            if not isinstance(pedido.get('matriculas', {}), dict):
+                raise ErroRequisicao("'matriculas' deve ser um objeto {etapa: quantidade}")
+            municipio = dict(original, **{c: v for c, v in pedido.items() if c != 'matriculas'})
+            municipio['matriculas'] = dict(original['matriculas'], **pedido.get('matriculas', {}))
+            municipio = self._validar(municipio)
+        else:
+            raise ErroRequisicao(f"Informe codigo_ibge ou os campos {', '.join(CAMPOS_OBRIGATORIOS)}")
+
+        totais = self.calculadora.totais_com_delta(original, municipio) if original is not None else None
+        return municipio, totais
+
+    def _lote(self, environ, progresso: Dict) -> Iterator[bytes]:
+        """
+        Linhas NDJSON na ordem de entrada, calculadas em blocos vetorizados
+
+        Cada item passa pela mesma resolução de /calcular (_resolver): código
+        IBGE, {'codigo_ibge': ..., campos que substituem os da base} ou um
+        município completo. Itens que não mudam os totais nacionais (códigos,
+        municípios fora da base) vão juntos numa passada vetorizada; itens da
+        base com dados alterados deslocam os totais e são calculados um a um
+        com o contexto ajustado, como em /calcular. Itens inválidos geram uma
+        linha {'indice', 'erro'} sem interromper o lote.
+        """
+        contexto = self.calculadora.contexto_nacional
+        for deslocamento, bloco in self._blocos(self._itens(environ)):
+            validos, alterados, erros = [], {}, {}
+            for i, item in enumerate(bloco):
+                try:
+                    if not isinstance(item, dict) or item.keys() == {'codigo_ibge'}:
+                        # Só o código: fatia a base colunar sem montar dicionários
+                        codigo = item['codigo_ibge'] if isinstance(item, dict) else item
+                        validos.append((i, self.base.indice(codigo)))
+                        continue
+                    municipio, totais = self._resolver(item)
+                    if totais is not None and contexto is not None and totais != contexto['totais']:
+                        alterados[i] = (municipio, dict(contexto, totais=totais))
+                    else:
+                        validos.append((i, municipio))
+                except KeyError as erro:
+                    erros[i] = {'indice': deslocamento + i, 'erro': f"Município não encontrado: {erro.args[0]}"}
+                except (ErroRequisicao, TypeError) as erro:
+                    erros[i] = {'indice': deslocamento + i, 'erro': str(erro)}
+
+            linhas = iter(())
+            if validos:
+                try:
+                    linhas = self._linhas([v for _, v in validos])
+                except (TypeError, ValueError, OverflowError):
+                    # Algum item com valor fora do esperado: calcula um a um para isolá-lo
+                    linhas = (self._linha_isolada(v, deslocamento + i) for i, v in validos)
+            progresso['municipios'] += len(validos) + len(alterados)
+
+            for i in range(len(bloco)):
+                if i in erros:
+                    yield _json(erros[i]) + b'\n'
+                elif i in alterados:
+                    municipio, contexto_ajustado = alterados[i]
+                    yield self._linha_isolada(municipio, deslocamento + i, contexto_ajustado)
+                else:
+                    yield next(linhas)
+
+    def _linhas(self, itens: list, contexto_nacional: Dict = None) -> Iterator[bytes]:
+        """Linhas NDJSON de itens (linhas da base ou municípios) em uma passada vetorizada"""
+        if all(isinstance(v, int) for v in itens):
+            sub_base = self.base.subconjunto(itens)
+        else:
+            sub_base = BaseMunicipios.de_registros([self.base[v] if isinstance(v, int) else v for v in itens])
+        lote = self.calculadora.calcular_lote(sub_base, contexto_nacional)
+        return (_json(r) + b'\n' for r in registros_lote(lote))
+
+    def _linha_isolada(self, item, indice: int, contexto_nacional: Dict = None) -> bytes:
+        """Linha de um item só; se o cálculo falhar, a linha {'indice', 'erro'} dele"""
+        try:
+            return next(self._linhas([item], contexto_nacional))
+        except (TypeError, ValueError, OverflowError) as erro:
+            return _json({'indice': indice, 'erro': str(erro)}) + b'\n'
+
+    # ---------- Entrada ----------
+
+    def _ler_corpo(self, environ) -> bytes:
+        try:
+            tamanho = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            raise ErroRequisicao("Content-Length inválido")
+        if tamanho > self.max_corpo:
+            raise ErroRequisicao("Corpo da requisição grande demais", '413 Payload Too Large')
+        return environ['wsgi.input'].read(tamanho)
+
+    def _itens(self, environ) -> Iterator:
+        """Itens do lote: array JSON ou NDJSON (lido linha a linha)"""
+        tipo = environ.get('CONTENT_TYPE', '')
+        if 'ndjson' in tipo:
+            restante = int(environ.get('CONTENT_LENGTH') or 0)
+            entrada = environ['wsgi.input']
+            while restante > 0:
+                linha = entrada.readline(min(restante, 1 << 20))
+                if not linha:
+                    break
+                restante -= len(linha)
+                if linha.strip():
+                    yield json.loads(linha)
+        else:
+            itens = json.loads(self._ler_corpo(environ))
+            if not isinstance(itens, list):
+                raise ErroRequisicao("Esperado um array JSON")
+            yield from itens
+
+    def _blocos(self, itens: Iterable) -> Iterator:
+        bloco, deslocamento = [], 0
+        for item in itens:
+            bloco.append(item)
+            if len(bloco) == self.tamanho_bloco:
+                yield deslocamento, bloco
+                deslocamento += len(bloco)
+                bloco = []
+        if bloco:
+            yield deslocamento, bloco
+
+    @staticmethod
+    def _validar(municipio: Dict) -> Dict:
+        """validar_municipio com o erro como ErroRequisicao (400)"""
+        try:
+            return validar_municipio(municipio)
+        except ValueError as erro:
+            raise ErroRequisicao(str(erro))
+
+    def _medir_fluxo(self, rota: str, inicio: float, environ) -> Iterator[bytes]:
+        """Repassa o fluxo do lote e registra latência total e municípios ao terminar"""
+        progresso = {'municipios': 0}
+        erro = False
+        try:
+            yield from self._lote(environ, progresso)
+        except (ErroRequisicao, ValueError) as e:
+            erro = True
+            yield _json({'erro': str(e)}) + b'\n'
+        finally:
+            self.estatisticas.registrar(rota, time.perf_counter() - inicio, erro=erro,
+                                        municipios=progresso['municipios'])
+
+
+# ---------- Servidor ----------
+
+class _ServidorThreads(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _HandlerSilencioso(WSGIRequestHandler):
+    def log_message(self, formato, *args):
+        pass
+
+
+def criar_app(caminho_base: str = 'dados/municipios.json', n_workers: int = 1) -> ServicoFUNDEB:
+    """Carrega base e ponderadores uma vez e monta a aplicação WSGI"""
+    municipios = carregar_municipios(caminho_base)
+    calculadora = CalculadoraFUNDEB()
+    calculadora.carregar_base_nacional(municipios)
+    return ServicoFUNDEB(calculadora, municipios, EstatisticasCompartilhadas(n_workers))
+
+
+def servir(app: ServicoFUNDEB, host: str = '127.0.0.1', porta: int = 8000, processos: int = 1):
+    """
+    Atende no endereço com processos pré-criados (fork) compartilhando o socket
+
+    Cada processo usa threads para não bloquear em respostas em fluxo. Em
+    sistemas sem fork, atende em um único processo.
+    """
+    servidor = make_server(host, porta, app, server_class=_ServidorThreads, handler_class=_HandlerSilencioso)
+    processos = min(processos, app.estatisticas.n_workers) if hasattr(os, 'fork') else 1
+
+    filhos = []
+    for worker in range(1, processos):
+        pid = os.fork()
+        if pid == 0:
+            app.estatisticas.worker = worker
+            signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+            try:
+                servidor.serve_forever()
+            finally:
+                os._exit(0)
+        filhos.append(pid)
+
+    def encerrar(*_):
+        for pid in filhos:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, encerrar)
+    print(f"Serviço FUNDEB em http://{host}:{porta} ({processos} processo(s))", flush=True)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in filhos:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        servidor.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serviço HTTP da calculadora FUNDEB")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8000)
+    parser.add_argument('--processos', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--base', default='dados/municipios.json', help="Base de municípios (JSON ou colunar)")
+    args = parser.parse_args(argv)
+
+    servir(criar_app(args.base, args.processos), args.host, args.porta, args.processos)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Tabelas grandes ordenadas e paginadas no servidor
+
+Em vez de enviar ao navegador um DataFrame com milhares de linhas formatado
+por Styler.format (uma chamada Python por célula), a tabela guarda os dados
+brutos, ordena por índices NumPy (memorizados por coluna) e formata em lote
+só as linhas da página visível.
+"""
+import math
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from calculadora import formatar_coluna
+
+# Formatos de coluna: (casas decimais, prefixo)
+FORMATOS = {
+    'moeda': (2, 'R$ '),
+    'decimal': (2, ''),
+    'inteiro': (0, ''),
+}
+
+
+class TabelaPaginada:
+    """
+    DataFrame ordenável e paginado, formatado página a página
+
+    Exemplo:
+        tabela = TabelaPaginada(df, {'Total': 'moeda', 'Matrículas': 'inteiro'})
+        tabela.pagina(1, 50, ordenar_por='Total', crescente=False)
+    """
+
+    def __init__(self, dados: pd.DataFrame, formatos: Dict[str, str] = None):
+        """
+        Args:
+            dados: Valores brutos (numéricos sem formatação)
+            formatos: {coluna: 'moeda' | 'decimal' | 'inteiro'}; as demais
+                colunas são exibidas como estão
+        """
+        self.dados = dados.reset_index(drop=True)
+        self.formatos = dict(formatos or {})
+        self._ordens: Dict[tuple, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.dados)
+
+    @property
+    def colunas(self) -> List[str]:
+        return list(self.dados.columns)
+
+    def n_paginas(self, tamanho_pagina: int) -> int:
+        return max(1, math.ceil(len(self) / tamanho_pagina))
+
+    def ordem(self, coluna: str, crescente: bool = True) -> np.ndarray:
+        """
+        Índices das linhas ordenadas pela coluna (memorizados)
+
+        Ordenação estável; textos ignoram maiúsculas; números ausentes (NaN)
+        ficam no fim nos dois sentidos.
+        """
+        chave = (coluna, crescente)
+        if chave not in self._ordens:
+            serie = self.dados[coluna]
+            if pd.api.types.is_numeric_dtype(serie):
+                valores = serie.to_numpy(dtype=np.float64)
+                ordem = np.argsort(valores if crescente else -valores, kind='stable')
+            else:
+                ordem = np.argsort(serie.astype(str).str.casefold().to_numpy(), kind='stable')
+                if not crescente:
+                    ordem = ordem[::-1]
+            self._ordens[chave] = ordem
+        return self._ordens[chave]
+
+    def pagina(
+        self,
+        numero: int,
+        tamanho_pagina: int = 50,
+        ordenar_por: str = None,
+        crescente: bool = True
+    ) -> pd.DataFrame:
+        """
+        Linhas de uma página, já formatadas para exibição
+
+        Args:
+            numero: Página (começa em 1; valores fora do intervalo são ajustados)
+            tamanho_pagina: Linhas por página
+            ordenar_por: Coluna de ordenação (padrão: ordem original)
+            crescente: Sentido da ordenação
+
+        Returns:
+            DataFrame com no máximo tamanho_pagina linhas, colunas formatadas como texto
+        """
+        numero = min(max(1, int(numero)), self.n_paginas(tamanho_pagina))
+        inicio = (numero - 1) * tamanho_pagina
+        if ordenar_por is None:
+            linhas = np.arange(inicio, min(inicio + tamanho_pagina, len(self)))
+        else:
+            linhas = self.ordem(ordenar_por, crescente)[inicio:inicio + tamanho_pagina]
+
+        pagina = self.dados.iloc[linhas].reset_index(drop=True)
+        for coluna, formato in self.formatos.items():
+            casas, prefixo = FORMATOS[formato]
+            pagina[coluna] = formatar_coluna(pagina[coluna].to_numpy(), casas, prefixo)
+        return pagina
@@ -13,3 +13,605 @@ print(f"Município: {resultado['municipio']}")
 print(f"VAAT: R$ {resultado['vaat']['valor_total']:,.2f}")
 print(f"VAAF: R$ {resultado['vaaf']['valor_total']:,.2f}")
 print(f"Total: R$ {resultado['total_complementacoes']:,.2f}")
+
+# Cálculo em lote deve reproduzir o cálculo escalar
+lote = calc.calcular_lote(municipios)
+for i, mun in enumerate(municipios):
+    escalar = calc.calcular_ambas_complementacoes(mun)
+    for tipo in ('vaat', 'vaaf'):
+        assert abs(lote[tipo]['valor_total'][i] - escalar[tipo]['valor_total']) < 1e-6
+print(f"✅ Lote consistente com cálculo escalar ({len(municipios)} municípios)")
+
+# Total nacional: atualização incremental deve coincidir com nova varredura
+calc.carregar_base_nacional(municipios)
+simulado = dict(municipios[1], matriculas=dict(municipios[1]['matriculas']))
+simulado['matriculas']['creche_integral'] += 500
+totais_delta = calc.totais_com_delta(municipios[1], simulado)
+totais_varredura = calc.calcular_totais_nacionais(
+    [simulado if i == 1 else m for i, m in enumerate(municipios)]
+)
+for tipo in ('vaat', 'vaaf'):
+    assert abs(totais_delta[tipo] - totais_varredura[tipo]) < 1e-6
+print("✅ Total nacional incremental consistente com varredura completa")
+
+# Redistribuição: o limiar encontrado deve esgotar o orçamento
+contexto = calc.contexto_nacional
+lote = calc.calcular_lote(municipios)
+for tipo in ('vaat', 'vaaf'):
+    elegivel = lote[tipo]['elegivel']
+    custo = (
+        lote[tipo]['total_ajustado'][elegivel]
+        * (contexto['limiares'][tipo] - lote[tipo]['valor_aluno_ano'][elegivel])
+    ).sum()
+    assert abs(custo - calc._orcamento(tipo)) < 1e-3 * calc._orcamento(tipo)
+print(f"✅ Limiares encontrados: VAAT R$ {contexto['limiares']['vaat']:,.2f}, VAAF R$ {contexto['limiares']['vaaf']:,.2f}")
+
+# Base colunar: mesmos resultados que a lista de dicionários
+import os
+import tempfile
+import threading
+from base_municipios import BaseMunicipios, converter_json_para_colunar
+
+with tempfile.TemporaryDirectory() as tmp:
+    base = BaseMunicipios.abrir(converter_json_para_colunar('dados/municipios.json', f'{tmp}/municipios.colunar'))
+    lote_colunar = calc.calcular_lote(base)
+    for tipo in ('vaat', 'vaaf'):
+        assert (lote_colunar[tipo]['valor_total'] == lote[tipo]['valor_total']).all()
+    assert base.por_codigo(municipios[2]['codigo_ibge'])['nome'] == municipios[2]['nome']
+    assert [base[i]['nome'] for i in base.indices_uf('PR')] == ['Apucarana']
+    # Regravar troca o link de uma vez: o destino nunca some e a base aberta segue válida
+    destino, ausente, regravando = f'{tmp}/municipios.colunar', [], True
+
+    def vigiar():
+        while regravando:
+            if not os.path.exists(os.path.join(destino, 'meta.json')):
+                ausente.append(True)
+    vigia = threading.Thread(target=vigiar)
+    vigia.start()
+    for _ in range(20):
+        BaseMunicipios.de_registros(municipios[::-1]).salvar(destino)
+    regravando = False
+    vigia.join()
+    assert not ausente and os.path.islink(destino)
+    assert base[0]['nome'] == municipios[0]['nome'] and BaseMunicipios.abrir(destino)[0]['nome'] == municipios[-1]['nome']
+    assert len([nome for nome in os.listdir(tmp) if nome.startswith('.municipios.colunar-')]) == 2
+    # Dois escritores no mesmo destino: nenhum apaga a versão em escrita do outro
+    em_escrita = tempfile.mkdtemp(prefix='.municipios.colunar-', dir=tmp)
+    falhas = []
+
+    def regravar():
+        try:
+            for _ in range(10):
+                BaseMunicipios.de_registros(municipios).salvar(destino)
+        except Exception as erro:
+            falhas.append(erro)
+    escritores = [threading.Thread(target=regravar) for _ in range(2)]
+    for escritor in escritores:
+        escritor.start()
+    for escritor in escritores:
+        escritor.join()
+    assert not falhas and os.path.isdir(em_escrita)
+    assert BaseMunicipios.abrir(destino)[0]['nome'] == municipios[0]['nome']
+    del base, lote_colunar
+print("✅ Base colunar consistente com municipios.json")
+
+# Varredura de cenários: reprodutível pela semente
+from cenarios import Normal, VarreduraCenarios
+
+bandas = [
+    VarreduraCenarios(calc, municipios, nse=Normal(0, 2), n_cenarios=100, semente=1, cenarios_por_lote=32)
+    .executar(processos=1).bandas('vaat')
+    for _ in range(2)
+]
+assert all((bandas[0][p] == bandas[1][p]).all() for p in ('p5', 'p50', 'p95'))
+assert (bandas[0]['p5'] <= bandas[0]['p95']).all()
+print("✅ Varredura de cenários reprodutível")
+
+# Projeção plurianual: primeiro ano coincide com o cenário nacional atual
+from projecao import ProjecaoPlurianual
+
+projecao = ProjecaoPlurianual(calc, municipios, crescimento_matriculas=0.02)
+atual = calc.calcular_cenario_nacional(municipios)
+assert projecao.cubo.shape == (len(municipios), 11, 2)
+assert abs(projecao.municipio(municipios[0]['codigo_ibge'])['vaat'][0] - atual['vaat']['valor_total'][0]) < 1e-3
+print("✅ Projeção 2025–2035 consistente com o ano-base")
+
+# Registro de ponderadores: rascunho comparado sem reabrir o JSON
+from ponderadores import obter_registro
+
+registro = obter_registro()
+dados_rascunho = dict(registro.obter().dados, vaat=dict(registro.obter().dados['vaat'], creche_integral=2.10))
+rascunho = registro.registrar('rascunho', 2025, dados_rascunho)
+calc_rascunho = CalculadoraFUNDEB(rascunho)
+assert registro.obter() is calc.conjunto_ponderadores
+assert calc_rascunho.calcular_total_ajustado(municipios[0]['matriculas'], 'vaat', 50, 1) > \
+    calc.calcular_total_ajustado(municipios[0]['matriculas'], 'vaat', 50, 1)
+# Só com ano: a Portaria registrada por último, não a maior como texto
+from ponderadores import RegistroPonderadores
+
+portarias = RegistroPonderadores()
+portarias.registrar('Portaria 9/2025', 2026, registro.obter().dados)
+portarias.registrar('Portaria 10/2025', 2026, dados_rascunho)
+assert portarias.obter(ano=2026).portaria == 'Portaria 10/2025'
+portarias.registrar('Portaria 9/2025', 2026, registro.obter().dados)
+assert portarias.obter(ano=2026).portaria == 'Portaria 9/2025'
+print(f"✅ Registro de ponderadores: {registro.versoes()}")
+
+# Cache de resultados: segunda leitura vem do disco, chave muda com os ponderadores
+from cache_resultados import CacheResultados
+
+with tempfile.TemporaryDirectory() as tmp:
+    CacheResultados(tmp).calcular_lote(calc, municipios)
+    cache = CacheResultados(tmp)
+    do_disco = cache.calcular_lote(calc, municipios)
+    assert cache.estatisticas()['acertos_disco'] == 1
+    assert (do_disco['vaat']['valor_total'] == lote['vaat']['valor_total']).all()
+    assert do_disco['municipio'] == lote['municipio'] and do_disco['etapas'] == lote['etapas']
+    assert CacheResultados.chave(calc, municipios) != CacheResultados.chave(calc_rascunho, municipios)
+    # Worker novo: contexto nacional vem do disco, sem varrer a base antes de consultar
+    CacheResultados(tmp).carregar_base_nacional(CalculadoraFUNDEB(), municipios)
+    frio = CalculadoraFUNDEB()
+    frio.resolver_contexto_nacional = None
+    cache_frio = CacheResultados(tmp)
+    cache_frio.carregar_base_nacional(frio, municipios)
+    assert frio.contexto_nacional == calc.contexto_nacional
+    assert CacheResultados.chave(frio, municipios) == CacheResultados.chave(calc, municipios)
+    # Resultados devolvidos são cópias
+    cache_frio.calcular_lote(frio, municipios)['vaat']['valor_total'][:] = -1
+    assert (cache_frio.calcular_lote(frio, municipios)['vaat']['valor_total'] == lote['vaat']['valor_total']).all()
+    assert cache_frio.estatisticas()['acertos_memoria'] == 1
+print("✅ Cache de resultados persistente")
+
+# Cache de respostas do chat: pergunta repetida não chama a API
+from types import SimpleNamespace
+from chat_agent import CacheRespostas, ChatAgentFUNDEB
+
+
+class ClienteFalso:
+    def __init__(self):
+        self.chamadas = 0
+        self.messages = self
+
+    def create(self, **kwargs):
+        self.chamadas += 1
+        self.ultima = kwargs
+        if 'system' in kwargs:
+            # Último turno da conversa (os resumos do histórico não têm prompt do sistema)
+            self.ultimo_turno = kwargs
+        return SimpleNamespace(
+            content=[SimpleNamespace(type='text', text=f"resposta {self.chamadas}")], stop_reason='end_turn'
+        )
+
+    def stream(self, **kwargs):
+        from contextlib import nullcontext
+        self.chamadas += 1
+        return nullcontext(SimpleNamespace(text_stream=iter(["resposta ", "em ", "fluxo"])))
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    cliente = ClienteFalso()
+    agente = ChatAgentFUNDEB(client=cliente, cache=CacheRespostas(tmp))
+    contexto = calc.calcular_ambas_complementacoes(municipios[0])
+    primeira = agente.gerar_resposta("O que é VAAT?", contexto_municipio=contexto)
+    assert agente.gerar_resposta("  o que é  vaat ", contexto_municipio=contexto) == primeira
+    assert cliente.chamadas == 1 and agente.cache.estatisticas()['acertos'] == 1
+    agente.gerar_resposta("O que é VAAT?", contexto_municipio=calc.calcular_ambas_complementacoes(municipios[1]))
+    assert cliente.chamadas == 2
+    expirado = ChatAgentFUNDEB(client=cliente, cache=CacheRespostas(tmp, ttl=0))
+    expirado.gerar_resposta("O que é VAAT?", contexto_municipio=contexto)
+    assert cliente.chamadas == 3
+print("✅ Cache de respostas do chat")
+
+# Resposta em fluxo: trechos entregues um a um, texto completo vai para o cache
+with tempfile.TemporaryDirectory() as tmp:
+    cliente = ClienteFalso()
+    agente = ChatAgentFUNDEB(client=cliente, cache=CacheRespostas(tmp))
+    trechos = list(agente.gerar_resposta_stream("Explique o VAAF"))
+    assert trechos == ["resposta ", "em ", "fluxo"] and agente.latencia_primeiro_token is not None
+    assert list(agente.gerar_resposta_stream("explique o vaaf?")) == ["resposta em fluxo"]
+    assert agente.gerar_resposta("Explique o VAAF") == "resposta em fluxo" and cliente.chamadas == 1
+print("✅ Resposta do chat em fluxo")
+
+# Prompt em blocos (prefixo fixo cacheável) e histórico limitado por resumo
+from chat_agent import MINIMO_TOKENS_CACHE, GerenciadorHistorico, estimar_tokens
+
+cliente = ClienteFalso()
+agente = ChatAgentFUNDEB(client=cliente)
+gerenciador = GerenciadorHistorico(limite_tokens=200, mensagens_recentes=2)
+historico, prefixos, tamanhos = [], set(), []
+for i in range(20):
+    pergunta = f"Pergunta {i} sobre o VAAT " + "detalhe " * 30
+    resposta = agente.gerar_resposta(pergunta, contexto_municipio=contexto, historico=historico, gerenciador=gerenciador)
+    gerenciador.aguardar()
+    if cliente.ultimo_turno['system'][0]['text'] == agente.prompt_fixo:
+        prefixos.add(cliente.ultimo_turno['system'][0]['cache_control']['type'])
+        tamanhos.append(sum(estimar_tokens(m['content']) for m in cliente.ultimo_turno['messages']))
+    historico += [{'role': 'user', 'content': pergunta}, {'role': 'assistant', 'content': resposta}]
+assert prefixos == {'ephemeral'} and gerenciador.resumo and gerenciador.compactadas > 0
+# Prefixo até o ponto de cache precisa passar do mínimo da API para ser guardado
+ponto_cache = next(i for i, bloco in enumerate(cliente.ultimo_turno['system']) if 'cache_control' in bloco)
+prefixo = ''.join(bloco['text'] for bloco in cliente.ultimo_turno['system'][:ponto_cache + 1])
+assert estimar_tokens(prefixo) >= MINIMO_TOKENS_CACHE
+assert max(tamanhos[5:]) <= 200 + 2 * estimar_tokens(pergunta)
+print(f"✅ Histórico do chat compactado ({gerenciador.compactadas} mensagens resumidas)")
+
+# Resposta do cache sai antes de qualquer resumo; o resumo roda depois, em segundo plano
+with tempfile.TemporaryDirectory() as tmp:
+    cliente = ClienteFalso()
+    agente = ChatAgentFUNDEB(client=cliente, cache=CacheRespostas(tmp))
+    agente.gerar_resposta("Explique o VAAT", historico=historico)
+    gerenciador = GerenciadorHistorico(limite_tokens=200, mensagens_recentes=2)
+    fluxo = agente.gerar_resposta_stream("explique o vaat", historico=historico, gerenciador=gerenciador)
+    assert next(fluxo) == "resposta 1" and cliente.chamadas == 1
+    list(fluxo)
+    gerenciador.aguardar()
+    assert cliente.chamadas == 2 and gerenciador.compactadas > 0
+print("✅ Resposta do cache antes do resumo do histórico")
+
+# Explicações em lote: repete após 429 e retoma pelo arquivo de progresso
+from explicacoes_lote import GeradorExplicacoes, preparar_resultados
+
+
+class LimiteTaxa(Exception):
+    status_code = 429
+
+
+class ClienteInstavel(ClienteFalso):
+    def create(self, **kwargs):
+        if self.chamadas == 0:
+            self.chamadas += 1
+            raise LimiteTaxa("rate limit")
+        return super().create(**kwargs)
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    arquivo = f'{tmp}/explicacoes.ndjson'
+    cliente = ClienteInstavel()
+    gerador = GeradorExplicacoes(ChatAgentFUNDEB(client=cliente), arquivo, concorrencia=2,
+                                 requisicoes_por_minuto=6000, espera_base=0.01)
+    contagem = gerador.executar(preparar_resultados(calc, municipios))
+    assert contagem == {'ok': len(municipios), 'erro': 0, 'pulados': 0}
+    assert cliente.chamadas == len(municipios) + 1
+    assert gerador.executar(preparar_resultados(calc, municipios))['pulados'] == len(municipios)
+    assert cliente.chamadas == len(municipios) + 1
+    # Já explicados são filtrados antes do cálculo (nenhuma chamada à calculadora)
+    assert list(preparar_resultados(None, municipios, concluidos=gerador.concluidos())) == []
+    base_colunar = BaseMunicipios.de_registros(municipios)
+    pendentes = list(preparar_resultados(calc, base_colunar, concluidos={municipios[0]['codigo_ibge']}))
+    assert [r['codigo_ibge'] for r in pendentes] == [m['codigo_ibge'] for m in municipios[1:]]
+print("✅ Explicações em lote com nova tentativa e retomada")
+
+# Índice legal: só os trechos relevantes entram no prompt
+from indice_legal import IndiceLegal, carregar_indice
+
+with tempfile.TemporaryDirectory() as tmp:
+    indice = carregar_indice(diretorio=f'{tmp}/legal.indice')
+    assert carregar_indice(diretorio=f'{tmp}/legal.indice').assinatura == indice.assinatura
+    melhores = indice.buscar("ponderador da creche integral", k=3)
+    assert 1 <= len(melhores) <= 3 and 'Creche integral' in melhores[0]['texto']
+
+cliente = ClienteFalso()
+agente = ChatAgentFUNDEB(client=cliente, indice=indice, k_trechos=2)
+agente.gerar_resposta("Qual o ponderador da creche integral?")
+blocos = [bloco['text'] for bloco in cliente.ultima['system']]
+# Resumo legal inteiro no prefixo cacheado; trechos recuperados depois, sem repeti-lo
+assert 'Creche integral' in blocos[0] and 'cache_control' in cliente.ultima['system'][0]
+assert len(blocos) == 2 and 'fundeb_resumo.md' not in blocos[1]
+assert 'Creche integral' in ChatAgentFUNDEB(client=cliente, indice=indice, resumo_legal='').contexto_legal(
+    "Qual o ponderador da creche integral?")
+print(f"✅ Índice legal com {len(indice)} trechos")
+
+# Ferramentas da calculadora: o modelo busca, calcula e simula; resultados em cache na conversa
+from ferramentas_chat import FerramentasCalculadora
+
+
+class ClienteComFerramentas:
+    def __init__(self):
+        self.messages = self
+        self.rodadas = []
+
+    def create(self, **kwargs):
+        self.rodadas.append(kwargs)
+        if len(self.rodadas) == 1:
+            chamadas = [
+                ('buscar_municipio', {'consulta': 'acrelandia'}),
+                ('simular_cenario', {'codigo_ibge': municipios[0]['codigo_ibge'],
+                                     'variacao_percentual': {'creche_integral': 20}}),
+                ('calcular_municipio', {'codigo_ibge': '0000000'}),
+            ]
+            return SimpleNamespace(stop_reason='tool_use', content=[
+                SimpleNamespace(type='tool_use', id=f't{i}', name=nome, input=args)
+                for i, (nome, args) in enumerate(chamadas)
+            ])
+        return SimpleNamespace(stop_reason='end_turn', content=[SimpleNamespace(type='text', text='ok')])
+
+
+ferramentas = FerramentasCalculadora(calc, municipios)
+cliente = ClienteComFerramentas()
+agente = ChatAgentFUNDEB(client=cliente, ferramentas=ferramentas)
+assert agente.gerar_resposta("E se a creche integral crescer 20%? Compare com Acrelândia") == 'ok'
+resultados = cliente.rodadas[1]['messages'][-1]['content']
+assert json.loads(resultados[0]['content'])['municipios'][0]['nome'] == 'Acrelândia'
+assert json.loads(resultados[1]['content'])['diferenca']['vaat'] >= 0
+assert resultados[2]['is_error'] and 'tools' in cliente.rodadas[0]
+ferramentas.executar('simular_cenario', {'codigo_ibge': municipios[0]['codigo_ibge'],
+                                         'variacao_percentual': {'creche_integral': 20}})
+assert ferramentas.chamadas == 2
+try:
+    ferramentas.simular_cenario(municipios[0]['codigo_ibge'], variacao_percentual={'creche_integral': -150})
+    raise AssertionError("variação abaixo de -100% aceita")
+except ValueError:
+    pass
+referencia = agente._referenciar_municipio(dict(contexto, codigo_ibge=municipios[0]['codigo_ibge']))
+assert municipios[0]['codigo_ibge'] in referencia
+print("✅ Ferramentas da calculadora no chat")
+
+# Serviço HTTP: lote em NDJSON na ordem de entrada, com erro por linha
+import io
+from wsgiref.util import setup_testing_defaults
+from calculadora import registros_lote
+from servico import ServicoFUNDEB
+
+
+def requisitar(app, metodo, rota, corpo=b''):
+    environ = {'REQUEST_METHOD': metodo, 'PATH_INFO': rota, 'CONTENT_LENGTH': str(len(corpo)),
+               'wsgi.input': io.BytesIO(corpo)}
+    setup_testing_defaults(environ)
+    status = []
+    saida = b''.join(app(environ, lambda s, h: status.append(s)))
+    return status[0], saida
+
+
+servico = ServicoFUNDEB(calc, municipios, tamanho_bloco=2)
+codigos = [m['codigo_ibge'] for m in municipios]
+status, saida = requisitar(servico, 'POST', '/calcular/lote', json.dumps(codigos + ['999']).encode())
+linhas = [json.loads(linha) for linha in saida.splitlines()]
+assert status.startswith('200') and [l.get('codigo_ibge') for l in linhas[:-1]] == codigos
+assert abs(linhas[0]['vaat']['valor_total'] - lote['vaat']['valor_total'][0]) < 1e-6 and 'erro' in linhas[-1]
+assert requisitar(servico, 'POST', '/calcular', b'{"codigo_ibge": "999"}')[0].startswith('404')
+estatisticas = json.loads(requisitar(servico, 'GET', '/estatisticas')[1])
+assert estatisticas['rotas']['/calcular/lote']['municipios'] == len(municipios)
+print("✅ Serviço HTTP (lote NDJSON e estatísticas)")
+
+# Mesmo pedido em /calcular e /calcular/lote: substituições e delta nacional iguais
+pedidos = [
+    {'codigo_ibge': codigos[0], 'matriculas': {'creche_integral': 50000}},
+    dict(municipios[1], nse=70.0),
+    codigos[2],
+]
+_, saida = requisitar(servico, 'POST', '/calcular/lote', json.dumps(pedidos).encode())
+for pedido, linha in zip(pedidos, saida.splitlines()):
+    corpo = json.dumps(pedido if isinstance(pedido, dict) else {'codigo_ibge': pedido}).encode()
+    individual = json.loads(requisitar(servico, 'POST', '/calcular', corpo)[1])
+    em_lote = json.loads(linha)
+    assert abs(individual['total_complementacoes'] - em_lote['total_complementacoes']) < 1e-6
+    assert individual['vaat']['elegivel'] == em_lote['vaat']['elegivel']
+for invalido in ({'codigo_ibge': codigos[0], 'nse': 'abc'},
+                 {'codigo_ibge': codigos[0], 'matriculas': {'creche_integral': -1}}):
+    status, saida = requisitar(servico, 'POST', '/calcular', json.dumps(invalido).encode())
+    assert status.startswith('400') and 'erro' in json.loads(saida)
+    assert 'erro' in json.loads(requisitar(servico, 'POST', '/calcular/lote', json.dumps([invalido]).encode())[1])
+print("✅ Serviço HTTP (lote igual a /calcular, validação de números)")
+
+# Etapa fora de ETAPAS: ignorada pelo cálculo escalar e pelo lote, recusada pelo serviço
+extra = dict(municipios[0], matriculas=dict(municipios[0]['matriculas'], foo=100000))
+escalar = calc.calcular_ambas_complementacoes(extra)
+em_lote = next(registros_lote(calc.calcular_lote([extra])))
+assert escalar['matriculas_totais'] == em_lote['matriculas_totais']
+assert abs(escalar['total_complementacoes'] - em_lote['total_complementacoes']) < 1e-6
+assert escalar['vaat']['elegivel'] == em_lote['vaat']['elegivel']
+for invalido in ({'codigo_ibge': codigos[0], 'matriculas': {'foo': 100000}},
+                 {'codigo_ibge': codigos[0], 'receita_vaat': 'abc'},
+                 dict(municipios[1], uf=['PR'])):
+    status, saida = requisitar(servico, 'POST', '/calcular', json.dumps(invalido).encode())
+    assert status.startswith('400') and 'erro' in json.loads(saida)
+status, saida = requisitar(servico, 'POST', '/calcular/lote',
+                           json.dumps([dict(municipios[1], uf=['PR']), codigos[0]]).encode())
+linhas = [json.loads(linha) for linha in saida.splitlines()]
+assert 'erro' in linhas[0] and linhas[1]['codigo_ibge'] == codigos[0]
+# Sem matrículas: valor por aluno infinito sai como null (JSON estrito)
+vazio = json.dumps({'codigo_ibge': codigos[0], 'matriculas': {e: 0 for e in municipios[0]['matriculas']}})
+sem_etapas = json.dumps(dict(municipios[0], matriculas={}))
+for rota, corpo in (('/calcular', vazio), ('/calcular/lote', f'[{vazio}, {sem_etapas}]')):
+    saida = requisitar(servico, 'POST', rota, corpo.encode())[1]
+    for linha in saida.splitlines():
+        assert json.loads(linha, parse_constant=lambda c: 1 / 0)['vaat']['valor_aluno_ano'] is None
+print("✅ Serviço HTTP (etapas e tipos recusados, sem Infinity no JSON)")
+
+# Lote em linha de comando: NDJSON/CSV em blocos, erros por registro sem parar
+from processar_lote import gravar, ler_csv, ler_ndjson, processar
+
+entrada = io.StringIO(''.join(json.dumps(m) + '\n' for m in municipios) + '{"nome": "x"}\n')
+saida = io.StringIO()
+contagem = gravar(processar(ler_ndjson(entrada), calc, tamanho_bloco=2), saida)
+linhas = [json.loads(linha) for linha in saida.getvalue().splitlines()]
+assert contagem == {'processados': len(municipios), 'erros': 1} and 'erro' in linhas[-1]
+assert abs(linhas[0]['total_complementacoes'] - lote['total_complementacoes'][0]) < 1e-6
+csv_entrada = io.StringIO("nome,uf,nse,drec,creche_integral\nTeste,PR,50,0.9,100\n")
+saida = io.StringIO()
+gravar(processar(ler_csv(csv_entrada), calc), saida, 'csv')
+assert saida.getvalue().splitlines()[1].startswith(',Teste,PR,')
+# Registros inválidos barrados antes do cálculo; processos usam os ponderadores do pai
+invalidos = [dict(municipios[0], nse='abc'), dict(municipios[0], matriculas={'creche_integral': -1}),
+             dict(municipios[0], receita_vaaf='x'), dict(municipios[0], matriculas={'foo': 1})]
+assert [status for status, _ in processar(invalidos, calc)] == ['erro'] * 4
+em_processos = list(processar(municipios, calc_rascunho, tamanho_bloco=2, processos=2))
+assert em_processos == list(processar(municipios, calc_rascunho, tamanho_bloco=2))
+assert em_processos != list(processar(municipios, calc, tamanho_bloco=2))
+print("✅ Lote em linha de comando (NDJSON/CSV)")
+
+# Benchmarks: base sintética no formato de municipios.json e detecção de regressão
+from benchmark import comparar, executar, gerar_municipios
+
+sinteticos = gerar_municipios(300, semente=1)
+assert len(sinteticos) == 300 and set(sinteticos[0]['matriculas']) == set(municipios[0]['matriculas'])
+assert gerar_municipios(300, semente=1)[7] == sinteticos[7]
+medicoes = executar(escalas=(1,), repeticoes=1, tamanho_nacional=200, amostra_escalar=20)
+assert {'carga_json', 'escalar', 'lote', 'tabela'} <= set(medicoes['escalas']['1x'])
+mais_lenta = json.loads(json.dumps(medicoes))
+for medicao in mais_lenta['escalas']['1x'].values():
+    medicao['minimo_s'] = medicao['minimo_s'] * 2 + 1
+assert not comparar(medicoes, medicoes) and len(comparar(mais_lenta, medicoes)) == len(medicoes['escalas']['1x'])
+print("✅ Benchmarks com base sintética")
+
+# Métricas: desligadas não registram nada; ligadas medem cálculos e tokens do chat
+from metricas import METRICAS
+
+
+class ClienteComUso(ClienteFalso):
+    def create(self, **kwargs):
+        resposta = super().create(**kwargs)
+        resposta.usage = SimpleNamespace(input_tokens=120, output_tokens=30, cache_read_input_tokens=100)
+        return resposta
+
+
+METRICAS.limpar()
+calc.calcular_lote(municipios)
+assert not METRICAS.resumo()['duracoes']
+METRICAS.ativo = True
+try:
+    for _ in range(3):
+        calc.calcular_lote(municipios)
+    ChatAgentFUNDEB(client=ClienteComUso()).gerar_resposta("O que é VAAF?")
+    resumo = METRICAS.resumo()
+finally:
+    METRICAS.ativo = False
+    METRICAS.limpar()
+lote_medido = resumo['duracoes']['CalculadoraFUNDEB.calcular_lote']
+assert lote_medido['n'] == 3 and lote_medido['p50_s'] <= lote_medido['max_s']
+assert resumo['contadores']['chat.tokens_entrada'] == 120 and resumo['contadores']['chat.tokens_cache_lidos'] == 100
+assert 'chat.gerar_resposta' in resumo['duracoes']
+print("✅ Métricas de tempo e tokens")
+
+# Resultados compactos: lidos como dicionários, detalhamento sob demanda
+import pickle
+from resultados import ResultadoMunicipio
+
+compacto = calc.calcular_ambas_complementacoes(municipios[0])
+assert isinstance(compacto, ResultadoMunicipio) and compacto['vaat']['valor_total'] == compacto.vaat.valor_total
+valor, detalhe = calc.calcular_complementacao(municipios[0], 'vaat')
+assert detalhe == compacto['vaat']['detalhamento'] and valor == compacto['vaat']['valor_total']
+assert abs(sum(d['valor_complementacao'] for d in detalhe.values()) - valor) < 1e-6 * max(valor, 1)
+df_detalhe = compacto.para_dataframe()
+assert set(df_detalhe['tipo']) == {'vaat', 'vaaf'} or not compacto['vaaf']['elegivel']
+assert list(compacto['vaat'].para_dataframe().index) == list(detalhe)
+compacto.update(codigo_ibge='123')
+assert compacto['codigo_ibge'] == '123' and list(compacto)[-1] == 'codigo_ibge'
+assert pickle.loads(pickle.dumps(compacto)) == compacto
+assert json.loads(json.dumps(compacto.para_dict()))['vaat']['detalhamento'].keys() == detalhe.keys()
+print("✅ Resultados compactos (dicionário, DataFrame e detalhamento sob demanda)")
+
+# Formatação brasileira em coluna e tabela paginada no servidor
+import numpy as np
+import pandas as pd
+from calculadora import formatar_coluna, formatar_moeda, formatar_moeda_coluna, formatar_numero
+from tabelas import TabelaPaginada
+
+assert formatar_moeda(1234567.891) == "R$ 1.234.567,89" and formatar_numero(-1234.5) == "-1.234,50"
+assert list(formatar_moeda_coluna([1234567.891, float('nan'), 0.5])) == ["R$ 1.234.567,89", "—", "R$ 0,50"]
+assert list(formatar_coluna([1500000, 7], casas=0)) == ["1.500.000", "7"]
+tabela = TabelaPaginada(
+    pd.DataFrame({'Município': lote['municipio'], 'Total': lote['total_complementacoes']}), {'Total': 'moeda'}
+)
+pagina = tabela.pagina(1, 2, ordenar_por='Total', crescente=False)
+assert len(pagina) == 2 and pagina['Total'][0] == formatar_moeda(float(np.max(lote['total_complementacoes'])))
+assert tabela.n_paginas(2) == (len(lote['municipio']) + 1) // 2
+assert len(tabela.pagina(99, 2)) == len(lote['municipio']) - 2 * (tabela.n_paginas(2) - 1)
+print("✅ Formatação em coluna e tabela paginada")
+
+# Gráficos agregados no servidor (tamanho independente do número de municípios)
+import graficos
+
+por_uf = graficos.agregar_por_uf(lote)
+assert abs(por_uf['Total'].sum() - float(np.sum(lote['total_complementacoes']))) < 1e-6
+assert por_uf['Municípios'].sum() == len(lote['municipio'])
+extremos = graficos.maiores_e_menores(lote, 'vaat', k=2)
+maiores = extremos[extremos['Grupo'] == 'Maiores']['Por aluno']
+assert maiores.is_monotonic_decreasing and maiores.iloc[0] == graficos.por_aluno(lote, 'vaat').max()
+assert len(graficos.figura_dispersao(lote, max_pontos=2).data[0].x) == min(2, len(lote['municipio']))
+assert len(graficos.figura_por_municipio(lote, max_barras=3).data[0].x) == min(3, len(lote['municipio']))
+print("✅ Gráficos agregados e WebGL")
+
+# Cubo de agregação (UF × faixa de população × elegibilidade) com atualização incremental
+from calculadora import registros_lote
+from cubo import CuboAgregado
+
+cubo = CuboAgregado.de_lote(lote, municipios)
+geral = cubo.consultar(por=())
+assert geral['Municípios'][0] == len(lote['municipio'])
+assert abs(geral['Total'][0] - float(np.sum(lote['total_complementacoes']))) < 1e-3
+elegiveis = cubo.consultar(por=('regiao',), elegivel_vaat=True)
+assert abs(elegiveis['VAAT'].sum() - float(np.sum(lote['vaat']['valor_total']))) < 1e-3
+assert elegiveis['Municípios'].sum() == int(np.sum(lote['vaat']['elegivel']))
+assert list(cubo.consultar(por=('uf',), uf=lote['uf'][0])['uf']) == [lote['uf'][0]]
+
+dobro = dict(municipios[0], matriculas={e: 2 * v for e, v in municipios[0]['matriculas'].items()})
+resultado_dobro = calc.calcular_ambas_complementacoes(dobro, calc.totais_com_delta(municipios[0], dobro))
+simulado = cubo.simulado(0, resultado_dobro)
+assert abs(
+    simulado.consultar(por=())['Total'][0] - geral['Total'][0]
+    - (resultado_dobro['total_complementacoes'] - lote['total_complementacoes'][0])
+) < 1e-3
+assert cubo.consultar(por=())['Total'][0] == geral['Total'][0]
+simulado.atualizar(0, next(registros_lote(lote)))
+assert abs(simulado.consultar(por=())['Total'][0] - geral['Total'][0]) < 1e-3
+print("✅ Cubo de agregação com filtros e simulação incremental")
+
+# Sensibilidade em forma fechada: valor de matrículas extras por etapa
+from base_municipios import ETAPAS
+
+sensibilidade = calc.calcular_sensibilidade(municipios, matriculas_extras=10)
+atual = calc.calcular_ambas_complementacoes(municipios[0])
+for j, etapa in enumerate(ETAPAS):
+    extra = dict(municipios[0], matriculas=dict(municipios[0]['matriculas']))
+    extra['matriculas'][etapa] = extra['matriculas'].get(etapa, 0) + 10
+    novo = calc.calcular_ambas_complementacoes(extra, calc.totais_com_delta(municipios[0], extra))
+    for tipo in ('vaat', 'vaaf'):
+        esperado = (novo[tipo]['valor_total'] - atual[tipo]['valor_total']) / 10
+        assert abs(sensibilidade[tipo]['valor_por_matricula'][0, j] - esperado) < 1e-6 * max(1, abs(esperado))
+assert np.allclose(
+    sensibilidade['valor_por_matricula_total'],
+    sensibilidade['vaat']['valor_por_matricula'] + sensibilidade['vaaf']['valor_por_matricula']
+)
+# Limite k → 0: B·c·(D − A)/D² para elegíveis
+infinitesimal = calc.calcular_sensibilidade(municipios, matriculas_extras=1e-6)
+if lote['vaat']['elegivel'][0]:
+    c_etapa = (calc.vetores_ponderadores['vaat'][0] * calc.calcular_fator_nse(municipios[0]['nse'])
+               * municipios[0]['drec'])
+    D, A = calc.totais_nacionais['vaat'], lote['vaat']['total_ajustado'][0]
+    derivada = calc._orcamento('vaat') * c_etapa * (D - A) / D ** 2
+    assert abs(infinitesimal['vaat']['valor_por_matricula'][0, 0] - derivada) < 1e-3 * derivada
+print("✅ Sensibilidade por etapa em forma fechada")
+
+# Metas: menor número de matrículas extras para um valor e distância da elegibilidade
+def valor_com_extras(municipio, etapa, k, tipo):
+    extra = dict(municipio, matriculas=dict(municipio['matriculas']))
+    extra['matriculas'][etapa] = extra['matriculas'].get(etapa, 0) + int(k)
+    r = calc.calcular_ambas_complementacoes(extra, calc.totais_com_delta(municipio, extra))
+    return r['total_complementacoes'] if tipo == 'total' else r[tipo]['valor_total']
+
+for tipo in ('vaat', 'total'):
+    atual = calc.resolver_matriculas(municipios, 'creche_integral', 0, tipo)['valor_atual']
+    metas = calc.resolver_matriculas(municipios, 'creche_integral', atual * 1.05 + 1, tipo)
+    for i, municipio in enumerate(municipios):
+        k = metas['matriculas_extras'][i]
+        if k < 0:
+            continue
+        assert valor_com_extras(municipio, 'creche_integral', k, tipo) >= atual[i] * 1.05 + 1 - 1e-6
+        assert k == 0 or valor_com_extras(municipio, 'creche_integral', k - 1, tipo) < atual[i] * 1.05 + 1
+    assert (metas['matriculas_extras'][atual > 0] > 0).all()
+
+distancia = calc.distancia_elegibilidade(municipios, 'vaat')
+assert (distancia['elegivel'] == lote['vaat']['elegivel']).all()
+assert (distancia['matriculas_extras'][distancia['elegivel']] == 0).all()
+assert ((distancia['diferenca_valor_aluno'] < 0) == distancia['elegivel']).all()
+for tipo in ('vaat', 'vaaf'):
+    distancia = calc.distancia_elegibilidade(municipios, tipo)
+    for i in np.flatnonzero(distancia['matriculas_extras'][:, 0] > 0):
+        k = distancia['matriculas_extras'][i, 0]
+        for extras, esperado in ((k, True), (k - 1, False)):
+            extra = dict(municipios[i], matriculas=dict(municipios[i]['matriculas']))
+            extra['matriculas']['creche_integral'] = extra['matriculas'].get('creche_integral', 0) + int(extras)
+            r = calc.calcular_ambas_complementacoes(extra, calc.totais_com_delta(municipios[i], extra))
+            assert r[tipo]['elegivel'] == esperado
+print("✅ Metas de matrículas e distância da elegibilidade")